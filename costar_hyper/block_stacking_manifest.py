@@ -0,0 +1,194 @@
+'''
+Manifest of the example files in a CoSTAR Block Stacking Dataset directory.
+
+Opening every h5f file just to count its frames takes a long time on the full
+dataset, so scan_directory() does it once in a pool of processes and writes the
+results to a csv file in the same directory:
+
+    costar_block_stacking_manifest.csv
+    filename, status, frame_count, goal_count, file_size, mtime, checksum
+
+Later scans only open files that are new or whose size or modification time
+changed, and the manifest is saved periodically while scanning, so an
+interrupted scan picks up where it stopped. frame_count is -1 for files which
+could not be read or have no images.
+
+Apache License 2.0 https://www.apache.org/licenses/LICENSE-2.0
+'''
+import csv
+import hashlib
+import os
+from multiprocessing import Pool
+
+import h5py
+
+# Progress bars using https://github.com/tqdm/tqdm
+# Import tqdm without enforcing it as a dependency
+try:
+    from tqdm import tqdm
+except ImportError:
+
+    def tqdm(*args, **kwargs):
+        if args:
+            return args[0]
+        return kwargs.get('iterable', None)
+
+
+MANIFEST_FILENAME = 'costar_block_stacking_manifest.csv'
+MANIFEST_FIELDS = ['filename', 'status', 'frame_count', 'goal_count', 'file_size', 'mtime', 'checksum']
+_INT_FIELDS = ['frame_count', 'goal_count', 'file_size']
+
+
+def example_status(filename):
+    ''' Get the status of an example from its filename: 'error.failure', 'failure', 'success' or None.
+    '''
+    if 'error' in filename:
+        return 'error.failure'
+    elif 'failure' in filename:
+        return 'failure'
+    elif 'success' in filename:
+        return 'success'
+    return None
+
+
+def file_checksum(file_path, block_size=1 << 20):
+    ''' md5 hex digest of the contents of a file.
+    '''
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def scan_file(args):
+    ''' Read the manifest row of a single example file.
+
+    :param args: A tuple (path, filename, checksum), checksum is a bool
+                 indicating whether the md5 of the file should be computed.
+    :return: A dictionary with the MANIFEST_FIELDS of the file.
+    '''
+    path, filename, checksum = args
+    file_path = os.path.join(path, filename)
+    stat = os.stat(file_path)
+    row = {'filename': filename,
+           'status': example_status(filename),
+           'frame_count': -1,
+           'goal_count': 0,
+           'file_size': stat.st_size,
+           'mtime': repr(stat.st_mtime),
+           'checksum': ''}
+    try:
+        with h5py.File(file_path, 'r') as data:
+            if 'image' in data:
+                row['frame_count'] = len(data['image'])
+            if 'gripper_action_goal_idx' in data:
+                row['goal_count'] = len(data['gripper_action_goal_idx'])
+    except IOError:
+        pass
+    if checksum:
+        row['checksum'] = file_checksum(file_path)
+    return row
+
+
+def is_up_to_date(row, file_path):
+    ''' Check if a manifest row still matches the size and modification time of the file.
+    '''
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return False
+    return row['file_size'] == stat.st_size and row['mtime'] == repr(stat.st_mtime)
+
+
+def read_manifest(path):
+    ''' Read the manifest of a directory.
+
+    :param path: The directory containing the manifest.
+    :return: A dictionary from filename to manifest row, empty if there is no manifest.
+    '''
+    manifest_path = os.path.join(path, MANIFEST_FILENAME)
+    if not os.path.isfile(manifest_path):
+        return {}
+    rows = {}
+    with open(manifest_path, 'r') as f:
+        for row in csv.DictReader(f):
+            for field in _INT_FIELDS:
+                row[field] = int(row[field])
+            rows[row['filename']] = row
+    return rows
+
+
+def write_manifest(path, rows):
+    ''' Write the manifest of a directory, replacing any existing manifest atomically.
+
+    :param path: The directory to write the manifest in.
+    :param rows: A dictionary from filename to manifest row.
+    :return manifest_path: The path to the manifest file.
+    '''
+    manifest_path = os.path.join(path, MANIFEST_FILENAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        for filename in sorted(rows):
+            writer.writerow(rows[filename])
+    os.rename(tmp_path, manifest_path)
+    return manifest_path
+
+
+def scan_directory(path, filenames=None, processes=None, checksum=True, write=True, save_every=500):
+    ''' Get the manifest rows of the example files in a directory, scanning only new or changed files.
+
+    :param path: The directory containing the .h5f files.
+    :param filenames: The filenames in path to scan, defaults to all .h5f files in path.
+    :param processes: The number of processes to scan with, defaults to the number of cpus.
+    :param checksum: Compute the md5 checksum of the scanned files.
+    :param write: Save the updated manifest in path.
+    :param save_every: Save the manifest each time this many files have been scanned,
+                       so an interrupted scan can be resumed.
+    :return: A dictionary from filename to manifest row for every file in filenames.
+    '''
+    path = os.path.expanduser(path)
+    if filenames is None:
+        filenames = [filename for filename in os.listdir(path) if '.h5f' in filename]
+    rows = read_manifest(path)
+    to_scan = [filename for filename in filenames
+               if filename not in rows or not is_up_to_date(rows[filename], os.path.join(path, filename))]
+    print("Manifest for {}: {} of {} files are new or changed and will be scanned.".format(
+          path, len(to_scan), len(filenames)))
+    if to_scan:
+        pool = Pool(processes)
+        try:
+            jobs = [(path, filename, checksum) for filename in to_scan]
+            for i, row in enumerate(tqdm(pool.imap_unordered(scan_file, jobs), total=len(jobs))):
+                rows[row['filename']] = row
+                if write and (i + 1) % save_every == 0:
+                    write_manifest(path, rows)
+        finally:
+            pool.close()
+            pool.join()
+        if write:
+            write_manifest(path, rows)
+    return {filename: rows[filename] for filename in filenames}
+
+
+def load_manifest_rows(file_paths):
+    ''' Look up a list of example file paths in the manifests of their directories.
+
+    Files that are not in a manifest, or have changed since they were scanned, are left out.
+
+    :param file_paths: A list of paths to .h5f files, which may be in different directories.
+    :return: A dictionary from file path to manifest row.
+    '''
+    manifests = {}
+    found = {}
+    for file_path in file_paths:
+        expanded_path = os.path.expanduser(file_path)
+        path, filename = os.path.split(expanded_path)
+        if path not in manifests:
+            manifests[path] = read_manifest(path)
+        row = manifests[path].get(filename)
+        if row is not None and is_up_to_date(row, expanded_path):
+            found[file_path] = row
+    return found
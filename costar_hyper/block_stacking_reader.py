@@ -3,10 +3,14 @@ import h5py
 import os
 import io
 import sys
+import copy
 import glob
+import threading
 import traceback
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+from timeit import default_timer
 from PIL import Image
-from skimage.transform import resize
 
 import numpy as np
 from numpy.random import RandomState
@@ -16,6 +20,7 @@ from keras.utils import Sequence
 from keras.utils import OrderedEnqueuer
 import tensorflow as tf
 import hypertree_pose_metrics
+import block_stacking_manifest
 import keras_applications
 import keras_preprocessing
 
@@ -92,14 +97,25 @@ def concat_images_with_tiled_vector_np(images, vector):
     """
     if not isinstance(images, list):
         images = [images]
+    vector = np.asarray(vector)
     image_shape = np.shape(images[0])
-    tiled_vector = tile_vector_as_image_channels_np(vector, image_shape)
-    images.append(tiled_vector)
-    combined = np.concatenate(images, axis=-1)
+    channels = [np.shape(image)[-1] for image in images] + [vector.shape[-1]]
+    # write everything into one output array, broadcasting the vector
+    # to every pixel instead of tiling it into a temporary image first
+    combined = np.empty(tuple(image_shape[:-1]) + (sum(channels),),
+                        dtype=np.result_type(vector, *images))
+    start = 0
+    for image, count in zip(images + [vector[:, np.newaxis, np.newaxis, :]], channels):
+        combined[..., start:start + count] = image
+        start += count
 
     return combined
 
 
+# unit meshgrids by (height, width), they never change so only compute them once
+_unit_meshgrid_cache = {}
+
+
 def concat_unit_meshgrid_np(tensor):
     """ Concat unit meshgrid onto the tensor.
 
@@ -110,22 +126,24 @@ def concat_unit_meshgrid_np(tensor):
     # print('tensor shape: ' + str(tensor.shape))
     y_size = tensor.shape[1]
     x_size = tensor.shape[2]
-    max_value = max(x_size, y_size)
-    y, x = np.meshgrid(np.arange(y_size),
-                       np.arange(x_size),
-                       indexing='ij')
-    assert y.size == x.size and y.size == tensor.shape[1] * tensor.shape[2]
-    # print('x shape: ' + str(x.shape) + ' y shape: ' + str(y.shape))
-    # rescale data and reshape to have the same dimension as the tensor
-    y = np.reshape(y / max_value, [1, y.shape[0], y.shape[1], 1])
-    x = np.reshape(x / max_value, [1, x.shape[0], x.shape[1], 1])
-
-    # need to have a meshgrid for each example in the batch,
-    # so tile along batch axis
-    tile_dimensions = [tensor.shape[0], 1, 1, 1]
-    y = np.tile(y, tile_dimensions)
-    x = np.tile(x, tile_dimensions)
-    combined = np.concatenate([tensor, y, x], axis=-1)
+    yx = _unit_meshgrid_cache.get((y_size, x_size))
+    if yx is None:
+        max_value = max(x_size, y_size)
+        y, x = np.meshgrid(np.arange(y_size),
+                           np.arange(x_size),
+                           indexing='ij')
+        assert y.size == x.size and y.size == tensor.shape[1] * tensor.shape[2]
+        # print('x shape: ' + str(x.shape) + ' y shape: ' + str(y.shape))
+        # rescale data to have the same dimension as the tensor
+        yx = np.stack([y / max_value, x / max_value], axis=-1)
+        _unit_meshgrid_cache[(y_size, x_size)] = yx
+
+    # the meshgrid is the same for each example in the batch,
+    # so broadcast it along the batch axis
+    channels = tensor.shape[-1]
+    combined = np.empty(tensor.shape[:-1] + (channels + 2,), dtype=np.result_type(tensor, yx))
+    combined[..., :channels] = tensor
+    combined[..., channels:] = yx
     return combined
 
 
@@ -167,6 +185,76 @@ def blend_image_sequence(images, alpha=0.5, verbose=0):
     return blended_image
 
 
+def decode_image(raw, output_shape=None, out=None):
+    """ Decode a binary jpeg or png image to a uint8 HWC numpy array.
+
+    When output_shape is given, jpeg images are decoded in PIL draft mode,
+    which uses DCT scaling to decode directly at the smallest power of 2 reduction
+    that is still at least output_shape, then the remaining bilinear resize is done
+    on uint8 data by PIL, so no full size or floating point copy is ever made.
+
+    # Arguments
+
+    raw: the encoded image bytes.
+    output_shape: None to keep the stored size, or (height, width) or (height, width, channels).
+    out: optional preallocated uint8 array with the output shape to write the image into.
+
+    # Returns
+
+    The uint8 image, which is out if it was provided.
+    """
+    image = Image.open(io.BytesIO(raw))
+    if output_shape is not None:
+        size = (output_shape[1], output_shape[0])
+        image.draft('RGB', size)
+        image = image.convert('RGB')
+        if image.size != size:
+            image = image.resize(size, Image.BILINEAR)
+    else:
+        image = image.convert('RGB')
+    if out is None:
+        return np.asarray(image, dtype=np.uint8)
+    out[...] = np.asarray(image, dtype=np.uint8)
+    return out
+
+
+def decode_image_batch(raw_images, output_shape=None, pool=None):
+    """ Decode a list of binary jpeg or png images into one preallocated NHWC uint8 array.
+
+    # Arguments
+
+    raw_images: a list of encoded image bytes, all of which must decode to the same size
+        if output_shape is None.
+    output_shape: see decode_image().
+    pool: an optional multiprocessing.pool.ThreadPool used to decode the images in parallel.
+        PIL releases the GIL while decoding, so threads give a real speedup here.
+
+    # Returns
+
+    A uint8 numpy array of shape [len(raw_images), height, width, 3].
+    """
+    if output_shape is None:
+        first = decode_image(raw_images[0])
+        height, width = first.shape[:2]
+    else:
+        first = None
+        height, width = output_shape[:2]
+    images = np.empty((len(raw_images), height, width, 3), dtype=np.uint8)
+    if first is not None:
+        images[0] = first
+
+    def decode(i):
+        decode_image(raw_images[i], output_shape, out=images[i])
+
+    indices = range(0 if first is None else 1, len(raw_images))
+    if pool is None:
+        for i in indices:
+            decode(i)
+    else:
+        pool.map(decode, indices)
+    return images
+
+
 def get_past_goal_indices(current_robot_time_index, goal_indices, filename='', verbose=0):
     """ get past goal image indices, including the initial image
 
@@ -204,24 +292,32 @@ def get_past_goal_indices(current_robot_time_index, goal_indices, filename='', v
     return image_indices
 
 
-def encode_label(label_features_to_extract, y, action_successes=None, random_augmentation=None, current_stacking_reward=None):
+def encode_label(label_features_to_extract, y, action_successes=None, random_augmentation=None, current_stacking_reward=None,
+                 encoded_y=None):
     """ Encode a label based on the features that need to be extracted from the pose y.
 
     y: list of poses in [[x, y, z, qx, qy, qz, qw]] format
     action_successes: list of labels with successful actions
+    encoded_y: optional y already encoded with batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(), such as from
+        load_encoding_cache(), which is used instead of encoding y. Only valid if random_augmentation is None.
     """
+    def encode_y():
+        if encoded_y is not None:
+            return np.array(encoded_y)
+        return hypertree_pose_metrics.batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(y, random_augmentation=random_augmentation)
+
     # determine the label
     if label_features_to_extract is None or 'grasp_goal_xyz_3' in label_features_to_extract:
         # regression to translation case, see semantic_translation_regression in hypertree_train.py
-        y = hypertree_pose_metrics.batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(y, random_augmentation=random_augmentation)
+        y = encode_y()
         y = y[:, :3]
     elif label_features_to_extract is None or 'grasp_goal_aaxyz_nsc_5' in label_features_to_extract:
         # regression to rotation case, see semantic_rotation_regression in hypertree_train.py
-        y = hypertree_pose_metrics.batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(y, random_augmentation=random_augmentation)
+        y = encode_y()
         y = y[:, 3:]
     elif label_features_to_extract is None or 'grasp_goal_xyz_aaxyz_nsc_8' in label_features_to_extract:
         # default, regression label case
-        y = hypertree_pose_metrics.batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(y, random_augmentation=random_augmentation)
+        y = encode_y()
     elif 'grasp_success' in label_features_to_extract or 'action_success' in label_features_to_extract:
         if action_successes is None:
             raise ValueError(
@@ -275,6 +371,14 @@ def encode_action(
     return action
 
 
+def preprocess_images(images):
+    """ Scale a batch of rgb images with values in the range [0, 255] to the float32 network input range [-1, 1].
+    """
+    return keras_applications.imagenet_utils._preprocess_numpy_input(
+        np.array(images, dtype=np.float32),
+        data_format='channels_last', mode='tf')
+
+
 def encode_action_and_images(
         data_features_to_extract,
         poses,
@@ -284,7 +388,9 @@ def encode_action_and_images(
         y=None,
         random_augmentation=None,
         encoded_goal_pose=None,
-        epsilon=1e-3):
+        epsilon=1e-3,
+        encoded_poses=None,
+        images_preprocessed=False):
     """ Given an action and images, return the combined input object performing prediction with keras.
 
     data_features_to_extract: A string identifier for the encoding to use for the actions and images.
@@ -300,24 +406,33 @@ def encode_action_and_images(
         it will modify the poses with a small amount of translation and rotation
         with the probablity specified by the provided floating point number.
     encoded_goal_pose: A pre-encoded goal pose for use in actor/critic classification of proposals.
+    encoded_poses: optional poses already encoded with batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(), such as from
+        load_encoding_cache(), which are used instead of encoding poses. Only valid if random_augmentation is None.
+    images_preprocessed: True if init_images and current_images were already passed through preprocess_images(),
+        so images can be prepared as soon as they arrive, before the rest of the input is available.
     """
 
     action_labels = np.array(action_labels)
-    init_images = keras_applications.imagenet_utils._preprocess_numpy_input(
-        np.array(init_images, dtype=np.float32),
-        data_format='channels_last', mode='tf')
-    current_images = keras_applications.imagenet_utils._preprocess_numpy_input(
-        np.array(current_images, dtype=np.float32),
-        data_format='channels_last', mode='tf')
+    if images_preprocessed:
+        init_images = np.asarray(init_images, dtype=np.float32)
+        current_images = np.asarray(current_images, dtype=np.float32)
+    else:
+        init_images = preprocess_images(init_images)
+        current_images = preprocess_images(current_images)
     poses = np.array(poses)
 
     # print('poses shape: ' + str(poses.shape))
-    encoded_poses = hypertree_pose_metrics.batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(
-        poses, random_augmentation=random_augmentation)
-    if data_features_to_extract is None or 'image_0_image_n_vec_0_vec_n_xyz_aaxyz_nsc_nxygrid_25':
-        # TODO(ahundt) This should actually encode two poses like the commented encoded_poses line below because it is for grasp proposal success/failure classification. First need to double check all code that uses it in enas and costar_plan
-        encoded_goal_pose = hypertree_pose_metrics.batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(
+    if encoded_poses is None:
+        encoded_poses = hypertree_pose_metrics.batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(
             poses, random_augmentation=random_augmentation)
+        if data_features_to_extract is None or 'image_0_image_n_vec_0_vec_n_xyz_aaxyz_nsc_nxygrid_25':
+            # TODO(ahundt) This should actually encode two poses like the commented encoded_poses line below because it is for grasp proposal success/failure classification. First need to double check all code that uses it in enas and costar_plan
+            encoded_goal_pose = hypertree_pose_metrics.batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(
+                poses, random_augmentation=random_augmentation)
+    else:
+        encoded_poses = np.array(encoded_poses)
+        # without random augmentation this is the same as encoding the poses a second time above
+        encoded_goal_pose = encoded_poses
         # encoded_poses = np.array([encoded_poses, encoded_goal_pose])
 
     if np.any(encoded_poses < 0 - epsilon) or np.any(encoded_poses > 1 + epsilon):
@@ -370,20 +485,239 @@ def encode_action_and_images(
     return X
 
 
-def inference_mode_gen(file_names):
+def inference_mode_gen(file_names, manifest_rows=None):
     """ Generate data for all time steps in a single example.
+
+    manifest_rows: optional dictionary from file name to block_stacking_manifest row,
+        the goal counts are read from it instead of opening the files when available.
     """
+    if manifest_rows is None:
+        manifest_rows = {}
     file_list_updated = []
     # print(len(file_names))
     for f_name in file_names:
-        with h5py.File(f_name, 'r') as data:
-            file_len = len(data['gripper_action_goal_idx']) - 1
-            # print(file_len)
-            list_id = [f_name] * file_len
+        row = manifest_rows.get(f_name)
+        if row is not None and row['goal_count'] > 0:
+            file_len = row['goal_count'] - 1
+        else:
+            with h5py.File(f_name, 'r') as data:
+                file_len = len(data['gripper_action_goal_idx']) - 1
+        # print(file_len)
+        list_id = [f_name] * file_len
         file_list_updated = file_list_updated + list_id
     return file_list_updated
 
 
+# Version of the precomputed encoding files, increment when the encoding changes.
+ENCODING_CACHE_VERSION = 1
+# Columns of the precomputed encoding array, one row per frame:
+# 'pose' is the encoded current pose, 'goal_pose' the encoded pose at the goal frame
+# gripper_action_goal_idx[t], which is the regression label, or nan if the goal frame is missing.
+ENCODING_CACHE_COLUMNS = {'pose': slice(0, 8), 'goal_pose': slice(8, 16)}
+
+
+def encoding_cache_filenames(example_filename, pose_name='pose_gripper_center'):
+    """ Get the side-car (array, metadata) filenames where the encodings of an example are precomputed.
+    """
+    base = example_filename + '.' + pose_name + '.encoding'
+    return base + '.npy', base + '.json'
+
+
+def _encoding_cache_metadata(example_filename, pose_name, num_frames):
+    stat = os.stat(example_filename)
+    return {'version': ENCODING_CACHE_VERSION, 'pose_name': pose_name, 'num_frames': int(num_frames),
+            'source_size': stat.st_size, 'source_mtime': stat.st_mtime}
+
+
+def write_encoding_cache(example_filename, pose_name='pose_gripper_center', data=None):
+    """ Precompute the pose encodings of every frame in an example file and write them next to it.
+
+    The encodings are the same batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc() values
+    CostarBlockStackingSequence computes when there is no random augmentation,
+    see ENCODING_CACHE_COLUMNS for the layout. The values do not depend on the
+    feature combo, they are sliced and combined for each combo at load time.
+
+    # Arguments
+
+    example_filename: path to the hdf5 example file.
+    pose_name: the pose to encode, see CostarBlockStackingSequence.
+    data: optional, an already open h5py file for example_filename.
+
+    # Returns
+
+    The filename of the precomputed encoding array.
+    """
+    if data is None:
+        with h5py.File(example_filename, 'r') as data:
+            return write_encoding_cache(example_filename, pose_name, data)
+    poses = np.array(data[pose_name])
+    goal_ids = np.array(data['gripper_action_goal_idx'])
+    encodings = np.full((len(poses), 16), np.nan)
+    encodings[:, ENCODING_CACHE_COLUMNS['pose']] = hypertree_pose_metrics.batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(poses)
+    valid = goal_ids < len(poses)
+    encodings[valid, ENCODING_CACHE_COLUMNS['goal_pose']] = encodings[goal_ids[valid], ENCODING_CACHE_COLUMNS['pose']]
+
+    array_filename, metadata_filename = encoding_cache_filenames(example_filename, pose_name)
+    # write then rename so a reader never sees a partially written file
+    tmp_filename = array_filename + '.tmp.npy'
+    np.save(tmp_filename, encodings)
+    os.rename(tmp_filename, array_filename)
+    with open(metadata_filename + '.tmp', 'w') as fp:
+        json.dump(_encoding_cache_metadata(example_filename, pose_name, len(poses)), fp)
+    os.rename(metadata_filename + '.tmp', metadata_filename)
+    return array_filename
+
+
+def load_encoding_cache(example_filename, pose_name='pose_gripper_center', num_frames=None):
+    """ Memory map the precomputed encodings of an example file, see write_encoding_cache().
+
+    # Returns
+
+    The read only memory mapped encodings, or None if they are missing or stale because
+    the example file, pose name, frame count, or encoding version changed.
+    """
+    array_filename, metadata_filename = encoding_cache_filenames(example_filename, pose_name)
+    try:
+        with open(metadata_filename, 'r') as fp:
+            metadata = json.load(fp)
+        if num_frames is None:
+            num_frames = metadata['num_frames']
+        if metadata != _encoding_cache_metadata(example_filename, pose_name, num_frames):
+            return None
+        encodings = np.load(array_filename, mmap_mode='r')
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+    if encodings.shape != (num_frames, 16):
+        return None
+    return encodings
+
+
+class BlockStackingExampleCache(object):
+    """ LRU pool of open hdf5 example files plus a small per-file index.
+
+    Opening an hdf5 file and reading the full label arrays costs far more than reading
+    the two jpeg blobs a single sample actually needs, so the handles are kept open
+    (up to max_open_files, least recently used is closed first) and the per-file index
+    of goal ids, poses, and action labels is read once and then served from memory.
+
+    The index is cleared with reset_index(), which CostarBlockStackingSequence calls
+    at the end of every epoch, so it is rebuilt once per epoch.
+    If use_encoding_cache is True the index also memory maps the precomputed
+    pose encodings of each file, see write_encoding_cache().
+    All access is serialized with a lock because keras reads batches from several threads,
+    and h5py holds a global lock for every read anyway.
+
+    # Arguments
+
+    pose_name: the pose key to cache, see CostarBlockStackingSequence.
+    max_open_files: the maximum number of hdf5 files to keep open at once.
+    use_encoding_cache: load precomputed pose encodings when they are available and up to date.
+    """
+    def __init__(self, pose_name='pose_gripper_center', max_open_files=64, use_encoding_cache=True):
+        self.pose_name = pose_name
+        self.max_open_files = max_open_files
+        self.use_encoding_cache = use_encoding_cache
+        self.lock = threading.RLock()
+        self.handles = OrderedDict()
+        self.index = {}
+        self.pid = os.getpid()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.handle_hits = 0
+        self.handle_misses = 0
+        self.index_hits = 0
+        self.index_misses = 0
+        self.batches = 0
+        self.read_time = 0.0
+        self.max_batch_read_time = 0.0
+
+    def reset_index(self):
+        """ Drop the cached per-file indices so they are read again on next access.
+        """
+        with self.lock:
+            self.index = {}
+
+    def _handle(self, filename):
+        if self.pid != os.getpid():
+            # handles inherited through fork() are not safe to use, open new ones
+            self.handles = OrderedDict()
+            self.pid = os.getpid()
+        data = self.handles.pop(filename, None)
+        if data is None:
+            self.handle_misses += 1
+            data = h5py.File(filename, 'r')
+            while len(self.handles) >= self.max_open_files:
+                _, oldest = self.handles.popitem(last=False)
+                oldest.close()
+        else:
+            self.handle_hits += 1
+        self.handles[filename] = data
+        return data
+
+    def example_index(self, filename):
+        """ Get the cached index for an example file.
+
+        # Returns
+
+        A dict with 'goal_ids', 'poses', and 'action_labels' numpy arrays,
+        each with one entry per frame in the file, and 'encodings' which is
+        the memory mapped result of load_encoding_cache() or None.
+        """
+        with self.lock:
+            index = self.index.get(filename)
+            if index is not None:
+                self.index_hits += 1
+                return index
+            self.index_misses += 1
+            data = self._handle(filename)
+            if 'gripper_action_goal_idx' not in data or 'gripper_action_label' not in data:
+                raise ValueError('block_stacking_reader.py: You need to run preprocessing before this will work! \n' +
+                                 '    python2 ctp_integration/scripts/view_convert_dataset.py --path ~/.keras/datasets/costar_block_stacking_dataset_v0.4 --preprocess_inplace gripper_action --write'
+                                 '\n File with error: ' + str(filename))
+            index = {
+                'goal_ids': np.array(data['gripper_action_goal_idx']),
+                'poses': np.array(data[self.pose_name]),
+                'action_labels': np.array(data['gripper_action_label'])}
+            index['encodings'] = None
+            if self.use_encoding_cache:
+                index['encodings'] = load_encoding_cache(filename, self.pose_name, len(index['goal_ids']))
+            self.index[filename] = index
+            return index
+
+    def read_images(self, filename, indices):
+        """ Read the encoded images at the specified frame indices of an example file.
+        """
+        with self.lock:
+            return list(self._handle(filename)['image'][indices])
+
+    def add_batch_read_time(self, seconds):
+        with self.lock:
+            self.batches += 1
+            self.read_time += seconds
+            self.max_batch_read_time = max(self.max_batch_read_time, seconds)
+
+    def stats(self):
+        """ Cache hit rates and per batch read latency in seconds since the last reset_stats().
+        """
+        with self.lock:
+            handle_total = max(self.handle_hits + self.handle_misses, 1)
+            index_total = max(self.index_hits + self.index_misses, 1)
+            return {
+                'handle_hit_rate': float(self.handle_hits) / handle_total,
+                'index_hit_rate': float(self.index_hits) / index_total,
+                'open_files': len(self.handles),
+                'batches': self.batches,
+                'mean_batch_read_time': self.read_time / max(self.batches, 1),
+                'max_batch_read_time': self.max_batch_read_time}
+
+    def close(self):
+        with self.lock:
+            for data in self.handles.values():
+                data.close()
+            self.handles = OrderedDict()
+
+
 class CostarBlockStackingSequence(Sequence):
     '''Generates a batch of data from the stacking dataset.
 
@@ -400,7 +734,10 @@ class CostarBlockStackingSequence(Sequence):
                  blend_previous_goal_images=False,
                  estimated_time_steps_per_example=250, verbose=0, inference_mode=False, one_hot_encoding=True,
                  pose_name='pose_gripper_center',
-                 force_random_training_pose_augmentation=None):
+                 force_random_training_pose_augmentation=None,
+                 max_open_files=64,
+                 decode_threads=4,
+                 use_encoding_cache=True):
         '''Initialization
 
         # Arguments
@@ -424,6 +761,9 @@ class CostarBlockStackingSequence(Sequence):
             so we simply sample in proportion to an estimated number of images per example.
             Due to random sampling, there is no guarantee that every image will be visited once!
             However, the images can be visited in a fixed order, particularly when is_training=False.
+            None uses the exact mean number of images per example from the
+            costar_block_stacking_manifest.csv files written by costar_block_stacking_split_dataset.py,
+            or 250 if some of the example files are missing from the manifests.
         one_hot_encoding flag triggers one hot encoding and thus numbers at the end of labels might not correspond to the actual size.
         force_random_training_pose_augmentation: override random_augmenation when training for pose data only.
         pose_name: Which pose to use as the robot 3D position in space. Options include:
@@ -431,6 +771,14 @@ class CostarBlockStackingSequence(Sequence):
                 of the robot, which is the base of the gripper wrist.
             'pose_gripper_center' is a point in between the robotiq C type gripping plates when the gripper is open
                 with the same orientation as pose.
+        max_open_files: The number of hdf5 example files to keep open at once, see BlockStackingExampleCache.
+            Cache hit rates and read times are printed at the end of each epoch when verbose > 0,
+            and are also available from get_cache_stats().
+        decode_threads: The number of threads used to decode and resize the images of each batch,
+            0 decodes in the calling thread.
+        use_encoding_cache: Use the pose encodings precomputed with write_encoding_cache() when they are up to date,
+            see costar_block_stacking_precompute_encodings.py. Encodings are still computed on the fly
+            for files without an up to date cache and when random pose augmentation is enabled.
 
         # Explanation of abbreviations:
 
@@ -448,6 +796,11 @@ class CostarBlockStackingSequence(Sequence):
         self.output_shape = output_shape
         self.is_training = is_training
         self.verbose = verbose
+        self.example_cache = BlockStackingExampleCache(
+            pose_name=pose_name, max_open_files=max_open_files, use_encoding_cache=use_encoding_cache)
+        self.decode_threads = decode_threads
+        self._decode_pool = None
+        self._decode_pool_pid = None
         self.on_epoch_end()
         if isinstance(label_features_to_extract, str):
             label_features_to_extract = [label_features_to_extract]
@@ -473,9 +826,20 @@ class CostarBlockStackingSequence(Sequence):
                 self.random_encoding_augmentation = force_random_training_pose_augmentation
 
         self.blend = blend_previous_goal_images
+        self.manifest_rows = block_stacking_manifest.load_manifest_rows(self.list_example_filenames)
+        if estimated_time_steps_per_example is None:
+            total_time_steps = self.get_total_time_steps()
+            if total_time_steps is None:
+                estimated_time_steps_per_example = 250
+                if self.verbose > 0:
+                    print('CostarBlockStackingSequence: some example files are not in a manifest, '
+                          'estimating ' + str(estimated_time_steps_per_example) + ' time steps per example.')
+            else:
+                estimated_time_steps_per_example = int(np.ceil(
+                    float(total_time_steps) / max(len(self.list_example_filenames), 1)))
         self.estimated_time_steps_per_example = estimated_time_steps_per_example
         if self.inference_mode is True:
-            self.list_example_filenames = inference_mode_gen(self.list_example_filenames)
+            self.list_example_filenames = inference_mode_gen(self.list_example_filenames, self.manifest_rows)
         # if crop_shape is None:
         #     # height width 3
         #     crop_shape = (224, 224, 3)
@@ -508,9 +872,61 @@ class CostarBlockStackingSequence(Sequence):
         """
         return self.estimated_time_steps_per_example
 
+    def get_total_time_steps(self):
+        """ Get the exact total number of images in all of the examples from the dataset manifests.
+
+        Returns None if some of the example files are not in an up to date manifest,
+        see block_stacking_manifest.scan_directory().
+        """
+        filenames = set(self.list_example_filenames)
+        if any(filename not in self.manifest_rows for filename in filenames):
+            return None
+        return sum(max(self.manifest_rows[filename]['frame_count'], 0) for filename in filenames)
+
+    def _get_decode_pool(self):
+        """ Get the thread pool for image decoding, created on first use in each process.
+        """
+        if self.decode_threads < 1:
+            return None
+        if self._decode_pool is None or self._decode_pool_pid != os.getpid():
+            self._decode_pool = ThreadPool(self.decode_threads)
+            self._decode_pool_pid = os.getpid()
+        return self._decode_pool
+
+    def shard(self, index, count):
+        """ Get a copy of this sequence which only visits every count-th example starting at index.
+
+        Used to split the work between processes, see SequenceProcessLoader.
+        The copy has its own file cache and its own random state, seeded with seed + index,
+        so each shard is reproducible on its own.
+        """
+        sequence = copy.copy(self)
+        sequence.list_example_filenames = self.list_example_filenames[index::count]
+        if self.seed is not None:
+            sequence.seed = self.seed + index
+            sequence.random_state = RandomState(sequence.seed)
+        else:
+            sequence.random_state = RandomState()
+        sequence.example_cache = BlockStackingExampleCache(
+            pose_name=self.pose_name, max_open_files=self.example_cache.max_open_files,
+            use_encoding_cache=self.example_cache.use_encoding_cache)
+        sequence._decode_pool = None
+        sequence._decode_pool_pid = None
+        sequence.on_epoch_end()
+        return sequence
+
+    def get_cache_stats(self):
+        """ Get the example file cache hit rates and per batch read latency for the current epoch.
+        """
+        return self.example_cache.stats()
+
     def on_epoch_end(self):
         """ Updates indexes after each epoch
         """
+        if self.verbose > 0 and self.example_cache.batches > 0:
+            print('CostarBlockStackingSequence example cache stats: ' + str(self.example_cache.stats()))
+        self.example_cache.reset_stats()
+        self.example_cache.reset_index()
         if self.seed is not None and not self.is_training:
             # repeat the same order if we're validating or testing
             # continue the large random sequence for training
@@ -519,6 +935,48 @@ class CostarBlockStackingSequence(Sequence):
         if self.shuffle is True:
             self.random_state.shuffle(self.indexes)
 
+    def decode_batch_images(self, raw_images, images_per_example):
+        """ Decode, resize, and augment the images of a whole batch at once.
+
+        # Arguments
+
+        raw_images: a flat list of the encoded images of every example in the batch.
+        images_per_example: the number of images each example contributed to raw_images,
+            2 unless blend_previous_goal_images is enabled.
+
+        # Returns
+
+        init_images, current_images as uint8 arrays of shape [batch_size, height, width, 3].
+        """
+        if not raw_images:
+            return np.zeros((0, 0, 0, 3), dtype=np.uint8), np.zeros((0, 0, 0, 3), dtype=np.uint8)
+        decoded = decode_image_batch(raw_images, self.output_shape, pool=self._get_decode_pool())
+        if self.blend:
+            images = np.empty((len(images_per_example), 2) + decoded.shape[1:], dtype=np.uint8)
+            start = 0
+            for i, count in enumerate(images_per_example):
+                example_images = decoded[start:start + count]
+                start += count
+                blended_image = blend_image_sequence(example_images)
+                images[i] = example_images[0], blended_image
+        else:
+            images = decoded.reshape((len(images_per_example), 2) + decoded.shape[1:])
+
+        if self.is_training and self.random_augmentation is not None:
+            # augment in place, in the same order as the images were read
+            for image in images.reshape((-1,) + images.shape[2:]):
+                if self.random_shift and np.random.random() > self.random_augmentation:
+                    # apply random shift to the images
+                    image[...] = keras_preprocessing.image.random_shift(
+                        image,
+                        # height, width
+                        1./(48. * 2.), 1./(64. * 2.),
+                        row_axis=0, col_axis=1, channel_axis=2)
+                if self.random_augmentation:
+                    # do some image augmentation with random erasing & cutout
+                    random_eraser(image)
+        return images[:, 0], images[:, 1]
+
     def __data_generation(self, list_Ids, images_index):
         """ Generates data containing batch_size samples
 
@@ -527,44 +985,19 @@ class CostarBlockStackingSequence(Sequence):
         list_Ids: a list of file paths to be read
         """
 
-        def JpegToNumpy(jpeg):
-            stream = io.BytesIO(jpeg)
-            im = np.asarray(Image.open(stream))
-            try:
-                return im.astype(np.uint8)
-            except(TypeError) as exception:
-                print("Failed to convert PIL image type", exception)
-                print("type ", type(im), "len ", len(im))
-
-        def ConvertImageListToNumpy(data, format='numpy', data_format='NHWC'):
-            """ Convert a list of binary jpeg or png files to numpy format.
-
-            # Arguments
-
-            data: a list of binary jpeg images to convert
-            format: default 'numpy' returns a 4d numpy array,
-                'list' returns a list of 3d numpy arrays
-            """
-            length = len(data)
-            imgs = []
-            for raw in data:
-                img = JpegToNumpy(raw)
-                if data_format == 'NCHW':
-                    img = np.transpose(img, [2, 0, 1])
-                imgs.append(img)
-            if format == 'numpy':
-                imgs = np.array(imgs)
-            return imgs
         try:
             # Initialization
             if self.verbose > 0:
                 print("generating batch: " + str(list_Ids))
             X = []
-            init_images = []
-            current_images = []
+            raw_images = []
+            images_per_example = []
             poses = []
             goal_pose = []
             y = []
+            # pose encodings from the precomputed cache, only used if every example in the batch has them
+            cached_poses = []
+            cached_labels = []
             action_labels = []
             action_successes = []
             example_filename = ''
@@ -573,6 +1006,7 @@ class CostarBlockStackingSequence(Sequence):
                 # make it a list so we can iterate
                 list_Ids = [list_Ids]
 
+            read_time = 0.0
             # Generate data
             for i, example_filename in enumerate(list_Ids):
                 example_filename = os.path.expanduser(example_filename)
@@ -584,153 +1018,131 @@ class CostarBlockStackingSequence(Sequence):
                 try:
                     if not os.path.isfile(example_filename):
                         raise ValueError('CostarBlockStackingSequence: Trying to open something which is not a file: ' + str(example_filename))
-                    with h5py.File(example_filename, 'r') as data:
-                        if 'gripper_action_goal_idx' not in data or 'gripper_action_label' not in data:
-                            raise ValueError('block_stacking_reader.py: You need to run preprocessing before this will work! \n' +
-                                             '    python2 ctp_integration/scripts/view_convert_dataset.py --path ~/.keras/datasets/costar_block_stacking_dataset_v0.4 --preprocess_inplace gripper_action --write'
-                                             '\n File with error: ' + str(example_filename))
-                        # indices = [0]
-                        # len of goal indexes is the same as the number of images, so this saves loading all the images
-                        all_goal_ids = np.array(data['gripper_action_goal_idx'])
-                        if('stacking_reward' in self.label_features_to_extract):
-                            # TODO(ahundt) move this check out of the stacking reward case after files have been updated
-                            if all_goal_ids[-1] > len(all_goal_ids):
-                                raise ValueError(' File contains goal id greater than total number of frames ' + str(example_filename))
-                        if len(all_goal_ids) < 2:
-                            print('block_stacking_reader.py: ' + str(len(all_goal_ids)) + ' goal indices in this file, skipping: ' + example_filename)
-                        if 'success' in example_filename:
-                            label_constant = 1
-                        else:
-                            label_constant = 0
-                        stacking_reward = np.arange(len(all_goal_ids))
-                        stacking_reward = 0.999 * stacking_reward * label_constant
-                        # print("reward estimates", stacking_reward)
-
-                        if self.seed is not None:
-                            rand_max = len(all_goal_ids) - 1
-                            if rand_max <= 1:
-                                print('CostarBlockStackingSequence: not enough goal ids: ' + str(all_goal_ids) + ' file: ' + str(rand_max))
-                            image_indices = self.random_state.randint(1, rand_max, 1)
+                    read_start = default_timer()
+                    example_index = self.example_cache.example_index(example_filename)
+                    read_time += default_timer() - read_start
+                    # len of goal indexes is the same as the number of images, so this saves loading all the images
+                    all_goal_ids = example_index['goal_ids']
+                    if('stacking_reward' in self.label_features_to_extract):
+                        # TODO(ahundt) move this check out of the stacking reward case after files have been updated
+                        if all_goal_ids[-1] > len(all_goal_ids):
+                            raise ValueError(' File contains goal id greater than total number of frames ' + str(example_filename))
+                    if len(all_goal_ids) < 2:
+                        print('block_stacking_reader.py: ' + str(len(all_goal_ids)) + ' goal indices in this file, skipping: ' + example_filename)
+                    if 'success' in example_filename:
+                        label_constant = 1
+                    else:
+                        label_constant = 0
+                    stacking_reward = np.arange(len(all_goal_ids))
+                    stacking_reward = 0.999 * stacking_reward * label_constant
+                    # print("reward estimates", stacking_reward)
+
+                    if self.seed is not None:
+                        rand_max = len(all_goal_ids) - 1
+                        if rand_max <= 1:
+                            print('CostarBlockStackingSequence: not enough goal ids: ' + str(all_goal_ids) + ' file: ' + str(rand_max))
+                        image_indices = self.random_state.randint(1, rand_max, 1)
+                    else:
+                        raise NotImplementedError
+                    indices = [0] + list(image_indices)
+
+                    if self.blend:
+                        img_indices = get_past_goal_indices(image_indices, all_goal_ids, filename=example_filename)
+                    else:
+                        img_indices = indices
+                    if self.inference_mode is True:
+                        if images_index >= len(all_goal_ids):
+                            self.infer_index = 1
+                            image_idx = 1
+                            # image_idx = (images_index % (len(data['gripper_action_goal_idx']) - 1)) + 1
                         else:
-                            raise NotImplementedError
-                        indices = [0] + list(image_indices)
-
-                        if self.blend:
-                            img_indices = get_past_goal_indices(image_indices, all_goal_ids, filename=example_filename)
-                        else:
-                            img_indices = indices
-                        if self.inference_mode is True:
-                            if images_index >= len(data['gripper_action_goal_idx']):
-                                self.infer_index = 1
-                                image_idx = 1
-                                # image_idx = (images_index % (len(data['gripper_action_goal_idx']) - 1)) + 1
-                            else:
-                                image_idx = images_index
-
-                            img_indices = [0, image_idx]
-                            # print("image_index", image_idx)
-                            # print("image_true", images_index, len(data['gripper_action_goal_idx']))
-                            # print("new_indices-----", image_idx)
-                        if self.verbose > 0:
-                            print("Indices --", indices)
-                            print('img_indices: ' + str(img_indices))
-                        rgb_images = list(data['image'][img_indices])
-                        rgb_images = ConvertImageListToNumpy(rgb_images, format='numpy')
-
-                        if self.blend:
-                            # TODO(ahundt) move this to after the resize loop for a speedup
-                            blended_image = blend_image_sequence(rgb_images)
-                            rgb_images = [rgb_images[0], blended_image]
-                        # resize using skimage
-                        rgb_images_resized = []
-                        for k, images in enumerate(rgb_images):
-                            if (self.is_training and self.random_augmentation is not None and
-                                    self.random_shift and np.random.random() > self.random_augmentation):
-                                # apply random shift to the images before resizing
-                                images = keras_preprocessing.image.random_shift(
-                                    images,
-                                    # height, width
-                                    1./(48. * 2.), 1./(64. * 2.),
-                                    row_axis=0, col_axis=1, channel_axis=2)
-                            # TODO(ahundt) improve crop/resize to match cornell_grasp_dataset_reader
-                            if self.output_shape is not None:
-                                resized_image = resize(images, self.output_shape, mode='constant', preserve_range=True, order=1)
-                            else:
-                                resized_image = images
-                            if self.is_training and self.random_augmentation:
-                                # do some image augmentation with random erasing & cutout
-                                resized_image = random_eraser(resized_image)
-                            rgb_images_resized.append(resized_image)
-
-                        init_images.append(rgb_images_resized[0])
-                        current_images.append(rgb_images_resized[1])
-                        poses.append(np.array(data[self.pose_name][indices[1:]])[0])
-                        if(self.data_features_to_extract is not None and 'image_0_image_n_vec_0_vec_n_xyz_aaxyz_nsc_nxygrid_25' in self.data_features_to_extract):
-                            next_goal_idx = all_goal_ids[indices[1:][0]]
-                            goal_pose.append(np.array(data[self.pose_name][next_goal_idx]))
-                            print("final pose added", goal_pose)
-                            current_stacking_reward = stacking_reward[indices[1]]
-                            print("reward estimate", current_stacking_reward)
-                        # x = x + tuple([rgb_images[indices]])
-                        # x = x + tuple([np.array(data[self.pose_name])[indices]])
-
-                        # WARNING: IF YOU CHANGE THIS ACTION ENCODING CODE BELOW, ALSO CHANGE encode_action() function ABOVE
-                        if (self.data_features_to_extract is not None and
-                                ('image_0_image_n_vec_xyz_aaxyz_nsc_15' in self.data_features_to_extract or
-                                 'image_0_image_n_vec_xyz_nxygrid_12' in self.data_features_to_extract or
-                                 'image_0_image_n_vec_xyz_aaxyz_nsc_nxygrid_17' in self.data_features_to_extract or
-                                 'image_0_image_n_vec_0_vec_n_xyz_aaxyz_nsc_nxygrid_25' in self.data_features_to_extract) and not self.one_hot_encoding):
-                            # normalized floating point encoding of action vector
-                            # from 0 to 1 in a single float which still becomes
-                            # a 2d array of dimension batch_size x 1
-                            # np.expand_dims(data['gripper_action_label'][indices[1:]], axis=-1) / self.total_actions_available
-                            for j in indices[1:]:
-                                action = [float(data['gripper_action_label'][j] / self.total_actions_available)]
-                                action_labels.append(action)
-                        else:
-                            # one hot encoding
-                            for j in indices[1:]:
-                                # generate the action label one-hot encoding
-                                action = np.zeros(self.total_actions_available)
-                                action[data['gripper_action_label'][j]] = 1
-                                action_labels.append(action)
-                        # action_labels = np.array(action_labels)
-
-                        # print(action_labels)
-                        # x = x + tuple([action_labels])
-                        # X.append(x)
-                        # action_labels = np.unique(data['gripper_action_label'])
-                        # print(np.array(data['labels_to_name']).shape)
-                        # X.append(np.array(data['pose'])[indices])
-
-                        # Store class
-                        label = ()
-                        # change to goals computed
-                        index1 = indices[1]
-                        goal_ids = all_goal_ids[index1]
-                        # print(index1)
-                        label = np.array(data[self.pose_name])[goal_ids]
-                        # print(type(label))
-                        # for items in list(data['all_tf2_frames_from_base_link_vec_quat_xyzxyzw_json'][indices]):
-                        #     json_data = json.loads(items.decode('UTF-8'))
-                        #     label = label + tuple([json_data['gripper_center']])
-                        #     print(np.array(json_data['gripper_center']))
-                            # print(json_data.keys())
-                            # y.append(np.array(json_data['camera_rgb_frame']))
-                        if('stacking_reward' in self.label_features_to_extract):
-                            # print(y)
-                            y.append(current_stacking_reward)
-                        else:
-                            y.append(label)
-                        if 'success' in example_filename:
-                            action_successes = action_successes + [1]
-                        else:
-                            action_successes = action_successes + [0]
-                        # print("y = ", y)
+                            image_idx = images_index
+
+                        img_indices = [0, image_idx]
+                        # print("image_index", image_idx)
+                        # print("image_true", images_index, len(data['gripper_action_goal_idx']))
+                        # print("new_indices-----", image_idx)
+                    if self.verbose > 0:
+                        print("Indices --", indices)
+                        print('img_indices: ' + str(img_indices))
+                    read_start = default_timer()
+                    rgb_images = self.example_cache.read_images(example_filename, img_indices)
+                    read_time += default_timer() - read_start
+                    raw_images.extend(rgb_images)
+                    images_per_example.append(len(rgb_images))
+                    poses.append(example_index['poses'][indices[1]])
+                    if(self.data_features_to_extract is not None and 'image_0_image_n_vec_0_vec_n_xyz_aaxyz_nsc_nxygrid_25' in self.data_features_to_extract):
+                        next_goal_idx = all_goal_ids[indices[1:][0]]
+                        goal_pose.append(example_index['poses'][next_goal_idx])
+                        print("final pose added", goal_pose)
+                        current_stacking_reward = stacking_reward[indices[1]]
+                        print("reward estimate", current_stacking_reward)
+                    # x = x + tuple([rgb_images[indices]])
+                    # x = x + tuple([np.array(data[self.pose_name])[indices]])
+
+                    # WARNING: IF YOU CHANGE THIS ACTION ENCODING CODE BELOW, ALSO CHANGE encode_action() function ABOVE
+                    if (self.data_features_to_extract is not None and
+                            ('image_0_image_n_vec_xyz_aaxyz_nsc_15' in self.data_features_to_extract or
+                             'image_0_image_n_vec_xyz_nxygrid_12' in self.data_features_to_extract or
+                             'image_0_image_n_vec_xyz_aaxyz_nsc_nxygrid_17' in self.data_features_to_extract or
+                             'image_0_image_n_vec_0_vec_n_xyz_aaxyz_nsc_nxygrid_25' in self.data_features_to_extract) and not self.one_hot_encoding):
+                        # normalized floating point encoding of action vector
+                        # from 0 to 1 in a single float which still becomes
+                        # a 2d array of dimension batch_size x 1
+                        # np.expand_dims(data['gripper_action_label'][indices[1:]], axis=-1) / self.total_actions_available
+                        for j in indices[1:]:
+                            action = [float(example_index['action_labels'][j] / self.total_actions_available)]
+                            action_labels.append(action)
+                    else:
+                        # one hot encoding
+                        for j in indices[1:]:
+                            # generate the action label one-hot encoding
+                            action = np.zeros(self.total_actions_available)
+                            action[example_index['action_labels'][j]] = 1
+                            action_labels.append(action)
+                    # action_labels = np.array(action_labels)
+
+                    # print(action_labels)
+                    # x = x + tuple([action_labels])
+                    # X.append(x)
+                    # action_labels = np.unique(data['gripper_action_label'])
+                    # print(np.array(data['labels_to_name']).shape)
+                    # X.append(np.array(data['pose'])[indices])
+
+                    # Store class
+                    label = ()
+                    # change to goals computed
+                    index1 = indices[1]
+                    goal_ids = all_goal_ids[index1]
+                    # print(index1)
+                    label = example_index['poses'][goal_ids]
+                    encodings = example_index['encodings']
+                    if encodings is not None:
+                        cached_poses.append(encodings[index1, ENCODING_CACHE_COLUMNS['pose']])
+                        cached_labels.append(encodings[index1, ENCODING_CACHE_COLUMNS['goal_pose']])
+                    # print(type(label))
+                    # for items in list(data['all_tf2_frames_from_base_link_vec_quat_xyzxyzw_json'][indices]):
+                    #     json_data = json.loads(items.decode('UTF-8'))
+                    #     label = label + tuple([json_data['gripper_center']])
+                    #     print(np.array(json_data['gripper_center']))
+                        # print(json_data.keys())
+                        # y.append(np.array(json_data['camera_rgb_frame']))
+                    if('stacking_reward' in self.label_features_to_extract):
+                        # print(y)
+                        y.append(current_stacking_reward)
+                    else:
+                        y.append(label)
+                    if 'success' in example_filename:
+                        action_successes = action_successes + [1]
+                    else:
+                        action_successes = action_successes + [0]
+                    # print("y = ", y)
                 except IOError as ex:
                     print('Error: Skipping file due to IO error when opening ' +
                           example_filename + ': ' + str(ex) + ' using the last example twice for batch')
 
+            self.example_cache.add_batch_read_time(read_time)
+            init_images, current_images = self.decode_batch_images(raw_images, images_per_example)
             action_labels = np.array(action_labels)
             init_images = keras_applications.imagenet_utils._preprocess_numpy_input(
                 np.array(init_images, dtype=np.float32),
@@ -739,7 +1151,13 @@ class CostarBlockStackingSequence(Sequence):
                 np.array(current_images, dtype=np.float32),
                 data_format='channels_last', mode='tf')
             poses = np.array(poses)
-
+            encoded_poses = None
+            encoded_y = None
+            if len(cached_poses) == len(poses):
+                if self.random_encoding_augmentation is None:
+                    encoded_poses = np.array(cached_poses)
+                if self.random_augmentation is None and not np.isnan(cached_labels).any():
+                    encoded_y = np.array(cached_labels)
 
             encoded_goal_pose = None
             # print('encoded poses shape: ' + str(encoded_poses.shape))
@@ -755,7 +1173,8 @@ class CostarBlockStackingSequence(Sequence):
                 data_features_to_extract=self.data_features_to_extract,
                 poses=poses, action_labels=action_labels,
                 init_images=init_images, current_images=current_images,
-                y=y, random_augmentation=self.random_encoding_augmentation)
+                y=y, random_augmentation=self.random_encoding_augmentation,
+                encoded_poses=encoded_poses)
 
             # print("type=======",type(X))
             # print("shape=====",X.shape)
@@ -764,7 +1183,7 @@ class CostarBlockStackingSequence(Sequence):
             if('stacking_reward' in self.label_features_to_extract):
                 y = encode_label(self.label_features_to_extract, y, action_successes, self.random_augmentation, current_stacking_reward)
             else:
-                y = encode_label(self.label_features_to_extract, y, action_successes, self.random_augmentation, None)
+                y = encode_label(self.label_features_to_extract, y, action_successes, self.random_augmentation, None, encoded_y=encoded_y)
 
             # Debugging checks
             if X is None:
@@ -252,3 +252,43 @@ class InaccurateModelStopping(keras.callbacks.Callback):
 
     def on_epoch_end(self, epoch, logs=None):
         self.metric_values = []
+
+
+class InputThroughputLogger(keras.callbacks.Callback):
+    """ Add the training throughput in batches per second to the epoch logs.
+
+    Place it before CSVLogger in the list of callbacks so the values are written to the training csv.
+    The time is measured from the start of the epoch to the end of the last training batch,
+    so validation is not included.
+
+    # Arguments
+
+        loader: An optional data loader with a stats() method such as SequenceProcessLoader,
+            the seconds training spent waiting on it are logged as input_wait_time.
+    """
+
+    def __init__(self, loader=None):
+        super(InputThroughputLogger, self).__init__()
+        self.loader = loader
+        self._epoch_start = default_timer()
+        self._last_batch_end = self._epoch_start
+        self._batches = 0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = default_timer()
+        self._last_batch_end = self._epoch_start
+        self._batches = 0
+        if self.loader is not None:
+            self.loader.stats(reset=True)
+
+    def on_batch_end(self, batch, logs=None):
+        self._batches += 1
+        self._last_batch_end = default_timer()
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs if logs is not None else {}
+        elapsed = max(self._last_batch_end - self._epoch_start, 1e-9)
+        # keras will check for value.item(), so leave these as numpy values
+        logs['batches_per_sec'] = np.array(self._batches / elapsed)
+        if self.loader is not None:
+            logs['input_wait_time'] = np.array(self.loader.stats(reset=True)['wait_time'])
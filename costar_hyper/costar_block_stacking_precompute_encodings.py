@@ -0,0 +1,86 @@
+'''
+Precompute the pose encodings of every frame in the CoSTAR Block Stacking Dataset.
+
+For each example file this writes two side-car files next to it:
+
+    <example>.h5f.<pose_name>.encoding.npy   float64 array with one row per frame
+    <example>.h5f.<pose_name>.encoding.json  the size and modification time of the example
+
+CostarBlockStackingSequence memory maps these instead of re-encoding the
+current and goal poses of every sample in every epoch. The encodings are shared
+by all of the feature combos, such as image_0_image_n_vec_xyz_aaxyz_nsc_15 and
+image_0_image_n_vec_xyz_aaxyz_nsc_nxygrid_17. If an example file changes after
+its encodings were written they are ignored and the sequence falls back to
+encoding on the fly, so simply run this script again to update them.
+
+    python costar_block_stacking_precompute_encodings.py --path ~/.keras/datasets/costar_block_stacking_dataset_v0.4/
+
+Apache License 2.0 https://www.apache.org/licenses/LICENSE-2.0
+'''
+import argparse
+import glob
+import os
+from multiprocessing import Pool
+
+from block_stacking_reader import load_encoding_cache
+from block_stacking_reader import write_encoding_cache
+
+# Progress bars using https://github.com/tqdm/tqdm
+# Import tqdm without enforcing it as a dependency
+try:
+    from tqdm import tqdm
+except ImportError:
+
+    def tqdm(*args, **kwargs):
+        if args:
+            return args[0]
+        return kwargs.get('iterable', None)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", type=str,
+                        default=os.path.join(
+                            os.path.expanduser("~"),
+                            '.keras/datasets/costar_block_stacking_dataset_v0.4/'),
+                        help='path to dataset folder containing h5f files, subfolders are also searched')
+    parser.add_argument("--pose_name", type=str, default='pose_gripper_center',
+                        help='The pose to encode, see CostarBlockStackingSequence.')
+    parser.add_argument("--force", action='store_true', default=False,
+                        help='Rewrite the encodings even if they are up to date.')
+    parser.add_argument("--processes", type=int, default=None,
+                        help='Number of processes, defaults to the number of cpus.')
+    return vars(parser.parse_args())
+
+
+def precompute_encodings(args):
+    """ Write the encodings for one file if needed, returns True if the file was written.
+    """
+    filename, pose_name, force = args
+    if not force and load_encoding_cache(filename, pose_name) is not None:
+        return False
+    try:
+        write_encoding_cache(filename, pose_name)
+    except (IOError, OSError, KeyError) as ex:
+        print('Skipping ' + filename + ': ' + str(ex))
+        return False
+    return True
+
+
+def main(args):
+    path = os.path.expanduser(args['path'])
+    filenames = sorted(glob.glob(os.path.join(path, '*.h5f')) + glob.glob(os.path.join(path, '*', '*.h5f')))
+    print('Found ' + str(len(filenames)) + ' h5f files in ' + path)
+    pool = Pool(args['processes'])
+    jobs = [(filename, args['pose_name'], args['force']) for filename in filenames]
+    written = 0
+    for was_written in tqdm(pool.imap_unordered(precompute_encodings, jobs), total=len(jobs)):
+        written += was_written
+    pool.close()
+    pool.join()
+    print('Wrote encodings for ' + str(written) + ' files, ' + str(len(filenames) - written) + ' were up to date or skipped.')
+
+
+if __name__ == '__main__':
+    args = _parse_args()
+    main(args)
@@ -13,6 +13,9 @@ https://sites.google.com/site/costardataset/usage
 To split the success_only subset or to add new files ot the success_only subset, use
 --success_only flag.
 
+The frame count of every h5f file is saved in costar_block_stacking_manifest.csv in
+its folder, so running this script again only opens new or changed files.
+
 Use --help to see all possible uses for this function.
 
 Author: Chia-Hung "Rexxar" Lin (rexxarchl)
@@ -21,7 +24,7 @@ Apache License 2.0 https://www.apache.org/licenses/LICENSE-2.0
 import argparse
 import os
 import random
-import h5py  # Needs h5py to open the files and check frame count
+from block_stacking_manifest import scan_directory
 
 # Progress bars using https://github.com/tqdm/tqdm
 # Import tqdm without enforcing it as a dependency
@@ -96,6 +99,10 @@ def _parse_args():
                                  "costar_block_stacking_v0.4"],
                         help="Existing txt file prefixes to look for when opening "
                              "train/val/test files.")
+    parser.add_argument("--processes", type=int, default=None,
+                        help='Number of processes used to scan new or changed h5f files '
+                             'into the costar_block_stacking_manifest.csv file of each '
+                             'folder, defaults to the number of cpus.')
     return vars(parser.parse_args())
 
 
@@ -488,10 +495,10 @@ def split_sanity_check(train_set, val_set, test_set, len_filenames):
 
 def split_all(
         filenames, dataset_name, dir_name, dir_path, success_only, existing_file_prefix,
-        val_len=None, test_len=None):
+        val_len=None, test_len=None, processes=None):
     '''Splits all files into success_only, task_failure_only, error_failure_only, and
     task_and_error_failure subsets.
-    1. Open all filenames with h5py to only count the files that contain images
+    1. Scan the files into the manifest of the folder to only count the files that contain images
     2. Calculate success:failure:error ratios
     3. Try to open success_only train/val/test txt file in existing_file_prefix for
        length reference. Output train/val/test txt files according to the calculated
@@ -508,6 +515,7 @@ def split_all(
                                  the folder to open as success_only reference.
     :param val_len: Expected output val set length.
     :param test_len: Expected output test set length.
+    :param processes: Number of processes used to scan new or changed files.
     :return: A list of 4 lists that contain 3 sublists.
              The 4 lists are in the format of [success_only, task_and_error_failure,
              task_failure_only, error_failure_only]
@@ -515,7 +523,7 @@ def split_all(
     '''
     # Get the success, failure, and error filenames with nonzero frames
     success_filenames, failure_filenames, error_filenames = count_files_containing_images(
-                                                                dir_path, filenames)
+                                                                dir_path, filenames, processes)
 
     # Calculate the percentage of success, failure and error
     total_file_count = (
@@ -619,46 +627,45 @@ def split_all(
             [err_train_set, err_val_set, err_test_set]]
 
 
-def count_files_containing_images(path, filenames):
-    '''Open the files and check frame count. Skip files with 0 frame.
+def count_files_containing_images(path, filenames, processes=None, checksum=True):
+    '''Check the frame count of the files using the manifest of the folder. Skip files with 0 frame.
+
+    Files that are new or changed since the last scan are opened in parallel and the
+    manifest csv file in path is updated with their frame counts,
+    see block_stacking_manifest.scan_directory().
 
+    :param path: Path to the folder with the .h5f files.
     :param filenames: .h5f filenames in the folder
+    :param processes: Number of processes used to scan the files, defaults to the number of cpus.
+    :param checksum: Compute the md5 checksum of the scanned files.
     :return: Lists of success/failure/error filenames with nonzero frames
     '''
-    # TODO(rexxarchl): Write total frames into csv file as a new column
-    # Open the files to check frame count. Skip files with 0 frame.
     error_filenames = []
     failure_filenames = []
     success_filenames = []
     skip_count = 0
     print("Checking {} files in {}...".format(len(filenames), path))
-    progress_bar = tqdm(filenames)
-    for filename in progress_bar:
-        try:
-            with h5py.File(os.path.join(path, filename), 'r') as data:
-                try:
-                    total_frames = len(data['image'])
-                except KeyError as e:
-                    progress_bar.write('KeyError: Skipping %s' % filename)
-                    continue
-
-                if total_frames == 0:  # Skip files with 0 frame
-                    # print('Skipping %s since it has 0 image frame' % filename)
-                    skip_count += 1
-                    continue
-
-                if 'error' in filename:
-                    error_filenames += [filename]
-                elif 'failure' in filename:
-                    failure_filenames += [filename]
-                elif 'success' in filename:
-                    success_filenames += [filename]
-                else:  # BUG: Sanity check for debugging
-                    raise Exception(
-                        'Somthing is wrong! The file does not contain `error`,'
-                        '`failure`, or `success` in the filename: %s' % filename)
-        except IOError as ex:
-            progress_bar.write('IOError: Skipping %s' % filename)
+    manifest = scan_directory(path, filenames, processes=processes, checksum=checksum)
+    for filename in filenames:
+        row = manifest[filename]
+        if row['frame_count'] < 0:
+            print('Unreadable or no images: Skipping %s' % filename)
+            continue
+
+        if row['frame_count'] == 0:  # Skip files with 0 frame
+            skip_count += 1
+            continue
+
+        if row['status'] == 'error.failure':
+            error_filenames += [filename]
+        elif row['status'] == 'failure':
+            failure_filenames += [filename]
+        elif row['status'] == 'success':
+            success_filenames += [filename]
+        else:  # BUG: Sanity check for debugging
+            raise Exception(
+                'Somthing is wrong! The file does not contain `error`,'
+                '`failure`, or `success` in the filename: %s' % filename)
 
     print("Counted {:d} success files, {:d} failure files, and {:d} error files.".format(
             len(success_filenames), len(failure_filenames), len(error_filenames)))
@@ -731,7 +738,7 @@ def main(args, root='root'):
         subsets = split_all(
                     filenames, args['dataset_name'], dir_name, dir_path,
                     args['success_only'], args['existing_file_prefix'],
-                    args['val_len'], args['test_len'])
+                    args['val_len'], args['test_len'], args['processes'])
         print("All splits complete. \n")
 
         # Output the files
@@ -286,6 +286,132 @@ def polygon_area(poly):
     return 0.5 * sum(p[1]*q[0] - p[0]*q[1] for p, q in zip(poly, poly_rot))
 
 
+def batch_rectangle_homogeneous_lines(batch_rp):
+    """ Homogeneous lines through the edges of a batch of convex polygons.
+
+    # Arguments
+
+    batch_rp: n by k by 2 array of polygon points in y, x order, such as
+        n by 4 by 2 rectangles.
+
+    # Returns
+
+    n by k by 3 array of lines [a, b, c], where a * x + b * y + c = 0,
+    which is the convention of `line_at_point()`. Line i passes through
+    points i and i + 1, and lines are oriented so points on the inside
+    of the polygon have values <= 0.
+    """
+    py = batch_rp[..., 0]
+    px = batch_rp[..., 1]
+    next_rp = np.roll(batch_rp, -1, axis=-2)
+    qy = next_rp[..., 0]
+    qx = next_rp[..., 1]
+    lines = np.stack([qy - py, px - qx, qx * py - px * qy], axis=-1)
+    # flip any line which has the polygon center on the positive side
+    center = np.mean(batch_rp, axis=-2)[..., None, :]
+    center_value = lines[..., 0] * center[..., 1] + lines[..., 1] * center[..., 0] + lines[..., 2]
+    return lines * np.where(center_value > 0, -1.0, 1.0)[..., None]
+
+
+def _batch_polygon_next_index(count, max_count):
+    """ Index of the next point around each polygon in a padded batch, and which points are valid.
+    """
+    index = np.arange(max_count)[None, :]
+    valid = index < count[:, None]
+    next_index = np.where(index + 1 < count[:, None], index + 1, 0)
+    return next_index, valid
+
+
+def batch_rectangle_intersection_polygon(batch_rp0, batch_rl1):
+    """ Clip a batch of convex polygons by a batch of convex polygons defined with homogeneous lines.
+
+    Vectorized version of `rectangle_intersection_polygon()`, which clips
+    each polygon in batch_rp0 against every line of the matching entry in
+    batch_rl1 with the Sutherland-Hodgman algorithm.
+
+    # Arguments
+
+    batch_rp0: n by k by 2 array of polygon points in y, x order.
+    batch_rl1: n by l by 3 array of homogeneous lines,
+        see `batch_rectangle_homogeneous_lines()`.
+
+    # Returns
+
+    A tuple (polygons, counts). polygons is an n by m by 2 array of
+    intersection points, padded to the largest intersection, and
+    counts holds the number of valid points of each polygon.
+    """
+    poly = np.asarray(batch_rp0, dtype=np.float64)
+    rows = np.arange(poly.shape[0])[:, None]
+    count = np.full((poly.shape[0],), poly.shape[1], dtype=np.int64)
+    if poly.shape[0] == 0:
+        return poly, count
+    for i in range(batch_rl1.shape[1]):
+        line = batch_rl1[:, i, None, :]
+        next_index, valid = _batch_polygon_next_index(count, poly.shape[1])
+        s = poly
+        t = poly[rows, next_index]
+        s_value = line[..., 0] * s[..., 1] + line[..., 1] * s[..., 0] + line[..., 2]
+        t_value = s_value[rows, next_index]
+        # any point p with line(p) <= 0 is on the "inside" (or on the boundary)
+        keep = valid & (s_value <= 0)
+        # points are on opposite sides, add the intersection of the edge with the line
+        crossing = valid & (s_value * t_value < 0)
+        fraction = s_value / np.where(crossing, s_value - t_value, 1.0)
+        intersection = s + (t - s) * fraction[..., None]
+        # interleave each point with the intersection that follows it, then pack the valid ones to the front
+        candidates = np.stack([s, intersection], axis=2).reshape(poly.shape[0], -1, 2)
+        mask = np.stack([keep, crossing], axis=2).reshape(poly.shape[0], -1)
+        order = np.argsort(~mask, axis=1, kind='mergesort')
+        count = np.sum(mask, axis=1)
+        poly = candidates[rows, order[:, :max(np.max(count), 1)]]
+    return poly, count
+
+
+def batch_polygon_area(batch_poly, count=None):
+    """ Area of a batch of padded polygons.
+
+    # Arguments
+
+    batch_poly: n by k by 2 array of polygon points.
+    count: number of valid points in each polygon, defaults to all k.
+
+    # Returns
+
+    Array of n unsigned areas.
+    """
+    if count is None:
+        count = np.full((batch_poly.shape[0],), batch_poly.shape[1], dtype=np.int64)
+    next_index, valid = _batch_polygon_next_index(count, batch_poly.shape[1])
+    next_poly = batch_poly[np.arange(batch_poly.shape[0])[:, None], next_index]
+    partial = batch_poly[..., 1] * next_poly[..., 0] - batch_poly[..., 0] * next_poly[..., 1]
+    return 0.5 * np.abs(np.sum(np.where(valid, partial, 0.0), axis=1))
+
+
+def batch_rectangle_vertices(h, w, cy, cx, sin_theta, cos_theta):
+    """ Vectorized version of `rectangle_vertices()`.
+
+    All arguments are arrays of length n, returns an n by 4 by 2 array of points in y, x order.
+    """
+    norm = np.sqrt(sin_theta ** 2 + cos_theta ** 2)
+    norm = np.where(norm > 0, norm, 1.0)
+    sin_theta = sin_theta / norm
+    cos_theta = cos_theta / norm
+    dx = w / 2
+    dy = h / 2
+    dxcos = dx * cos_theta
+    dxsin = dx * sin_theta
+    dycos = dy * cos_theta
+    dysin = dy * sin_theta
+    center = np.stack([cy, cx], axis=-1)[:, None, :]
+    offsets = np.stack([
+        np.stack([-dxsin + -dycos, -dxcos - -dysin], axis=-1),
+        np.stack([ dxsin + -dycos,  dxcos - -dysin], axis=-1),
+        np.stack([ dxsin +  dycos,  dxcos -  dysin], axis=-1),
+        np.stack([-dxsin +  dycos, -dxcos -  dysin], axis=-1)], axis=1)
+    return center + offsets
+
+
 def rectangle_vertices(h, w, cy, cx, sin_theta=None, cos_theta=None, theta=None):
     """ Get the vertices from a parameterized bounding box.
 
@@ -503,6 +629,51 @@ def shapely_intersection_over_union(rect0_points, rect1_points, verbose=0):
         return 0.0
 
 
+def batch_intersection_over_union(true_rp, pred_rp):
+    """ Intersection over union of pairs of oriented rectangles.
+
+    Vectorized replacement for `shapely_intersection_over_union()`,
+    based on convex polygon clipping.
+
+    # Arguments
+
+        true_rp: n by 4 by 2 array of rectangle points in y, x order.
+        pred_rp: n by 4 by 2 array of rectangle points in y, x order.
+
+    # Returns
+
+        Array of n iou values, 0 where both rectangles have no area.
+    """
+    true_rp = np.asarray(true_rp, dtype=np.float64)
+    pred_rp = np.asarray(pred_rp, dtype=np.float64)
+    true_area = batch_polygon_area(true_rp)
+    pred_area = batch_polygon_area(pred_rp)
+    intersection_polygon, count = batch_rectangle_intersection_polygon(
+        true_rp, batch_rectangle_homogeneous_lines(pred_rp))
+    # a degenerate rectangle has no inside, so it can't clip anything
+    intersection_area = np.minimum(batch_polygon_area(intersection_polygon, count),
+                                   np.minimum(true_area, pred_area))
+    union_area = true_area + pred_area - intersection_area
+    return np.where(union_area > 0, intersection_area / np.where(union_area > 0, union_area, 1.0), 0.0)
+
+
+def intersection_over_union_one_vs_many(rp, many_rp):
+    """ Intersection over union of one oriented rectangle with each of many others.
+
+    # Arguments
+
+        rp: 4 by 2 array of rectangle points in y, x order, such as a prediction.
+        many_rp: n by 4 by 2 array of rectangle points, such as all the ground truth rectangles of an image.
+
+    # Returns
+
+        Array of n iou values.
+    """
+    many_rp = np.asarray(many_rp, dtype=np.float64)
+    rp = np.broadcast_to(np.asarray(rp, dtype=np.float64), many_rp.shape)
+    return batch_intersection_over_union(many_rp, rp)
+
+
 def normalize_sin_theta_cos_theta(sin_theta, cos_theta):
     """ Put sin(theta) cos(theta) on the unit circle.
 
@@ -696,30 +867,93 @@ def jaccard_score(y_true, y_pred, angle_threshold=np.radians(60.0), iou_threshol
             return 0.0
 
 
-def grasp_jaccard_batch(y_true, y_pred, verbose=0):
-    # print('y_true.shape: ' + str(y_true.shape))
-    # print('y_pred.shape: ' + str(y_pred.shape))
-    scores = []
-    for i in range(y_true.shape[0]):
-        # print(' i: ' + str(i))
-        # TODO(ahundt) comment the next few lines when not debugging
-        verbose = 0
-        if np.random.randint(0, 10000) % 10000 == 0:
-            verbose = 1
-            print('')
-            print('')
-            print('hypertree_pose_metrics.py sample of ground_truth and prediction:')
-        this_true = y_true[i, :]
-        this_pred = y_pred[i, :]
-        score = jaccard_score(this_true, this_pred, verbose=verbose)
-        if verbose:
-            print('s2t_c2t_hw_cycx_true: ' + str(this_true))
-            print('s2t_c2t_hw_cycx_pred: ' + str(this_pred))
-            print('score:' + str(score))
-        scores += [score]
-    scores = np.array(scores, dtype=np.float32)
-    # print('scores.shape: ' + str(scores.shape))
-    return scores
+def batch_decode_prediction_vector(y_true):
+    """ Vectorized version of `decode_prediction_vector()` for a 2d array of prediction vectors.
+
+    Unlike `decode_prediction_vector()` the input is not modified.
+
+    # Returns
+
+        sin(2 * theta) array, cos(2 * theta) array, and an n by 4 by 2 array of rectangle points.
+    """
+    y_true = np.array(y_true, dtype=np.float64)
+    rect_index = 1 if y_true.shape[-1] == 7 else 0
+    sin_cos = denorm_sin2_cos2(y_true[:, rect_index:rect_index + 2])
+    # Just like decode_prediction_vector(), the rectangle is parsed from the
+    # vector after sin and cos have been denormalized, so the rectangles match
+    # the ones jaccard_score() compares.
+    rect_sin_cos = denorm_sin2_cos2(sin_cos)
+    rect_theta = np.arctan2(rect_sin_cos[:, 0], rect_sin_cos[:, 1]) / 2.0
+    rect = y_true[:, rect_index + 2:]
+    rp = batch_rectangle_vertices(rect[:, 0], rect[:, 1], rect[:, 2], rect[:, 3],
+                                  np.sin(rect_theta), np.cos(rect_theta))
+    return sin_cos[:, 0], sin_cos[:, 1], rp
+
+
+def batch_angle_difference_less_than_threshold(
+        true_y_sin_theta, true_x_cos_theta,
+        pred_y_sin_theta, pred_x_cos_theta,
+        angle_threshold=np.radians(60.0)):
+    """ Vectorized version of `angle_difference_less_than_threshold()`.
+    """
+    true_angle = np.arctan2(true_y_sin_theta, true_x_cos_theta)
+    pred_angle = np.arctan2(pred_y_sin_theta, pred_x_cos_theta)
+    true_pred_diff = true_angle - pred_angle
+    angle_difference = np.arctan2(np.sin(true_pred_diff), np.cos(true_pred_diff))
+    return np.abs(angle_difference) <= angle_threshold
+
+
+def grasp_jaccard_batch(y_true, y_pred, verbose=0, angle_threshold=np.radians(60.0), iou_threshold=0.25):
+    """ Vectorized version of `jaccard_score()` for 2d arrays with a batch of vectors.
+
+    Scores each row of y_pred against the same row of y_true,
+    see `jaccard_score()` for the accepted formats and thresholds.
+    """
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+    scores = np.ones((y_true.shape[0],))
+    check_rectangles = np.ones((y_true.shape[0],), dtype=np.bool_)
+    if y_pred.shape[-1] == 7:
+        # round grasp success to 0 or 1
+        predicted_success = np.rint(y_pred[:, 0])
+        true_success = y_true[:, 0].astype(np.int64)
+        # a success prediction that doesn't match scores 0,
+        # a correctly predicted failure scores 1 regardless of box contents
+        scores[predicted_success != true_success] = 0.0
+        check_rectangles = (predicted_success == true_success) & (predicted_success != 0)
+
+    true_y_sin_theta, true_x_cos_theta, true_rp = batch_decode_prediction_vector(y_true[check_rectangles])
+    pred_y_sin_theta, pred_x_cos_theta, pred_rp = batch_decode_prediction_vector(y_pred[check_rectangles])
+    angle_ok = batch_angle_difference_less_than_threshold(
+        true_y_sin_theta, true_x_cos_theta,
+        pred_y_sin_theta, pred_x_cos_theta,
+        angle_threshold)
+    iou = batch_intersection_over_union(true_rp, pred_rp)
+    scores[check_rectangles] = angle_ok & (iou >= iou_threshold)
+    if verbose:
+        print('grasp_jaccard_batch iou: ' + str(iou) + ' angle within threshold: ' + str(angle_ok))
+    return scores.astype(np.float32)
+
+
+def grasp_jaccard_one_vs_many(y_true, y_pred, angle_threshold=np.radians(60.0), iou_threshold=0.25):
+    """ Score one prediction against every ground truth grasp of an image.
+
+    The Cornell grasp evaluation counts a predicted grasp as correct
+    if it matches any of the ground truth grasps for the image.
+
+    # Arguments
+
+        y_true: 2d array of all ground truth vectors for one image.
+        y_pred: a single prediction vector.
+
+    # Returns
+
+        1.0 if any of the ground truth vectors match, 0.0 otherwise.
+    """
+    y_true = np.asarray(y_true)
+    y_pred = np.broadcast_to(np.asarray(y_pred), (y_true.shape[0], np.shape(y_pred)[-1]))
+    scores = grasp_jaccard_batch(y_true, y_pred, angle_threshold=angle_threshold, iou_threshold=iou_threshold)
+    return np.max(scores) if scores.size else 0.0
 
 
 def grasp_jaccard(y_true, y_pred):
@@ -861,8 +1095,49 @@ def encode_xyz_qxyzw_to_xyz_aaxyz_nsc(xyz_qxyzw, rescale_meters=4, rotation_weig
         raise ValueError('encode_xyz_qxyzw_to_xyz_aaxyz_nsc: unsupported input data length of ' + str(length))
 
 
+def batch_normalize_qwxyz(batch_qwxyz, tolerance=1e-14):
+    """ Normalize an n by 4 batch of [w, x, y, z] quaternions the way pyquaternion's Quaternion does.
+
+    Rows which are already unit quaternions within tolerance and rows of zeros are not changed.
+    """
+    sum_of_squares = np.sum(batch_qwxyz * batch_qwxyz, axis=-1, keepdims=True)
+    norm = np.sqrt(sum_of_squares)
+    normalize = (np.abs(1.0 - sum_of_squares) >= tolerance) & (norm > 0)
+    return np.where(normalize, batch_qwxyz / np.where(normalize, norm, 1.0), batch_qwxyz)
+
+
+def batch_rotation_to_xyz_theta(batch_qwxyz):
+    """ Vectorized version of `rotation_to_xyz_theta()` for an n by 4 batch of quaternions.
+
+    The quaternions are in pyquaternion's [w, x, y, z] order, and like
+    pyquaternion an undefined axis of a null rotation is all zeros.
+
+    # Returns
+
+        n by 4 array of the unit axis xyz and the signed angle theta in radians.
+    """
+    # Quaternion.angle and Quaternion.axis each normalize the quaternion first
+    batch_qwxyz = batch_normalize_qwxyz(np.asarray(batch_qwxyz, dtype=np.float64))
+    vector_norm = np.linalg.norm(batch_qwxyz[:, 1:], axis=-1)
+    theta = 2.0 * np.arctan2(vector_norm, batch_qwxyz[:, 0])
+    # wrap to the range (-pi, pi], odd multiples of pi are wrapped to +pi
+    theta = np.mod(theta + np.pi, 2 * np.pi) - np.pi
+    theta[theta == -np.pi] = np.pi
+    batch_qwxyz = batch_normalize_qwxyz(batch_qwxyz)
+    vector_norm = np.linalg.norm(batch_qwxyz[:, 1:], axis=-1, keepdims=True)
+    defined = vector_norm >= 1e-17
+    axis = np.where(defined, batch_qwxyz[:, 1:] / np.where(defined, vector_norm, 1.0), 0.0)
+    theta = np.where(axis[:, 2] < 0, theta, -theta)
+    return np.concatenate([axis, theta[:, None]], axis=-1)
+
+
 def batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(batch_xyz_qxyzw, rescale_meters=4, rotation_weight=0.001, random_augmentation=None):
-    """ Expects n by 7 batch with xyz_qxyzw
+    """ Expects n by 7 batch with xyz_qxyzw, or an n by 3 batch of xyz translations.
+
+    Vectorized version of `encode_xyz_qxyzw_to_xyz_aaxyz_nsc()`, the results match it to floating point rounding.
+    With random_augmentation the same per row probability and translation range are used,
+    but the random numbers are drawn for the whole batch at once, so for a given
+    numpy random seed the augmented rows differ from a loop over the single pose version.
 
     rescale_meters: Divide the number of meters by this number so
         positions will be encoded between 0 and 1.
@@ -875,14 +1150,24 @@ def batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(batch_xyz_qxyzw, rescale_meters=4, r
         of randomly modifying the data with a small translation and rotation.
         Enabling random_augmentation is not recommended.
     """
-    encoded_poses = []
-    for xyz_qxyzw in batch_xyz_qxyzw:
-        # print('xyz_qxyzw: ' + str(xyz_qxyzw))
-        xyz_aaxyz_nsc = encode_xyz_qxyzw_to_xyz_aaxyz_nsc(
-            xyz_qxyzw, rescale_meters=rescale_meters, rotation_weight=rotation_weight, random_augmentation=random_augmentation)
-        # print('xyz_aaxyz_nsc: ' + str(xyz_aaxyz_nsc))
-        encoded_poses.append(xyz_aaxyz_nsc)
-    return np.stack(encoded_poses, axis=0)
+    batch_xyz_qxyzw = np.asarray(batch_xyz_qxyzw, dtype=np.float64)
+    length = batch_xyz_qxyzw.shape[-1]
+    if length != 7 and length != 3:
+        raise ValueError('batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc: unsupported input data length of ' + str(length))
+    xyz = (batch_xyz_qxyzw[:, :3] / rescale_meters) + 0.5
+    if random_augmentation is not None:
+        augment = np.random.random(len(xyz)) > random_augmentation
+        # random translation change of up to 0.5 cm
+        xyz[augment] += (np.random.random((np.count_nonzero(augment), 3)) - 0.5) / 10.
+    if length == 3:
+        return xyz
+    # the rotation is passed to pyquaternion as is, see encode_xyz_qxyzw_to_xyz_aaxyz_nsc()
+    aaxyz_theta = batch_rotation_to_xyz_theta(batch_xyz_qxyzw[:, 3:])
+    # encode the unit axis vector into the [0,1] range
+    aaxyz = ((aaxyz_theta[:, :-1] / 2) * rotation_weight) + 0.5
+    theta = aaxyz_theta[:, -1:]
+    nsc = encode_sin_cos(np.concatenate([np.sin(theta), np.cos(theta)], axis=-1))
+    return np.concatenate([xyz, aaxyz, nsc], axis=-1)
 
 
 def decode_xyz_aaxyz_nsc_to_xyz_qxyzw(xyz_aaxyz_nsc, rescale_meters=4, rotation_weight=0.001):
@@ -912,6 +1197,63 @@ def decode_xyz_aaxyz_nsc_to_xyz_qxyzw(xyz_aaxyz_nsc, rescale_meters=4, rotation_
     return xyz
 
 
+def batch_decode_aaxyz_nsc_to_qwxyz(batch_aaxyz_nsc, rotation_weight=0.001, epsilon=1e-5):
+    """ Decode an n by 5 batch of axis and normalized sin(theta) cos(theta) to quaternions.
+
+    Vectorized equivalent of the rotation part of `decode_xyz_aaxyz_nsc_to_xyz_qxyzw()`,
+    including the handling of all zero axes in `normalize_axis()`.
+
+    # Returns
+
+        n by 4 array of quaternions in the order of pyquaternion's Quaternion.elements, [w, x, y, z].
+    """
+    batch_aaxyz_nsc = np.asarray(batch_aaxyz_nsc, dtype=np.float64)
+    # decode and normalize sin(theta) cos(theta), rows of zeros are left as zeros
+    sin_cos = denorm_sin_cos(batch_aaxyz_nsc[:, -2:])
+    norm = np.linalg.norm(sin_cos, axis=-1, keepdims=True)
+    sin_cos = sin_cos / np.where(norm > 0, norm, 1.0)
+    theta = np.arctan2(sin_cos[:, 0], sin_cos[:, 1])
+    # decode ([0, 1] * rotation_weight) range to [-1, 1] range
+    aaxyz = ((batch_aaxyz_nsc[:, :3] - 0.5) * 2) / rotation_weight
+    aaxyz[~np.any(aaxyz, axis=-1), -1] += epsilon
+    aaxyz = aaxyz / np.linalg.norm(aaxyz, axis=-1, keepdims=True)
+    half_theta = theta / 2.0
+    return np.concatenate([np.cos(half_theta)[:, None], aaxyz * np.sin(half_theta)[:, None]], axis=-1)
+
+
+def batch_decode_xyz_aaxyz_nsc_to_xyz_qxyzw(batch_xyz_aaxyz_nsc, rescale_meters=4, rotation_weight=0.001):
+    """ Decode an n by 8 batch of xyz_aaxyz_nsc poses, or an n by 3 batch of xyz translations.
+
+    Vectorized version of `decode_xyz_aaxyz_nsc_to_xyz_qxyzw()`, see that function for details.
+    """
+    batch_xyz_aaxyz_nsc = np.asarray(batch_xyz_aaxyz_nsc, dtype=np.float64)
+    xyz = (batch_xyz_aaxyz_nsc[:, :3] - 0.5) * rescale_meters
+    length = batch_xyz_aaxyz_nsc.shape[-1]
+    if length == 8:
+        q = batch_decode_aaxyz_nsc_to_qwxyz(batch_xyz_aaxyz_nsc[:, 3:], rotation_weight=rotation_weight)
+        return np.concatenate([xyz, q], axis=-1)
+    elif length != 3:
+        raise ValueError('batch_decode_xyz_aaxyz_nsc_to_xyz_qxyzw: unsupported input data length of ' + str(length))
+    return xyz
+
+
+# (metric name, max_translation in meters, max_rotation in radians) of every grasp_acc metric,
+# for use with grasp_accuracy_xyz_aaxyz_nsc_tiers_batch()
+GRASP_ACC_TIERS = [
+    ('grasp_acc', 0.01, 0.261799),
+    ('grasp_acc_5mm_7_5deg', 0.005, 0.1308995),
+    ('grasp_acc_1cm_15deg', 0.01, 0.261799),
+    ('grasp_acc_2cm_30deg', 0.02, 0.523598),
+    ('grasp_acc_4cm_60deg', 0.04, 1.047196),
+    ('grasp_acc_8cm_120deg', 0.08, 2.094392),
+    ('grasp_acc_16cm_240deg', 0.16, 4.188784),
+    ('grasp_acc_32cm_360deg', 0.32, 6.2832),
+    ('grasp_acc_64cm_360deg', 0.64, 6.2832),
+    ('grasp_acc_128cm_360deg', 1.28, 6.2832),
+    ('grasp_acc_256cm_360deg', 2.56, 6.2832),
+    ('grasp_acc_512cm_360deg', 5.12, 6.2832)]
+
+
 def grasp_acc(y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_nsc, max_translation=0.01, max_rotation=0.261799):
     """ Calculate 3D grasp accuracy for a single result with grasp_accuracy_xyz_aaxyz_nsc encoding.
 
@@ -1268,14 +1610,19 @@ def absolute_angle_distance_xyz_aaxyz_nsc_batch(y_true_xyz_aaxyz_nsc, y_pred_xyz
     max_rotation defaults to 15 degrees in radians.
     Input format is xyz_aaxyz_nsc.
     """
-    # print('type of y_true_xyz_aaxyz_nsc: ' + str(type(y_true_xyz_aaxyz_nsc)))
-    accuracies = []
-    for y_true, y_pred in zip(y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_nsc):
-        one_accuracy = absolute_angle_distance_xyz_aaxyz_nsc_single(y_true, y_pred)
-        # print('one grasp acc: ' + str(one_accuracy))
-        accuracies.append(one_accuracy)
-    accuracies = np.array(accuracies, np.float32)
-    return accuracies
+    return _absolute_angle_distance_xyz_aaxyz_nsc_batch(y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_nsc).astype(np.float32)
+
+
+def _absolute_angle_distance_xyz_aaxyz_nsc_batch(y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_nsc):
+    """ Vectorized absolute_angle_distance_xyz_aaxyz_nsc_single() for n by 8 or n by 5 arrays, in float64.
+    """
+    # the rotation is always the last 5 entries
+    y_true_q = batch_decode_aaxyz_nsc_to_qwxyz(np.asarray(y_true_xyz_aaxyz_nsc)[:, -5:])
+    y_pred_q = batch_decode_aaxyz_nsc_to_qwxyz(np.asarray(y_pred_xyz_aaxyz_nsc)[:, -5:])
+    # same as Quaternion.absolute_distance(), q and -q are the same rotation
+    d_minus = np.linalg.norm(y_true_q - y_pred_q, axis=-1)
+    d_plus = np.linalg.norm(y_true_q + y_pred_q, axis=-1)
+    return np.where(d_minus < d_plus, d_minus, d_plus)
 
 
 def absolute_cart_distance_xyz_aaxyz_nsc_single(y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_nsc):
@@ -1297,14 +1644,16 @@ def absolute_cart_distance_xyz_aaxyz_nsc_batch(y_true_xyz_aaxyz_nsc, y_pred_xyz_
     max_translation defaults to 0.01 meters, or 1cm.
     max_rotation defaults to 15 degrees in radians.
     """
-    # print('type of y_true_xyz_aaxyz_nsc: ' + str(type(y_true_xyz_aaxyz_nsc)))
-    accuracies = []
-    for y_true, y_pred in zip(y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_nsc):
-        one_accuracy = absolute_cart_distance_xyz_aaxyz_nsc_single(y_true, y_pred)
-        # print('one grasp acc: ' + str(one_accuracy))
-        accuracies.append(one_accuracy)
-    accuracies = np.array(accuracies, np.float32)
-    return accuracies
+    return _absolute_cart_distance_xyz_aaxyz_nsc_batch(y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_nsc).astype(np.float32)
+
+
+def _absolute_cart_distance_xyz_aaxyz_nsc_batch(y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_nsc, rescale_meters=4):
+    """ Vectorized absolute_cart_distance_xyz_aaxyz_nsc_single() for n by 8 or n by 3 arrays, in float64.
+    """
+    # only the translation needs to be decoded
+    y_true_xyz = (np.asarray(y_true_xyz_aaxyz_nsc, dtype=np.float64)[:, :3] - 0.5) * rescale_meters
+    y_pred_xyz = (np.asarray(y_pred_xyz_aaxyz_nsc, dtype=np.float64)[:, :3] - 0.5) * rescale_meters
+    return np.linalg.norm(y_true_xyz - y_pred_xyz, axis=-1)
 
 
 def grasp_accuracy_xyz_aaxyz_nsc_single(y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_nsc, max_translation=0.01, max_rotation=0.261799):
@@ -1355,12 +1704,38 @@ def grasp_accuracy_xyz_aaxyz_nsc_batch(y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_ns
     max_translation defaults to 0.01 meters, or 1cm.
     max_rotation defaults to 15 degrees in radians.
     """
-    # print('type of y_true_xyz_aaxyz_nsc: ' + str(type(y_true_xyz_aaxyz_nsc)))
-    accuracies = []
-    for y_true, y_pred in zip(y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_nsc):
-        one_accuracy = grasp_accuracy_xyz_aaxyz_nsc_single(
-            y_true, y_pred, max_translation=max_translation, max_rotation=max_rotation)
-        # print('one grasp acc: ' + str(one_accuracy))
-        accuracies.append(one_accuracy)
-    accuracies = np.array(accuracies, np.float32)
-    return accuracies
+    accuracies = grasp_accuracy_xyz_aaxyz_nsc_tiers_batch(
+        y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_nsc, [max_translation], [max_rotation])
+    return accuracies[:, 0]
+
+
+def grasp_accuracy_xyz_aaxyz_nsc_tiers_batch(y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_nsc, max_translations, max_rotations):
+    """ Calculate 3D grasp accuracy for a batch at several thresholds at once.
+
+    The translation and rotation distances are computed once for the whole batch
+    and then compared against every threshold pair, see GRASP_ACC_TIERS.
+    Supports the same n by 3, n by 5 and n by 8 formats as
+    `grasp_accuracy_xyz_aaxyz_nsc_single()`.
+
+    # Arguments
+
+        max_translations: list of k maximum translation distances in meters.
+        max_rotations: list of k maximum rotation distances in radians.
+
+    # Returns
+
+        n by k float32 array, 1 where the prediction meets both criteria of a tier, 0 otherwise.
+    """
+    length = np.shape(y_true_xyz_aaxyz_nsc)[-1]
+    if length not in (3, 5, 8):
+        raise ValueError('grasp_accuracy_xyz_aaxyz_nsc_tiers_batch: unsupported label value format of length ' + str(length))
+    max_translations = np.asarray(max_translations, dtype=np.float64)
+    max_rotations = np.asarray(max_rotations, dtype=np.float64)
+    accurate = np.ones((np.shape(y_true_xyz_aaxyz_nsc)[0], max_translations.shape[0]), dtype=np.bool_)
+    if length == 3 or length == 8:
+        translation = _absolute_cart_distance_xyz_aaxyz_nsc_batch(y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_nsc)
+        accurate &= translation[:, None] < max_translations[None, :]
+    if length == 5 or length == 8:
+        angle_distance = _absolute_angle_distance_xyz_aaxyz_nsc_batch(y_true_xyz_aaxyz_nsc, y_pred_xyz_aaxyz_nsc)
+        accurate &= angle_distance[:, None] < max_rotations[None, :]
+    return accurate.astype(np.float32)
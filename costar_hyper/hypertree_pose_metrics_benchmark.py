@@ -0,0 +1,114 @@
+""" Benchmark the vectorized pose metrics in hypertree_pose_metrics against the per-row versions.
+
+    python hypertree_pose_metrics_benchmark.py --batch_size 1024 --repeats 5
+
+The per-row path decodes one pose at a time with pyquaternion and evaluates each
+grasp_acc threshold separately, the vectorized path decodes the whole batch once
+and evaluates every threshold in GRASP_ACC_TIERS in one pass.
+
+The xyz_aaxyz_nsc encode and decode round trip is also timed at each of the
+--encode_batch_sizes, comparing encode_xyz_qxyzw_to_xyz_aaxyz_nsc() and
+decode_xyz_aaxyz_nsc_to_xyz_qxyzw() on one pose at a time with the batch versions.
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+import hypertree_pose_metrics
+
+
+def random_xyz_qxyzw(batch_size, seed=0):
+    """ Random poses with unit quaternions.
+    """
+    rng = np.random.RandomState(seed)
+    batch_xyz_qxyzw = np.concatenate([rng.uniform(-0.5, 0.5, (batch_size, 3)),
+                                      rng.normal(size=(batch_size, 4))], axis=-1)
+    batch_xyz_qxyzw[:, 3:] /= np.linalg.norm(batch_xyz_qxyzw[:, 3:], axis=-1, keepdims=True)
+    return batch_xyz_qxyzw
+
+
+def random_xyz_aaxyz_nsc(batch_size, seed=0):
+    """ Random pairs of encoded poses, with predictions close to the ground truth.
+    """
+    rng = np.random.RandomState(seed)
+    batch_xyz_qxyzw = random_xyz_qxyzw(batch_size, seed)
+    y_true = hypertree_pose_metrics.batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(batch_xyz_qxyzw)
+    y_pred = y_true + rng.normal(scale=0.01, size=y_true.shape)
+    return y_true, y_pred
+
+
+def per_row(y_true, y_pred):
+    accuracies = []
+    for name, max_translation, max_rotation in hypertree_pose_metrics.GRASP_ACC_TIERS:
+        accuracies.append([hypertree_pose_metrics.grasp_accuracy_xyz_aaxyz_nsc_single(
+            t, p, max_translation=max_translation, max_rotation=max_rotation)
+            for t, p in zip(y_true, y_pred)])
+    cart = [hypertree_pose_metrics.absolute_cart_distance_xyz_aaxyz_nsc_single(t, p)
+            for t, p in zip(y_true, y_pred)]
+    angle = [hypertree_pose_metrics.absolute_angle_distance_xyz_aaxyz_nsc_single(t, p)
+             for t, p in zip(y_true, y_pred)]
+    return np.array(accuracies, np.float32).T, np.array(cart), np.array(angle)
+
+
+def vectorized(y_true, y_pred):
+    _, max_translations, max_rotations = zip(*hypertree_pose_metrics.GRASP_ACC_TIERS)
+    accuracies = hypertree_pose_metrics.grasp_accuracy_xyz_aaxyz_nsc_tiers_batch(
+        y_true, y_pred, max_translations, max_rotations)
+    cart = hypertree_pose_metrics.absolute_cart_distance_xyz_aaxyz_nsc_batch(y_true, y_pred)
+    angle = hypertree_pose_metrics.absolute_angle_distance_xyz_aaxyz_nsc_batch(y_true, y_pred)
+    return accuracies, cart, angle
+
+
+def per_row_encode_decode(batch_xyz_qxyzw):
+    encoded = np.stack([hypertree_pose_metrics.encode_xyz_qxyzw_to_xyz_aaxyz_nsc(x) for x in batch_xyz_qxyzw])
+    decoded = np.stack([hypertree_pose_metrics.decode_xyz_aaxyz_nsc_to_xyz_qxyzw(x) for x in encoded])
+    return encoded, decoded
+
+
+def vectorized_encode_decode(batch_xyz_qxyzw):
+    encoded = hypertree_pose_metrics.batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(batch_xyz_qxyzw)
+    decoded = hypertree_pose_metrics.batch_decode_xyz_aaxyz_nsc_to_xyz_qxyzw(encoded)
+    return encoded, decoded
+
+
+def benchmark_encode_decode(batch_sizes, repeats):
+    print('xyz_aaxyz_nsc encode + decode round trip')
+    print('%10s %12s %12s %10s' % ('batch', 'per-row sec', 'vector sec', 'speedup'))
+    for batch_size in batch_sizes:
+        batch_xyz_qxyzw = random_xyz_qxyzw(batch_size)
+        for row, vec in zip(per_row_encode_decode(batch_xyz_qxyzw), vectorized_encode_decode(batch_xyz_qxyzw)):
+            assert np.allclose(row, vec, rtol=0, atol=1e-9), 'vectorized encodings do not match the per-row encodings'
+        # the per-row version is slow on large batches, so it is only timed once
+        row_time = min(timeit.repeat(lambda: per_row_encode_decode(batch_xyz_qxyzw), number=1,
+                                     repeat=repeats if batch_size <= 1024 else 1))
+        vec_time = min(timeit.repeat(lambda: vectorized_encode_decode(batch_xyz_qxyzw), number=1, repeat=repeats))
+        print('%10d %12.4f %12.4f %9.1fx' % (batch_size, row_time, vec_time, row_time / vec_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch_size', type=int, default=1024)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--encode_batch_sizes', type=str, default='32,1024,32768,100000',
+                        help='Comma separated batch sizes for the encode and decode benchmark, empty to skip it.')
+    args = parser.parse_args()
+
+    y_true, y_pred = random_xyz_aaxyz_nsc(args.batch_size)
+    row_results = per_row(y_true, y_pred)
+    vec_results = vectorized(y_true, y_pred)
+    for row, vec in zip(row_results, vec_results):
+        assert np.allclose(row, vec, atol=1e-6), 'vectorized results do not match the per-row results'
+
+    row_time = min(timeit.repeat(lambda: per_row(y_true, y_pred), number=1, repeat=args.repeats))
+    vec_time = min(timeit.repeat(lambda: vectorized(y_true, y_pred), number=1, repeat=args.repeats))
+    print('batch of %d poses, %d grasp_acc tiers' % (args.batch_size, len(hypertree_pose_metrics.GRASP_ACC_TIERS)))
+    print('per-row:    %.4f sec' % row_time)
+    print('vectorized: %.4f sec (%.1fx faster)' % (vec_time, row_time / vec_time))
+
+    if args.encode_batch_sizes:
+        benchmark_encode_decode([int(size) for size in args.encode_batch_sizes.split(',')], args.repeats)
+
+
+if __name__ == '__main__':
+    main()
@@ -30,6 +30,8 @@ import cornell_grasp_dataset_reader
 
 from block_stacking_reader import CostarBlockStackingSequence
 from block_stacking_reader import block_stacking_generator
+import block_stacking_manifest
+from sequence_process_loader import SequenceProcessLoader
 
 import time
 from tensorflow.python.platform import flags
@@ -71,6 +73,7 @@ from callbacks import PrintLogsCallback
 from callbacks import FineTuningCallback
 from callbacks import SlowModelStopping
 from callbacks import InaccurateModelStopping
+from callbacks import InputThroughputLogger
 from keras.utils import OrderedEnqueuer
 
 import grasp_loss
@@ -222,6 +225,36 @@ flags.DEFINE_string(
     """
 )
 
+flags.DEFINE_string(
+    'data_loader',
+    'thread',
+    """How training and validation batches are loaded, options are thread and process.
+
+    thread runs the data pipeline in data_loader_workers threads in the training process.
+    process splits the training examples across data_loader_workers processes
+    and returns the batches through shared memory, which avoids the GIL for
+    python heavy pipelines. Each process is seeded with the dataset seed plus
+    its index, so runs stay reproducible. process is only supported by datasets
+    that are keras Sequences with a shard() method, such as costar_block_stacking;
+    other datasets use threads.
+    """
+)
+flags.DEFINE_integer(
+    'data_loader_workers',
+    20,
+    'The number of threads or processes used to load training data, see data_loader.'
+)
+flags.DEFINE_boolean(
+    'costar_exact_time_steps',
+    False,
+    """Size costar_block_stacking epochs to visit the exact total number of images listed
+    in the costar_block_stacking_manifest.csv files written by costar_block_stacking_split_dataset.py,
+    instead of a fixed 8 images per example. If some example files are not in a manifest,
+    the mean number of images per example is used for every example. Example files that
+    the manifests list as having no images are always skipped.
+    """
+)
+
 FLAGS = flags.FLAGS
 
 
@@ -603,52 +636,80 @@ def run_training(
             sess.run(init_op)
 
         print('check 2 - train_steps: ' + str(train_steps) + ' validation_steps: ' + str(validation_steps) + ' test_steps: ' + str(test_steps))
+        train_loader = None
+        validation_loader = None
+        workers = FLAGS.data_loader_workers
+        if FLAGS.data_loader == 'process':
+            if hasattr(train_data, 'shard'):
+                print('Loading training data with ' + str(workers) + ' worker processes')
+                train_loader = SequenceProcessLoader(train_data, workers=workers)
+                train_data = train_loader
+                if hasattr(validation_data, 'shard'):
+                    # keras uses the same number of workers for validation, which will be 0 below
+                    validation_loader = SequenceProcessLoader(validation_data, workers=max(1, workers // 4))
+                    validation_data = validation_loader
+                    # validate on the same batches every epoch, as keras does with a Sequence
+                    callbacks.insert(callbacks.index(csv_logger), keras.callbacks.LambdaCallback(
+                        on_epoch_end=lambda epoch, logs: validation_loader.restart()))
+                # batches are already prepared in the loader processes
+                workers = 0
+            else:
+                print('hypertree_train.py: data_loader process is not supported for dataset ' +
+                      str(dataset_name) + ', loading with threads instead.')
+        elif FLAGS.data_loader != 'thread':
+            raise ValueError('Unsupported data_loader ' + str(FLAGS.data_loader) + ', options are thread and process.')
+        # the csv logger must stay last, so put the throughput logger right before it
+        callbacks.insert(callbacks.index(csv_logger), InputThroughputLogger(loader=train_loader))
         # fit the model
-        # TODO(ahundt) may need to disable multiprocessing for cornell and enable it for costar stacking
-        history = model.fit_generator(
-            train_data,
-            steps_per_epoch=train_steps,
-            epochs=epochs,
-            validation_data=validation_data,
-            validation_steps=validation_steps,
-            callbacks=callbacks,
-            use_multiprocessing=False,
-            workers=20,
-            verbose=0,
-            initial_epoch=initial_epoch)
-
-        #  TODO(ahundt) remove when FineTuningCallback https://github.com/keras-team/keras/pull/9105 is resolved
-        if fine_tuning and fine_tuning_epochs is not None and fine_tuning_epochs > 0:
-            # do fine tuning stage after initial training
-            print('')
-            print('')
-            print('Initial training complete, beginning fine tuning stage')
-            print('------------------------------------------------------')
-            _, optimizer = choose_optimizer(optimizer_name, fine_tuning_learning_rate, [], monitor_loss_name)
-
-            for layer in model.layers:
-                layer.trainable = True
-
-            model.compile(
-                optimizer=optimizer,
-                loss=loss,
-                metrics=metrics)
-
-            # Write out the model summary so we can see statistics
-            with open(log_dir_run_name + '_summary.txt','w') as fh:
-                # Pass the file handle in as a lambda function to make it callable
-                model.summary(print_fn=lambda x: fh.write(x + '\n'))
-
-            # start training!
+        try:
             history = model.fit_generator(
                 train_data,
                 steps_per_epoch=train_steps,
-                epochs=epochs + fine_tuning_epochs + initial_epoch,
+                epochs=epochs,
                 validation_data=validation_data,
                 validation_steps=validation_steps,
                 callbacks=callbacks,
+                use_multiprocessing=False,
+                workers=workers,
                 verbose=0,
-                initial_epoch=epochs + initial_epoch)
+                initial_epoch=initial_epoch)
+
+            #  TODO(ahundt) remove when FineTuningCallback https://github.com/keras-team/keras/pull/9105 is resolved
+            if fine_tuning and fine_tuning_epochs is not None and fine_tuning_epochs > 0:
+                # do fine tuning stage after initial training
+                print('')
+                print('')
+                print('Initial training complete, beginning fine tuning stage')
+                print('------------------------------------------------------')
+                _, optimizer = choose_optimizer(optimizer_name, fine_tuning_learning_rate, [], monitor_loss_name)
+
+                for layer in model.layers:
+                    layer.trainable = True
+
+                model.compile(
+                    optimizer=optimizer,
+                    loss=loss,
+                    metrics=metrics)
+
+                # Write out the model summary so we can see statistics
+                with open(log_dir_run_name + '_summary.txt','w') as fh:
+                    # Pass the file handle in as a lambda function to make it callable
+                    model.summary(print_fn=lambda x: fh.write(x + '\n'))
+
+                # start training!
+                history = model.fit_generator(
+                    train_data,
+                    steps_per_epoch=train_steps,
+                    epochs=epochs + fine_tuning_epochs + initial_epoch,
+                    validation_data=validation_data,
+                    validation_steps=validation_steps,
+                    callbacks=callbacks,
+                    verbose=0,
+                    initial_epoch=epochs + initial_epoch)
+        finally:
+            for loader in [train_loader, validation_loader]:
+                if loader is not None:
+                    loader.close()
 
     elif 'test' in pipeline:
         if test_steps == 0:
@@ -1196,6 +1257,34 @@ def choose_features_and_metrics(feature_combo_name, problem_name, image_shapes=N
     return image_shapes, vector_shapes, data_features, model_name, monitor_loss_name, label_features, monitor_metric_name, loss, metrics, classes, success_only
 
 
+def filter_empty_examples(file_names, split_name=''):
+    """ Remove the costar block stacking example files which the dataset manifests list as having no images.
+
+    Files which are not in a manifest are kept, see block_stacking_manifest.scan_directory().
+    """
+    file_names = list(file_names)
+    manifest_rows = block_stacking_manifest.load_manifest_rows(file_names)
+    kept = [file_name for file_name in file_names
+            if file_name not in manifest_rows or manifest_rows[file_name]['frame_count'] > 0]
+    print('costar_block_stacking ' + split_name + ': ' + str(len(manifest_rows)) + ' of ' + str(len(file_names)) +
+          ' files found in dataset manifests, skipping ' + str(len(file_names) - len(kept)) + ' files without images, total images in manifests: ' +
+          str(sum(max(row['frame_count'], 0) for row in manifest_rows.values())))
+    return kept
+
+
+def count_time_steps(sequence, batch_size):
+    """ Count the images a CostarBlockStackingSequence epoch should visit to see every image once.
+
+    Uses the exact total from the dataset manifests when every example file is in one,
+    otherwise the estimated number of images per example for every example.
+    len(sequence) counts batches, so it is multiplied back up by batch_size.
+    """
+    total_time_steps = sequence.get_total_time_steps()
+    if total_time_steps is not None:
+        return total_time_steps
+    return len(sequence) * batch_size * sequence.get_estimated_time_steps_per_example()
+
+
 def load_dataset(
         label_features=None, data_features=None,
         train_filenames=None, train_size=0,
@@ -1328,9 +1417,17 @@ def load_dataset(
             print('loading train data from: ' + str(train_data_filename))
             train_data = np.genfromtxt(train_data_filename, dtype='str', delimiter=', ')
 
+        # Skip the files the dataset manifests know to be empty or unreadable
+        train_data = filter_empty_examples(train_data, 'train')
+        validation_data = filter_empty_examples(validation_data, 'val')
+        test_data = filter_empty_examples(test_data, 'test')
+
         # We are multiplying by batch size as a hacky workaround because we want the sizing reduction
         # from steps_per_epoch to not be affected by the batch size.
         estimated_time_steps_per_example = 8 * batch_size
+        if FLAGS.costar_exact_time_steps:
+            # CostarBlockStackingSequence reads the exact number from the manifests
+            estimated_time_steps_per_example = None
         # train_data = file_names[:5]
         # test_data = file_names[5:10]
         # validation_data = file_names[10:15]
@@ -1354,9 +1451,14 @@ def load_dataset(
             test_data, batch_size=batch_size, is_training=False, output_shape=output_shape,
             data_features_to_extract=data_features, label_features_to_extract=label_features,
             estimated_time_steps_per_example=estimated_time_steps_per_example)
-        train_size = len(train_data) * train_data.get_estimated_time_steps_per_example()
-        val_size = len(validation_data) * validation_data.get_estimated_time_steps_per_example()
-        test_size = len(test_data) * test_data.get_estimated_time_steps_per_example()
+        if FLAGS.costar_exact_time_steps:
+            train_size = count_time_steps(train_data, batch_size)
+            val_size = count_time_steps(validation_data, batch_size)
+            test_size = count_time_steps(test_data, batch_size)
+        else:
+            train_size = len(train_data) * train_data.get_estimated_time_steps_per_example()
+            val_size = len(validation_data) * validation_data.get_estimated_time_steps_per_example()
+            test_size = len(test_data) * test_data.get_estimated_time_steps_per_example()
         print('check 1 - train size: ' + str(train_size) + ' val_size: ' + str(val_size) + ' test size: ' + str(test_size))
         # train_data = block_stacking_generator(train_data)
         # test_data = block_stacking_generator(test_data)
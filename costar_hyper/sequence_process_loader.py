@@ -0,0 +1,216 @@
+""" Load batches from a keras Sequence in a pool of worker processes.
+
+Python threads are serialized by the GIL, so a pure python data pipeline such
+as CostarBlockStackingSequence gains very little from fit_generator(workers=20).
+SequenceProcessLoader instead splits the list of example files across worker
+processes, and each worker returns its batches through its own ring of shared
+memory buffers.
+
+Batches are taken from the workers in a fixed round robin order and every worker
+has its own random seed, so a run with the same seed and number of workers
+produces the same sequence of batches. restart() goes back to the start of that
+sequence, which keeps validation on the same batches every epoch.
+"""
+import multiprocessing as mp
+import traceback
+from timeit import default_timer
+
+import numpy as np
+from six.moves import queue
+
+from shared_array_buffers import allocate_buffers, read_arrays, write_arrays
+
+
+def _flatten_batch(batch):
+    """ Flatten an (X, y) batch into a list of arrays and a description of its structure.
+    """
+    arrays = []
+    structure = []
+    for part in batch:
+        if isinstance(part, (list, tuple)) and part and all(isinstance(p, np.ndarray) for p in part):
+            arrays.extend(part)
+            structure.append(len(part))
+        else:
+            arrays.append(np.asarray(part))
+            # None marks a part that is a single array
+            structure.append(None)
+    return arrays, structure
+
+
+def _unflatten_batch(arrays, structure):
+    """ Inverse of _flatten_batch().
+    """
+    batch = []
+    i = 0
+    for count in structure:
+        if count is None:
+            batch.append(arrays[i])
+            i += 1
+        else:
+            batch.append(arrays[i:i + count])
+            i += count
+    return tuple(batch)
+
+
+def _sequence_worker(sequence, worker_index, num_workers, buffers, free, ready):
+    """ Generate batches from one shard of the sequence forever, epoch after epoch.
+
+    An exception is sent to the loader through the ready queue, with a slot of None.
+    """
+    try:
+        _sequence_worker_loop(sequence, worker_index, num_workers, buffers, free, ready)
+    except Exception:
+        ready.put((None, traceback.format_exc(), None, None))
+
+
+def _sequence_worker_loop(sequence, worker_index, num_workers, buffers, free, ready):
+    sequence = sequence.shard(worker_index, num_workers)
+    if len(sequence) == 0:
+        raise ValueError('SequenceProcessLoader: worker ' + str(worker_index) + ' has no complete batch to load.')
+    if sequence.seed is not None:
+        # the global numpy random state is used for image augmentation
+        np.random.seed(sequence.seed)
+    while True:
+        for index in range(len(sequence)):
+            arrays, structure = _flatten_batch(sequence[index])
+            slot = free.get()
+            if slot is None:
+                return
+            layout = write_arrays(buffers[slot], arrays)
+            # a batch which does not fit in the buffer goes through the queue instead
+            ready.put((slot, structure, layout, arrays if layout is None else None))
+        sequence.on_epoch_end()
+
+
+class SequenceProcessLoader(object):
+    """ Generate the batches of a keras Sequence in worker processes.
+
+    Worker i calls sequence.shard(i, workers), which must return a copy of the
+    sequence that only visits its share of the examples with its own random state,
+    see CostarBlockStackingSequence.shard(). Every worker needs at least one full
+    batch of examples, so there are at most len(examples) // batch_size workers.
+    Every worker gets queue_size shared memory buffers, sized from one batch
+    generated with is_training=False at startup. A batch that is too large for
+    its buffer is sent through the queue instead.
+
+    Use it as a python generator, for example
+    `model.fit_generator(SequenceProcessLoader(sequence), workers=0, ...)`.
+    An exception in a worker, or a worker that exits, stops the loader
+    and raises a RuntimeError from the next call.
+
+    # Arguments
+
+    sequence: The keras Sequence to load from, it must provide a shard() method.
+    workers: The maximum number of worker processes.
+    queue_size: The number of batches each worker may have waiting.
+    poll_interval: Seconds between checks that a worker is still running while waiting for a batch.
+    """
+    def __init__(self, sequence, workers=4, queue_size=2, poll_interval=1.0):
+        if not hasattr(sequence, 'shard'):
+            raise ValueError('SequenceProcessLoader: ' + str(type(sequence)) +
+                             ' does not support shard(), use the threaded loader instead.')
+        max_workers = len(sequence.list_example_filenames) // sequence.batch_size
+        if max_workers < 1:
+            raise ValueError('SequenceProcessLoader: ' + str(len(sequence.list_example_filenames)) +
+                             ' examples are not enough for one batch of ' + str(sequence.batch_size) + '.')
+        workers = max(1, min(workers, max_workers))
+        self.sequence = sequence
+        self.workers = workers
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.batches = 0
+        self.wait_time = 0.0
+
+        probe = sequence.shard(0, workers)
+        probe.is_training = False
+        arrays, _ = _flatten_batch(probe[0])
+        del probe
+
+        self.buffers = [allocate_buffers(arrays, queue_size) for _ in range(workers)]
+        self.processes = []
+        self._start()
+
+    def _start(self):
+        """ Start the worker processes from the beginning of their shards.
+        """
+        self._next_worker = 0
+        self.free = []
+        self.ready = []
+        self.processes = []
+        for worker_index in range(self.workers):
+            free = mp.Queue()
+            ready = mp.Queue()
+            for slot in range(self.queue_size):
+                free.put(slot)
+            process = mp.Process(
+                target=_sequence_worker,
+                args=(self.sequence, worker_index, self.workers, self.buffers[worker_index], free, ready))
+            process.daemon = True
+            process.start()
+            self.free.append(free)
+            self.ready.append(ready)
+            self.processes.append(process)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        worker_index = self._next_worker
+        self._next_worker = (self._next_worker + 1) % self.workers
+        start = default_timer()
+        slot, structure, layout, arrays = self._get_ready(worker_index)
+        self.wait_time += default_timer() - start
+        if slot is None:
+            self.close()
+            raise RuntimeError('SequenceProcessLoader: worker ' + str(worker_index) +
+                               ' failed with:\n' + structure)
+        if layout is not None:
+            arrays = read_arrays(self.buffers[worker_index][slot], layout)
+        self.free[worker_index].put(slot)
+        self.batches += 1
+        return _unflatten_batch(arrays, structure)
+
+    next = __next__
+
+    def _get_ready(self, worker_index):
+        """ Wait for the next message from a worker, and raise if the worker has exited without sending one.
+        """
+        process = self.processes[worker_index]
+        while True:
+            # a worker that has exited had a full interval to flush its last message
+            alive = process.is_alive()
+            try:
+                return self.ready[worker_index].get(timeout=self.poll_interval)
+            except queue.Empty:
+                if not alive:
+                    exitcode = process.exitcode
+                    self.close()
+                    raise RuntimeError('SequenceProcessLoader: worker ' + str(worker_index) +
+                                       ' exited with code ' + str(exitcode) + ' without sending a batch.')
+
+    def stats(self, reset=True):
+        """ Get the number of batches loaded and the seconds spent waiting for them since the last reset.
+        """
+        stats = {'batches': self.batches, 'wait_time': self.wait_time}
+        if reset:
+            self.batches = 0
+            self.wait_time = 0.0
+        return stats
+
+    def restart(self):
+        """ Go back to the first batch, the workers are restarted with their initial random state.
+
+        The batches that follow are the same as the ones after the loader was created,
+        for example to validate on the same batches every epoch.
+        """
+        self.close()
+        self._start()
+
+    def close(self):
+        """ Stop the worker processes.
+        """
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        self.processes = []
@@ -106,6 +106,108 @@ def test_rotation_encoding():
     test_add_sub_angles(180, 56)
     test_add_sub_angles(340, 56)
 
+def test_grasp_accuracy_xyz_aaxyz_nsc_batch():
+    rng = np.random.RandomState(0)
+    y_true = rng.uniform(size=(200, 8))
+    y_pred = y_true + rng.normal(scale=0.01, size=y_true.shape)
+    # all zero axis, see normalize_axis()
+    y_true[0, 3:6] = 0.5
+    y_pred[1, 3:6] = 0.5
+    for columns in [slice(None), slice(0, 3), slice(3, 8)]:
+        t = y_true[:, columns]
+        p = y_pred[:, columns]
+        for name, max_translation, max_rotation in hypertree_pose_metrics.GRASP_ACC_TIERS:
+            expected = [hypertree_pose_metrics.grasp_accuracy_xyz_aaxyz_nsc_single(
+                ti, pi, max_translation=max_translation, max_rotation=max_rotation) for ti, pi in zip(t, p)]
+            result = hypertree_pose_metrics.grasp_accuracy_xyz_aaxyz_nsc_batch(
+                t, p, max_translation=max_translation, max_rotation=max_rotation)
+            assert np.array_equal(result, expected)
+    expected = [hypertree_pose_metrics.absolute_cart_distance_xyz_aaxyz_nsc_single(t, p) for t, p in zip(y_true, y_pred)]
+    assert np.allclose(hypertree_pose_metrics.absolute_cart_distance_xyz_aaxyz_nsc_batch(y_true, y_pred), expected)
+    expected = [hypertree_pose_metrics.absolute_angle_distance_xyz_aaxyz_nsc_single(t, p) for t, p in zip(y_true, y_pred)]
+    assert np.allclose(hypertree_pose_metrics.absolute_angle_distance_xyz_aaxyz_nsc_batch(y_true, y_pred), expected)
+    expected = [hypertree_pose_metrics.decode_xyz_aaxyz_nsc_to_xyz_qxyzw(t) for t in y_true]
+    assert np.allclose(hypertree_pose_metrics.batch_decode_xyz_aaxyz_nsc_to_xyz_qxyzw(y_true), expected)
+
+def test_batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc():
+    rng = np.random.RandomState(0)
+    batch_xyz_qxyzw = np.concatenate([rng.uniform(-1, 1, (200, 3)), rng.normal(size=(200, 4))], axis=-1)
+    # half unit and half non unit quaternions, plus null rotations and an all zero quaternion
+    batch_xyz_qxyzw[:100, 3:] /= np.linalg.norm(batch_xyz_qxyzw[:100, 3:], axis=-1, keepdims=True)
+    batch_xyz_qxyzw[0, 3:] = [1, 0, 0, 0]
+    batch_xyz_qxyzw[1, 3:] = [-1, 0, 0, 0]
+    batch_xyz_qxyzw[2, 3:] = [0, 0, 0, 0]
+    batch_xyz_qxyzw[3, 3:] = [0, 1, 0, 0]
+    for columns in [slice(None), slice(0, 3)]:
+        x = batch_xyz_qxyzw[:, columns]
+        expected = [hypertree_pose_metrics.encode_xyz_qxyzw_to_xyz_aaxyz_nsc(row) for row in x]
+        encoded = hypertree_pose_metrics.batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(x)
+        assert np.allclose(encoded, expected, rtol=0, atol=1e-12)
+        # random augmentation only moves the translation of some rows by up to 0.5 cm / rescale_meters
+        np.random.seed(0)
+        augmented = hypertree_pose_metrics.batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(x, random_augmentation=0.5)
+        assert np.allclose(augmented[:, 3:], encoded[:, 3:], rtol=0, atol=1e-12)
+        offsets = np.abs(augmented[:, :3] - encoded[:, :3])
+        assert np.all(offsets <= 0.05)
+        assert 0 < np.count_nonzero(np.any(offsets > 0, axis=-1)) < len(x)
+    # round trip of the full encoding, the quaternion columns go through pyquaternion in its [w, x, y, z] order
+    encoded = hypertree_pose_metrics.batch_encode_xyz_qxyzw_to_xyz_aaxyz_nsc(batch_xyz_qxyzw)
+    decoded = hypertree_pose_metrics.batch_decode_xyz_aaxyz_nsc_to_xyz_qxyzw(encoded)
+    assert decoded.shape == batch_xyz_qxyzw.shape
+    assert np.allclose(decoded[:, :3], batch_xyz_qxyzw[:, :3])
+    q = batch_xyz_qxyzw[:, 3:]
+    norms = np.linalg.norm(q, axis=-1)
+    rotations = norms > 0
+    q = q[rotations] / norms[rotations, None]
+    # theta is negated when the axis z component is not negative, see rotation_to_xyz_theta(),
+    # so those rows decode to the inverse rotation
+    q[q[:, 3] >= 0, 1:] *= -1
+    # q and -q are the same rotation
+    assert np.allclose(np.abs(np.sum(decoded[rotations, 3:] * q, axis=-1)), 1)
+    # the all zero quaternion decodes to the null rotation
+    assert np.allclose(decoded[~rotations, 3:], [1, 0, 0, 0])
+
+
+def random_grasp_vectors(rng, n, with_success):
+    """ Random norm_sin2_cos2_hw_yx_6 vectors, optionally with grasp success in front.
+    """
+    vectors = np.concatenate([rng.uniform(0, 1, (n, 2)),
+                              rng.uniform(0.05, 0.3, (n, 2)),
+                              rng.uniform(0.3, 0.7, (n, 2))], axis=-1)
+    if with_success:
+        vectors = np.concatenate([rng.randint(0, 2, (n, 1)), vectors], axis=-1)
+    return vectors
+
+
+def test_batch_intersection_over_union():
+    rng = np.random.RandomState(0)
+    n = 500
+    rects = []
+    for i in range(2):
+        theta = rng.uniform(-np.pi, np.pi, n)
+        rects.append(hypertree_pose_metrics.batch_rectangle_vertices(
+            rng.uniform(0.05, 0.3, n), rng.uniform(0.05, 0.3, n),
+            rng.uniform(0.4, 0.6, n), rng.uniform(0.4, 0.6, n),
+            np.sin(theta), np.cos(theta)))
+    expected = [hypertree_pose_metrics.shapely_intersection_over_union(r0, r1) for r0, r1 in zip(*rects)]
+    assert np.allclose(hypertree_pose_metrics.batch_intersection_over_union(*rects), expected)
+    assert np.allclose(hypertree_pose_metrics.batch_intersection_over_union(rects[0], rects[0]), 1.0)
+    expected = [hypertree_pose_metrics.shapely_intersection_over_union(rects[0][0], r1) for r1 in rects[1]]
+    assert np.allclose(hypertree_pose_metrics.intersection_over_union_one_vs_many(rects[0][0], rects[1]), expected)
+
+
+def test_grasp_jaccard_batch():
+    rng = np.random.RandomState(0)
+    for with_success in [False, True]:
+        y_true = random_grasp_vectors(rng, 500, with_success)
+        y_pred = y_true + rng.normal(scale=0.05, size=y_true.shape)
+        if with_success:
+            y_pred[:, 0] = np.where(rng.uniform(size=500) < 0.8, y_true[:, 0], 1 - y_true[:, 0])
+        # jaccard_score() modifies its arguments
+        expected = [hypertree_pose_metrics.jaccard_score(t.copy(), p.copy()) for t, p in zip(y_true, y_pred)]
+        assert np.array_equal(hypertree_pose_metrics.grasp_jaccard_batch(y_true, y_pred), expected)
+        assert hypertree_pose_metrics.grasp_jaccard_one_vs_many(y_true, y_true[3]) == 1.0
+
 if __name__ == '__main__':
     test_add_sub_angles(1, 28)
     pytest.main([__file__])
\ No newline at end of file
@@ -0,0 +1,60 @@
+import copy
+import os
+
+import numpy as np
+import pytest
+
+from sequence_process_loader import SequenceProcessLoader
+
+
+class FakeSequence(object):
+    """ A minimal sequence with shard(), which can fail on its second batch.
+    """
+    def __init__(self, num_examples=8, batch_size=2, fail=None):
+        self.list_example_filenames = list(range(num_examples))
+        self.batch_size = batch_size
+        self.seed = 0
+        self.is_training = True
+        self.fail = fail
+        self.examples = self.list_example_filenames
+
+    def shard(self, index, count):
+        sequence = copy.copy(self)
+        sequence.examples = self.list_example_filenames[index::count]
+        return sequence
+
+    def __len__(self):
+        return len(self.examples) // self.batch_size
+
+    def __getitem__(self, index):
+        if index == 1 and self.fail == 'raise':
+            raise IOError('corrupt example')
+        if index == 1 and self.fail == 'exit':
+            os._exit(3)
+        return np.full((self.batch_size, 3), index), np.ones(self.batch_size)
+
+    def on_epoch_end(self):
+        pass
+
+
+def test_restart():
+    loader = SequenceProcessLoader(FakeSequence(), workers=2)
+    try:
+        first = [next(loader)[0] for _ in range(4)]
+        loader.restart()
+        again = [next(loader)[0] for _ in range(4)]
+    finally:
+        loader.close()
+    assert all(np.array_equal(a, b) for a, b in zip(first, again))
+
+
+@pytest.mark.parametrize('fail, message', [('raise', 'corrupt example'), ('exit', 'exited with code 3')])
+def test_worker_failure(fail, message):
+    loader = SequenceProcessLoader(FakeSequence(fail=fail), workers=2, poll_interval=0.1)
+    try:
+        with pytest.raises(RuntimeError) as excinfo:
+            for _ in range(4):
+                next(loader)
+    finally:
+        loader.close()
+    assert message in str(excinfo.value)
@@ -14,6 +14,7 @@ import keras.backend as K
 import keras.optimizers as optimizers
 
 from .datasets.image import *
+from .datasets.prefetch import BatchPrefetcher
 from .plotting import *
 
 class AbstractAgentBasedModel(object):
@@ -104,6 +105,8 @@ class AbstractAgentBasedModel(object):
             model_directory="./",
             reqs_directory=None,
             max_img_size=224,
+            num_workers=0,
+            prefetch=4,
             *args, **kwargs):
 
         if lr == 0 or lr < 1e-30:
@@ -173,6 +176,8 @@ class AbstractAgentBasedModel(object):
         self.option_num = option_num
         self.load_jpeg = False
         self.max_img_size = max_img_size
+        self.num_workers = num_workers
+        self.prefetch = prefetch
 
         if self.noise_dim < 1:
             self.use_noise = False
@@ -274,14 +279,14 @@ class AbstractAgentBasedModel(object):
         raise NotImplementedError('_getData() requires a dataset.')
 
     def trainGenerator(self, dataset):
-        return self._yieldLoop(dataset.sampleTrain)
+        return self._yieldLoop(dataset.sampleTrain, self.steps_per_epoch)
 
     def testGenerator(self, dataset):
         if self.validation_steps is None:
             # update the validation steps if we did not already set it --
             # something proportional to the amount of validation data we have
             self.validation_steps = len(dataset.test) + 1
-        return self._yieldLoop(dataset.sampleTest)
+        return self._yieldLoop(dataset.sampleTest, self.validation_steps)
 
     def _genRandomIndexes(self, length, random_draw):
       ''' Common method to generate random indexes for getData '''
@@ -290,78 +295,105 @@ class AbstractAgentBasedModel(object):
       return indexes
 
 
-    def _yieldLoop(self, sampleFn):
+    def _yieldLoop(self, sampleFn, steps=None):
       '''
       This helper function runs in a loop infinitely, executing some callable
       to extract a set of feature information from a dataset file, and then
       performs any necessary preprocessing on it.
 
+      If num_workers is set, batches are built by a pool of worker processes
+      and prefetched (see BatchPrefetcher), and the time spent waiting on
+      either side of the queue is printed every steps batches.
+
       Parameters:
       -----------
       sampleFn: callable to receive a feature dict and file name
+      steps: number of batches in an epoch, for reporting
       '''
-      # Infinite loop for yielding (generator)
-      while True:
-            drawn_samples = 0
-            features, targets = [], []
-            while drawn_samples < self.batch_size:
-
-                # Sample one random file to read and its name
-                sampler, filename = sampleFn()
-                with sampler as filedata:
-                    if len(filedata.keys()) == 0:
-                        print("WARNING: ", filename, "has no keys")
-                        continue
-
-                    # Randomly choose how many to draw from this file
-                    to_draw = np.random.randint(1, self.batch_size - drawn_samples + 1)
-
-                    # Draw the random samples from the file
-                    ffeatures, ftargets = self._getDataRandom(random_draw=to_draw, **filedata)
-
-                if len(ffeatures) == 0 or len(ffeatures[0]) == 0:
-                    #print("WARNING: ", filename, "was empty after getData.")
+      if self.num_workers < 1:
+          # Infinite loop for yielding (generator)
+          while True:
+              yield self._makeBatch(sampleFn)
+
+      prefetcher = BatchPrefetcher(lambda: self._makeBatch(sampleFn),
+                                   num_workers=self.num_workers,
+                                   queue_size=self.prefetch)
+      try:
+          while True:
+              yield prefetcher.next()
+              if steps is not None and prefetcher.batches >= steps:
+                  stats = prefetcher.stats()
+                  print("\nInput pipeline: %d batches, waited %.2fs for "
+                        "batches, workers waited %.2fs for free buffers" % (
+                            stats["batches"], stats["consumer_stall"],
+                            stats["producer_stall"]))
+      finally:
+          prefetcher.close()
+
+    def _makeBatch(self, sampleFn):
+        '''
+        Build one batch: draw samples from random files until there are
+        batch_size of them, then convert and resize images.
+        '''
+        drawn_samples = 0
+        features, targets = [], []
+        while drawn_samples < self.batch_size:
+
+            # Sample one random file to read and its name
+            sampler, filename = sampleFn()
+            with sampler as filedata:
+                if len(filedata.keys()) == 0:
+                    print("WARNING: ", filename, "has no keys")
                     continue
 
-                actually_drawn = len(ffeatures[0])
-                drawn_samples += actually_drawn
-
-                # Concatenate
-                if features == []:
-                    features = [[x] for x in ffeatures]
-                else:
-                    for old, new in zip(features, ffeatures):
-                        old.append(new)
-
-                if targets == []:
-                    targets = [[x] for x in ftargets]
-                else:
-                    for old, new in zip(targets, ftargets):
-                        old.append(new)
-
-            # Concatenate every feature/target with numpy
-            features = [np.concatenate(f) for f in features]
-            targets = [np.concatenate(t) for t in targets]
-
-            # Sanity check
-            n_samples = features[0].shape[0]
-            for f in features:
-                if f.shape[0] != n_samples:
-                    print(f.shape, n_samples)
-                    raise ValueError("Feature lengths are not equal!")
-
-            #print("Collected ", n_samples, " samples") #debug
-
-            # Final conversion for some kinds of data
-            self._convert(features)
-            self._convert(targets)
-
-            # Resize if necessary
-            self._resize(features)
-            self._resize(targets)
-
-            # Yield so it's a generator
-            yield features, targets
+                # Randomly choose how many to draw from this file
+                to_draw = np.random.randint(1, self.batch_size - drawn_samples + 1)
+
+                # Draw the random samples from the file
+                ffeatures, ftargets = self._getDataRandom(random_draw=to_draw, **filedata)
+
+            if len(ffeatures) == 0 or len(ffeatures[0]) == 0:
+                #print("WARNING: ", filename, "was empty after getData.")
+                continue
+
+            actually_drawn = len(ffeatures[0])
+            drawn_samples += actually_drawn
+
+            # Concatenate
+            if features == []:
+                features = [[x] for x in ffeatures]
+            else:
+                for old, new in zip(features, ffeatures):
+                    old.append(new)
+
+            if targets == []:
+                targets = [[x] for x in ftargets]
+            else:
+                for old, new in zip(targets, ftargets):
+                    old.append(new)
+
+        # Concatenate every feature/target with numpy
+        features = [np.concatenate(f) for f in features]
+        targets = [np.concatenate(t) for t in targets]
+
+        # Sanity check
+        n_samples = features[0].shape[0]
+        for f in features:
+            if f.shape[0] != n_samples:
+                print(f.shape, n_samples)
+                raise ValueError("Feature lengths are not equal!")
+
+        #print("Collected ", n_samples, " samples") #debug
+
+        # Final conversion for some kinds of data
+        self._convert(features)
+        self._convert(targets)
+
+        # Resize if necessary
+        self._resize(features)
+        self._resize(targets)
+
+        return features, targets
 
     def _getDataRandom(self, random_draw, **kwargs):
         '''
@@ -10,6 +10,7 @@ import numpy as np
 from .datasets.npz import NpzDataset
 from .datasets.npy_generator import NpzGeneratorDataset
 from .datasets.h5f_generator import H5fGeneratorDataset
+from .datasets.shard_generator import ShardGeneratorDataset
 
 def GetDataset(args):
 
@@ -27,6 +28,9 @@ def GetDataset(args):
     elif data_type == "h5f":
         dataset = H5fGeneratorDataset(root)
         data = dataset.load(success_only = args['success_only'])
+    elif data_type == "shard":
+        dataset = ShardGeneratorDataset(root)
+        data = dataset.load(success_only = args['success_only'])
     else:
         raise NotImplementedError('data type not implemented: %s'%data_type)
     return data, dataset
@@ -2,3 +2,5 @@ from .tfrecord import TFRecordConverter
 from .npz import NpzDataset
 from .h5f import H5fDataset
 from .npy_generator import NpzGeneratorDataset
+from .shard import ShardDataset
+from .shard_generator import ShardGeneratorDataset
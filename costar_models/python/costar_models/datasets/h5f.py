@@ -4,6 +4,7 @@ import h5py as h5f
 import numpy as np
 import os
 import datetime
+import six
 
 class H5fDataset(object):
     '''
@@ -40,6 +41,16 @@ class H5fDataset(object):
             f.create_dataset(key, data=value)
         f.close()
 
+    def stream(self, tmp_filename, image_types=[], chunk_rows=16):
+        '''
+        Start writing an example to disk one timestep at a time, see H5fStreamWriter.
+
+        tmp_filename: name of the file to write while the example is in progress,
+            it is renamed when the example is finalized.
+        '''
+        return H5fStreamWriter(os.path.join(self.name, tmp_filename), image_types=image_types,
+                               chunk_rows=chunk_rows, verbose=self.verbose)
+
     def load(self,success_only=False):
         '''
         Read a whole set of data files in. This part could definitely be
@@ -63,3 +74,186 @@ class H5fDataset(object):
         Create train/val/test splits
         '''
         raise RuntimeError('h5f does not yet support train/test splits')
+
+
+def _as_h5f_array(value):
+    '''
+    Convert one value to a numpy array that h5py can store, strings become
+    fixed length bytes the same way np.asarray() stores python 2 strings.
+    '''
+    if value is None:
+        return np.asarray(b'')
+    if isinstance(value, six.text_type):
+        value = value.encode('utf-8')
+    if isinstance(value, bytes):
+        return np.asarray(value)
+    value = np.asarray(value)
+    if value.dtype.kind == 'O' and value.shape == ():
+        # such as np.copy(None) or np.copy() of a python 3 str
+        return _as_h5f_array(value.item())
+    if value.dtype.kind == 'U':
+        value = np.char.encode(value, 'utf-8')
+    elif value.dtype.kind == 'O':
+        raise TypeError('H5fStreamWriter cannot store values of type: ' + str(type(value.flat[0])))
+    return value
+
+
+class H5fStreamWriter(object):
+    '''
+    Write an example to an h5f file one timestep at a time.
+
+    Every key becomes a chunked dataset that grows along its first axis, so
+    memory use stays flat during long examples and finalizing an example only
+    has to close and rename the file. The file is written under a temporary
+    name and finalize() renames it, so a half written example never appears
+    under its final name.
+
+    Rows are held in memory until there are chunk_rows of them and then written
+    as one whole chunk, so every compressed chunk is written once instead of
+    being read back, decompressed and recompressed by every single row append.
+    flush() writes the rows that are still pending.
+
+    Strings and encoded images are stored as fixed length bytes, as np.asarray()
+    stores them when the whole example is written at once. The length has some
+    headroom and grows as longer values arrive, and these datasets are compressed
+    so the padding takes almost no space.
+    '''
+
+    def __init__(self, filename, image_types=[], chunk_rows=16, verbose=0):
+        self.tmp_filename = filename
+        self.chunk_rows = chunk_rows
+        self.verbose = verbose
+        self.lengths = {}
+        # rows not written to the file yet, and the shape of every row of each key
+        self.pending = {}
+        self.shapes = {}
+        self.file = h5f.File(filename, 'w')
+        for (img_type_str, img_format_str) in image_types:
+            self.file.create_dataset("type_" + img_type_str, data=[img_format_str])
+
+    def _create(self, key, row):
+        dtype = row.dtype
+        compression = None
+        compression_opts = None
+        if dtype.kind == 'S':
+            # headroom so slightly longer strings and images don't need a resize
+            dtype = np.dtype('S' + str(max(16, dtype.itemsize * 5 // 4)))
+            compression = 'gzip'
+            compression_opts = 1
+        if self.verbose > 0:
+            print('H5fStreamWriter creating key: ' + str(key) + ' dtype: ' + str(dtype) + ' shape: ' + str(row.shape))
+        self.file.create_dataset(
+            key, shape=(0,) + row.shape, maxshape=(None,) + row.shape,
+            chunks=(self.chunk_rows,) + row.shape, dtype=dtype,
+            compression=compression, compression_opts=compression_opts)
+
+    def _widen_strings(self, key, itemsize):
+        '''
+        Copy a fixed length bytes dataset into a new one that holds longer values.
+        '''
+        old = self.file[key]
+        itemsize = max(itemsize * 5 // 4, old.dtype.itemsize * 3 // 2)
+        tmp_key = key + '__widen'
+        new = self.file.create_dataset(
+            tmp_key, shape=old.shape, maxshape=old.maxshape, chunks=old.chunks,
+            dtype=np.dtype('S' + str(itemsize)), compression='gzip', compression_opts=1)
+        for start in range(0, old.shape[0], self.chunk_rows):
+            new[start:start + self.chunk_rows] = old[start:start + self.chunk_rows]
+        del self.file[key]
+        self.file.move(tmp_key, key)
+
+    def extend(self, key, rows):
+        '''
+        Append rows to the dataset key, creating it from the first row.
+        Whole chunks of rows are written as soon as they are complete.
+        '''
+        rows = [_as_h5f_array(row) for row in rows]
+        if not rows:
+            return
+        if key not in self.lengths:
+            self.shapes[key] = rows[0].shape
+            self.pending[key] = []
+            self.lengths[key] = 0
+        if any(row.shape != self.shapes[key] for row in rows):
+            raise ValueError('H5fStreamWriter key ' + str(key) + ' has rows of shape ' +
+                             str(self.shapes[key]) + ' but got shapes ' + str([row.shape for row in rows]))
+        pending = self.pending[key]
+        pending.extend(rows)
+        self.lengths[key] += len(rows)
+        full = len(pending) - len(pending) % self.chunk_rows
+        if full > 0:
+            self._write_rows(key, pending[:full])
+            del pending[:full]
+
+    def _write_rows(self, key, rows):
+        '''
+        Write rows to the end of the dataset key in the file.
+        '''
+        if key not in self.file:
+            self._create(key, rows[0])
+        dataset = self.file[key]
+        if dataset.dtype.kind == 'S':
+            itemsize = max(row.dtype.itemsize for row in rows)
+            if itemsize > dataset.dtype.itemsize:
+                self._widen_strings(key, itemsize)
+                dataset = self.file[key]
+        start = dataset.shape[0]
+        dataset.resize(start + len(rows), axis=0)
+        dataset[start:] = np.stack(rows).astype(dataset.dtype)
+
+    def flush(self):
+        '''
+        Write every pending row to the file.
+        '''
+        for key, pending in self.pending.items():
+            if pending:
+                self._write_rows(key, pending)
+                del pending[:]
+
+    def append(self, key, value):
+        '''
+        Append one row to the dataset key.
+        '''
+        self.extend(key, [value])
+
+    def append_row(self, row):
+        '''
+        Append one timestep, a dictionary from key to value.
+        '''
+        for key, value in row.items():
+            self.append(key, value)
+
+    def write(self, key, value):
+        '''
+        Write a whole dataset at once, for data that isn't recorded every timestep.
+        '''
+        if key in self.file:
+            del self.file[key]
+        self.lengths.pop(key, None)
+        self.pending.pop(key, None)
+        self.shapes.pop(key, None)
+        self.file.create_dataset(key, data=value)
+
+    def __len__(self):
+        '''
+        The number of rows in the longest dataset.
+        '''
+        return max(self.lengths.values()) if self.lengths else 0
+
+    def finalize(self, filename):
+        '''
+        Write the pending rows, close the file and atomically rename it to
+        filename in the same folder.
+        '''
+        self.flush()
+        self.file.close()
+        filename = os.path.join(os.path.dirname(self.tmp_filename), filename)
+        os.rename(self.tmp_filename, filename)
+        return filename
+
+    def abort(self):
+        '''
+        Close and delete the unfinished file.
+        '''
+        self.file.close()
+        os.remove(self.tmp_filename)
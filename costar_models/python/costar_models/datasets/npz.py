@@ -2,6 +2,7 @@ from __future__ import print_function
 
 import numpy as np
 import os
+import zipfile
 
 
 class NpzDataset(object):
@@ -37,42 +38,132 @@ class NpzDataset(object):
             example["image_type"] = image_type
         np.savez(filename, **example)
 
-    def load(self,success_only=False):
+    def files(self, success_only=False):
         '''
-        Read a whole set of data files in. This part could definitely be
-        faster/more efficient.
+        List the example files in this dataset, in sorted order.
+
+        Parameters:
+        -----------
+        success_only: exclude examples without the "success" tag in their
+                      filename.
+        '''
+        files = sorted(os.listdir(self.name))
+        files = [f for f in files if not f[0] == '.']
+        if success_only:
+            files = [f for f in files if 'success' in f.split('.')[1:-1]]
+        return files
+
+    def index(self, success_only=False):
+        '''
+        Read the shape and dtype of every array in every file, without
+        decompressing any array data: only the .npy headers inside each
+        archive are read.
+
+        Returns:
+        --------
+        index: list of (filename, {key: (shape, dtype)}) tuples.
+        '''
+        index = []
+        for i, f in enumerate(self.files(success_only)):
+            print("%d:"%(i+1), f)
+            entries = {}
+            with zipfile.ZipFile(os.path.join(self.name, f)) as archive:
+                for member in archive.namelist():
+                    if not member.endswith('.npy'):
+                        continue
+                    with archive.open(member) as npy:
+                        version = np.lib.format.read_magic(npy)
+                        if version == (1, 0):
+                            header = np.lib.format.read_array_header_1_0(npy)
+                        else:
+                            header = np.lib.format.read_array_header_2_0(npy)
+                    shape, fortran_order, dtype = header
+                    entries[member[:-len('.npy')]] = (shape, dtype)
+            index.append((f, entries))
+        return index
+
+    def load(self, success_only=False, mmap_dir=None):
+        '''
+        Read a whole set of data files in.
+
+        This makes two passes over the data: first it builds an index of the
+        shape of every array in every file, then it allocates each output
+        array once at its final size and copies every file straight into
+        place. Each file is decompressed exactly once.
 
         Parameters:
         -----------
         success_only: exclude examples without the "success" tag in their
                       filename when loading. Good when learning certain types
                       of models.
+        mmap_dir: if set, the output arrays are memory-mapped .npy files in
+                  this directory instead of arrays held in RAM.
 
         Returns:
         --------
         data: dict of features and other information.
         '''
-        files = os.listdir(self.name)
-        files.sort()
+        index = self.index(success_only)
+
+        # Work out the final size of every key. Scalars (0-d arrays) are not
+        # concatenated; we just keep the first one.
+        rows, shapes, dtypes = {}, {}, {}
+        for f, entries in index:
+            for key, (shape, dtype) in entries.items():
+                if key not in shapes:
+                    shapes[key] = shape
+                    dtypes[key] = dtype
+                    rows[key] = 0
+                else:
+                    dtypes[key] = np.promote_types(dtypes[key], dtype)
+                if len(shape) > 0:
+                    rows[key] += shape[0]
+
         data = {}
-        i = 0
-        for f in files:
-            if not f[0] == '.':
-                i += 1
-                print("%d:"%i, f)
-                if success_only:
-                    name = f.split('.')
-                    if name[0] == 'failure':
-                        continue
-                fdata = np.load(os.path.join(self.name,f))
-                for key, value in fdata.items():
-                    if key not in data:
-                        data[key] = value
-                    if value.shape[0] == 0:
-                        continue
-                    data[key] = np.concatenate([data[key],value],axis=0)
+        for key, shape in shapes.items():
+            if len(shape) == 0:
+                continue
+            full_shape = (rows[key],) + tuple(shape[1:])
+            if mmap_dir is not None:
+                if not os.path.exists(mmap_dir):
+                    os.makedirs(mmap_dir)
+                data[key] = np.lib.format.open_memmap(
+                        os.path.join(mmap_dir, key + ".npy"), mode="w+",
+                        dtype=dtypes[key], shape=full_shape)
+            else:
+                data[key] = np.empty(full_shape, dtype=dtypes[key])
+
+        # Fill everything in place
+        offsets = dict((key, 0) for key in data)
+        for f, fdata in self.generator(success_only, index):
+            for key, value in fdata.items():
+                if len(shapes[key]) == 0:
+                    data.setdefault(key, value)
+                    continue
+                n = value.shape[0]
+                data[key][offsets[key]:offsets[key] + n] = value
+                offsets[key] += n
         return data
 
+    def generator(self, success_only=False, index=None):
+        '''
+        Yield (filename, data) for one example file at a time, without ever
+        materializing the whole dataset.
+
+        Parameters:
+        -----------
+        success_only: skip examples without the "success" tag.
+        index: optional output of index(), to reuse its list of files.
+        '''
+        if index is not None:
+            files = [f for f, _ in index]
+        else:
+            files = self.files(success_only)
+        for f in files:
+            fdata = np.load(os.path.join(self.name, f))
+            yield f, dict(fdata.items())
+            fdata.close()
+
     def preprocess(self, train=0.6, val=0.2):
         '''
         TODO(cpaxton) 
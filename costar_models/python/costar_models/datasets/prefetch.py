@@ -0,0 +1,122 @@
+from __future__ import print_function
+
+import multiprocessing as mp
+import numpy as np
+import timeit
+
+from .shared_array_buffers import allocate_buffers, read_arrays, write_arrays
+
+
+def _prefetchWorker(make_batch, buffers, free, ready, stall, seed):
+    '''
+    Build batches forever, and copy each one into a free shared buffer.
+    '''
+    np.random.seed(seed)
+    while True:
+        features, targets = make_batch()
+        start = timeit.default_timer()
+        slot = free.get()
+        with stall.get_lock():
+            stall.value += timeit.default_timer() - start
+        if slot is None:
+            break
+        arrays = list(features) + list(targets)
+        layout = write_arrays(buffers[slot], arrays)
+        # a batch that does not fit the buffers goes through the queue instead
+        ready.put((slot, len(features), layout,
+                   arrays if layout is None else None))
+
+
+class BatchPrefetcher(object):
+    '''
+    Build training batches in a pool of worker processes.
+
+    Each worker calls make_batch() in a loop, with its own random seed, and
+    copies the (features, targets) it returns into one of queue_size shared
+    memory buffers. Only the slot number and array shapes go through the
+    queue. The consumer copies a batch out of its buffer and hands the buffer
+    back, so at most queue_size batches are ever waiting.
+
+    The buffers are managed with the helpers in shared_array_buffers.
+
+    The size of the buffers is taken from one batch built in the calling
+    process at startup; any later batch that does not fit is sent through the
+    queue instead.
+
+    Stall times are kept so that input-bound and compute-bound training can be
+    told apart: consumer_stall is the time spent waiting for a batch, and
+    producer_stall is the total time the workers spent waiting for a free
+    buffer.
+    '''
+
+    def __init__(self, make_batch, num_workers=2, queue_size=4):
+        self.num_workers = num_workers
+        self.batches = 0
+        self.consumer_stall = 0.
+
+        self._first = make_batch()
+        self.buffers = allocate_buffers(list(self._first[0]) +
+                                        list(self._first[1]), queue_size)
+        self.free = mp.Queue()
+        self.ready = mp.Queue()
+        self.producer_stall = mp.Value('d', 0.)
+        for slot in range(queue_size):
+            self.free.put(slot)
+
+        seeds = np.random.randint(2**31 - 1, size=num_workers)
+        self.workers = []
+        for seed in seeds:
+            worker = mp.Process(target=_prefetchWorker,
+                                args=(make_batch, self.buffers, self.free,
+                                      self.ready, self.producer_stall, seed))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def next(self):
+        '''
+        Return the next (features, targets) batch.
+        '''
+        self.batches += 1
+        if self._first is not None:
+            batch, self._first = self._first, None
+            return batch
+        start = timeit.default_timer()
+        slot, num_features, layout, arrays = self.ready.get()
+        self.consumer_stall += timeit.default_timer() - start
+        if layout is not None:
+            arrays = read_arrays(self.buffers[slot], layout)
+        self.free.put(slot)
+        return arrays[:num_features], arrays[num_features:]
+
+    __next__ = next
+
+    def __iter__(self):
+        return self
+
+    def stats(self, reset=True):
+        '''
+        Return the number of batches consumed and the consumer and producer
+        stall times, in seconds, since the last reset.
+        '''
+        with self.producer_stall.get_lock():
+            producer_stall = self.producer_stall.value
+            if reset:
+                self.producer_stall.value = 0.
+        stats = {"batches": self.batches,
+                 "consumer_stall": self.consumer_stall,
+                 "producer_stall": producer_stall}
+        if reset:
+            self.batches = 0
+            self.consumer_stall = 0.
+        return stats
+
+    def close(self):
+        '''
+        Stop the workers.
+        '''
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
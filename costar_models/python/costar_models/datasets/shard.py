@@ -0,0 +1,342 @@
+from __future__ import print_function
+
+import json
+import numpy as np
+import os
+
+
+class ShardDataset(object):
+    '''
+    Write out examples into a small number of large, fixed-size shard files
+    instead of one compressed archive per example, and read single examples or
+    single timesteps back out of them without decompressing anything.
+
+    Layout of the dataset directory:
+
+        index.json                  global index (see below)
+        index.log                   examples written since index.json
+        shard00000.<key>.dat        rows of numeric key, raw C-order bytes
+        shard00000.<key>.blob       encoded rows (jpeg/png) back to back
+        shard00000.<key>.idx        (offset, length) int64 pair per blob row
+
+    Every key of an example must have the same number of rows (timesteps).
+    Numeric keys are stored uncompressed so they can be read with np.memmap;
+    byte-string keys such as encoded images stay encoded and are stored
+    contiguously in a blob file, with a table of row offsets next to them.
+
+    The index lists the shards (their keys, dtypes and row shapes) and the
+    examples (their shard, first row and number of rows), so the location of
+    timestep t of an example is just row start + t: an O(1) lookup and one
+    seek per key.
+
+    write() only appends a line for each example to index.log, and index.json
+    is rewritten by flush() or close(). Opening the dataset replays the part of
+    the log that index.json does not cover yet, so examples written before a
+    crash are not lost.
+
+    A new shard is started when the current one grows beyond shard_size
+    bytes, when an example has a different set of keys, dtypes or row shapes
+    than the shard it would go in, and whenever the dataset is reopened for
+    writing.
+    '''
+
+    INDEX = "index.json"
+    LOG = "index.log"
+
+    def __init__(self, name, shard_size=512 * 1024 * 1024):
+        '''
+        Create a folder to hold the shards in, or open an existing one.
+
+        Parameters:
+        -----------
+        name: the directory
+        shard_size: shards are closed once they contain this many bytes
+        '''
+        self.name = os.path.expanduser(name)
+        self.shard_size = shard_size
+        try:
+            os.mkdir(self.name)
+        except OSError:
+            pass
+        index_filename = os.path.join(self.name, self.INDEX)
+        if os.path.exists(index_filename):
+            with open(index_filename, "r") as f:
+                self.info = json.load(f)
+        else:
+            self.info = {"version": 1, "shards": [], "examples": []}
+        self.shards = self.info["shards"]
+        self.examples = self.info["examples"]
+        self._log_end = self.info.get("log_size", 0)
+        self._dirty = False
+        self._replayLog()
+        # shard that write() currently appends to; always start a new one
+        # so that half-written rows from an earlier crash are never reused
+        self._current = None
+        self._current_bytes = 0
+        self._mmaps = {}
+
+    def write(self, example, i, r, image_type=None):
+        '''
+        Append an example to the current shard.
+        '''
+        if r > 0.:
+            status = "success"
+        else:
+            status = "failure"
+
+        arrays, attrs, layout = {}, {}, {}
+        length = None
+        for key, value in example.items():
+            value = np.asarray(value)
+            if value.ndim == 0:
+                attrs[key] = value.tolist()
+                continue
+            if length is None:
+                length = value.shape[0]
+            elif value.shape[0] != length:
+                raise ValueError("key %s has %d entries, expected %d"
+                                 % (key, value.shape[0], length))
+            encoded = value.dtype.kind in "SO"
+            if encoded:
+                layout[key] = {"dtype": "|S", "shape": [], "encoded": True}
+            else:
+                layout[key] = {"dtype": value.dtype.str,
+                               "shape": list(value.shape[1:]),
+                               "encoded": False}
+            arrays[key] = value
+        if image_type is not None:
+            attrs["image_type"] = image_type
+        if length is None:
+            raise ValueError("example %d has no data" % i)
+
+        if (self._current is None or layout != self._current["keys"]
+                or self._current_bytes >= self.shard_size):
+            self._current = {"name": "shard%05d" % len(self.shards),
+                             "rows": 0,
+                             "keys": layout}
+            self._current_bytes = 0
+            self.shards.append(self._current)
+
+        shard = self._current
+        base = os.path.join(self.name, shard["name"])
+        for key, value in arrays.items():
+            if layout[key]["encoded"]:
+                with open("%s.%s.blob" % (base, key), "ab") as f:
+                    f.seek(0, os.SEEK_END)
+                    offset = f.tell()
+                    table = np.zeros((length, 2), dtype=np.int64)
+                    for t, raw in enumerate(value):
+                        raw = bytes(raw)
+                        f.write(raw)
+                        table[t] = offset, len(raw)
+                        offset += len(raw)
+                with open("%s.%s.idx" % (base, key), "ab") as f:
+                    f.write(table.tobytes())
+                self._current_bytes += int(table[:, 1].sum()) + table.nbytes
+            else:
+                value = np.ascontiguousarray(value)
+                with open("%s.%s.dat" % (base, key), "ab") as f:
+                    f.write(value.tobytes())
+                self._current_bytes += value.nbytes
+
+        entry = {"example": int(i),
+                 "status": status,
+                 "shard": len(self.shards) - 1,
+                 "start": shard["rows"],
+                 "length": int(length),
+                 "attrs": attrs}
+        record = {"example": entry}
+        if shard["rows"] == 0:
+            record["shard"] = {"name": shard["name"], "keys": layout}
+        self._appendLog(record)
+        self.examples.append(entry)
+        shard["rows"] += int(length)
+        self._mmaps.clear()
+
+    def _appendLog(self, record):
+        '''
+        Append one record to index.log. A partial line left at the end of the
+        log by a crash is cut off first.
+        '''
+        filename = os.path.join(self.name, self.LOG)
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with open(filename, "ab") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() != self._log_end:
+                f.truncate(self._log_end)
+            f.write(line)
+        self._log_end += len(line)
+        self._dirty = True
+
+    def _replayLog(self):
+        '''
+        Add the shards and examples that were appended to index.log after
+        index.json was last written. Stops at a partial last line.
+        '''
+        filename = os.path.join(self.name, self.LOG)
+        if not os.path.exists(filename):
+            self._log_end = 0
+            return
+        with open(filename, "rb") as f:
+            f.seek(self._log_end)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                record = json.loads(line.decode("utf-8"))
+                if "shard" in record:
+                    shard = dict(record["shard"], rows=0)
+                    self.shards.append(shard)
+                entry = record["example"]
+                self.examples.append(entry)
+                self.shards[entry["shard"]]["rows"] += entry["length"]
+                self._log_end += len(line)
+                self._dirty = True
+
+    def flush(self):
+        '''
+        Write index.json, covering everything in index.log so far. It is
+        replaced atomically, so that a reader never sees a partially written
+        index.
+        '''
+        if not self._dirty:
+            return
+        self.info["log_size"] = self._log_end
+        filename = os.path.join(self.name, self.INDEX)
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(self.info, f)
+        os.rename(tmp_filename, filename)
+        self._dirty = False
+
+    def close(self):
+        '''
+        Write the index and forget the open memory maps.
+        '''
+        self.flush()
+        self._mmaps.clear()
+
+    def _mmap(self, shard_idx, key, ext):
+        '''
+        Memory-map one of the files of a shard. Maps are cached, so repeated
+        reads from the same shard do not reopen anything.
+        '''
+        cache_key = (shard_idx, key, ext)
+        mmap = self._mmaps.get(cache_key, None)
+        if mmap is None:
+            shard = self.shards[shard_idx]
+            layout = shard["keys"][key]
+            filename = os.path.join(self.name,
+                                    "%s.%s.%s" % (shard["name"], key, ext))
+            if ext == "idx":
+                dtype, shape = np.int64, (shard["rows"], 2)
+            elif ext == "blob":
+                dtype, shape = np.uint8, (os.path.getsize(filename),)
+            else:
+                dtype = np.dtype(layout["dtype"])
+                shape = (shard["rows"],) + tuple(layout["shape"])
+            if np.prod(shape) == 0:
+                mmap = np.zeros(shape, dtype=dtype)
+            else:
+                mmap = np.memmap(filename, mode="r", dtype=dtype, shape=shape)
+            self._mmaps[cache_key] = mmap
+        return mmap
+
+    def _read(self, shard_idx, key, start, stop):
+        '''
+        Read rows [start, stop) of a key from a shard. Numeric rows are
+        returned as a view of the memory map; encoded rows as an array of byte
+        strings, read with a single contiguous slice of the blob.
+        '''
+        layout = self.shards[shard_idx]["keys"][key]
+        if not layout["encoded"]:
+            return self._mmap(shard_idx, key, "dat")[start:stop]
+        table = self._mmap(shard_idx, key, "idx")[start:stop]
+        if table.shape[0] == 0:
+            return np.array([], dtype="|S1")
+        blob = self._mmap(shard_idx, key, "blob")
+        first = table[0, 0]
+        end = table[-1, 0] + table[-1, 1]
+        raw = blob[first:end].tobytes()
+        return np.array([raw[o - first:o - first + n] for o, n in table])
+
+    def offset(self, example_idx, t, key):
+        '''
+        Byte offset of timestep t of an example in the shard file that holds
+        key: the .dat file for numeric keys, the .blob file for encoded ones.
+        '''
+        entry = self.examples[example_idx]
+        row = entry["start"] + t
+        layout = self.shards[entry["shard"]]["keys"][key]
+        if layout["encoded"]:
+            return int(self._mmap(entry["shard"], key, "idx")[row, 0])
+        row_size = np.dtype(layout["dtype"]).itemsize * \
+            int(np.prod(layout["shape"]))
+        return row * row_size
+
+    def files(self, success_only=False):
+        '''
+        List the examples in this dataset, named like the files NpzDataset
+        would have written for them.
+        '''
+        return [self.exampleName(idx) for idx in self.indices(success_only)]
+
+    def indices(self, success_only=False):
+        '''
+        Positions of the examples in the index, in order.
+        '''
+        return [idx for idx, entry in enumerate(self.examples)
+                if not success_only or entry["status"] == "success"]
+
+    def exampleName(self, example_idx):
+        entry = self.examples[example_idx]
+        return "example%06d.%s" % (entry["example"], entry["status"])
+
+    def numTimesteps(self, example_idx):
+        return self.examples[example_idx]["length"]
+
+    def example(self, example_idx):
+        '''
+        Return every key of one example as a dict, without decompressing
+        anything.
+        '''
+        entry = self.examples[example_idx]
+        start = entry["start"]
+        stop = start + entry["length"]
+        data = {}
+        for key in self.shards[entry["shard"]]["keys"]:
+            data[key] = self._read(entry["shard"], key, start, stop)
+        for key, value in entry["attrs"].items():
+            data[key] = np.array(value)
+        return data
+
+    def timestep(self, example_idx, t):
+        '''
+        Return a single timestep of one example as a dict of arrays with a
+        leading dimension of 1.
+        '''
+        entry = self.examples[example_idx]
+        if t < 0 or t >= entry["length"]:
+            raise IndexError("example %d has %d timesteps"
+                             % (example_idx, entry["length"]))
+        row = entry["start"] + t
+        data = {}
+        for key in self.shards[entry["shard"]]["keys"]:
+            data[key] = self._read(entry["shard"], key, row, row + 1)
+        return data
+
+    def load(self, success_only=False):
+        '''
+        Read the whole dataset into one dict of concatenated arrays, like
+        NpzDataset.load().
+        '''
+        indices = self.indices(success_only)
+        data = {}
+        for idx in indices:
+            for key, value in self.example(idx).items():
+                data.setdefault(key, []).append(value)
+        for key, values in data.items():
+            if values[0].ndim == 0:
+                data[key] = values[0]
+            else:
+                data[key] = np.concatenate(values, axis=0)
+        return data
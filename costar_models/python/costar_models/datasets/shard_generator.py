@@ -0,0 +1,82 @@
+from __future__ import print_function
+
+import numpy as np
+import os
+
+from .npy_generator import NpzGeneratorDataset
+from .shard import ShardDataset
+
+
+class ShardGeneratorDataset(NpzGeneratorDataset):
+    '''
+    Generate samples from a dataset written by ShardDataset.
+
+    Examples are named like the files of an npz dataset ("example000012.success")
+    so the rest of the training tool can treat them the same way. Opening an
+    example only maps the relevant rows of each shard file.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(ShardGeneratorDataset, self).__init__(*args, **kwargs)
+        self.file_extension = 'shard'
+        self.shards = None
+        self.example_idx = {}
+
+    def load(self, success_only=False, verbose=0, max_img_size=224):
+        '''
+        Read the shard index; get the list of acceptable examples; split into
+        train and test sets.
+        '''
+        self.shards = ShardDataset(self.name)
+        indices = self.shards.indices(success_only)
+        names = []
+        for idx in indices:
+            name = self.shards.exampleName(idx)
+            self.example_idx[name] = idx
+            names.append(name)
+        if verbose > 0:
+            print('examples that will be used in dataset: \n' + str(names))
+
+        sample = {}
+        if len(indices) > 0:
+            print('Extracting dataset structure from example: ' + names[0])
+            sample = self.shards.example(indices[0])
+
+        length = max(1, int(self.split * len(names)))
+        print("---------------------------------------------")
+        print("Loaded data.")
+        print("# Total examples:", len(names))
+        print("# Validation examples:", length)
+        print("---------------------------------------------")
+        self.test = names[:length]
+        self.train = names[length:]
+        np.random.shuffle(self.test)
+        np.random.shuffle(self.train)
+        return sample
+
+    def sampleTrainFilename(self):
+        return self.train[np.random.randint(len(self.train))]
+
+    def sampleTestFilename(self):
+        return self.test[np.random.randint(len(self.test))]
+
+    def loadTest(self, i):
+        if i > len(self.test):
+            raise RuntimeError('index %d greater than number of files' % i)
+        filename = self.test[i]
+        return self._load(filename), 'success' in filename
+
+    def sampleTrain(self):
+        filename = self.sampleTrainFilename()
+        return self._load(filename), filename
+
+    def sampleTest(self):
+        filename = self.sampleTestFilename()
+        return self._load(filename), filename
+
+    def loadFile(self, filename):
+        return self._load(os.path.basename(filename))
+
+    # Interface for `with`
+    def __enter__(self):
+        return self.shards.example(self.example_idx[self.file])
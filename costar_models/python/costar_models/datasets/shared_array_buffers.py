@@ -0,0 +1,65 @@
+""" Pass lists of numpy arrays between processes through shared memory buffers.
+
+A producer process copies a batch of arrays into a free multiprocessing.RawArray
+with write_arrays(), and only the small layout it returns goes through a queue.
+The consumer copies the arrays back out with read_arrays() and hands the buffer back.
+Used by BatchPrefetcher. costar_hyper keeps a copy for its SequenceProcessLoader.
+"""
+import multiprocessing as mp
+
+import numpy as np
+
+
+def array_layout(arrays):
+    """ Compute where each array goes in a flat byte buffer.
+
+    # Returns
+
+    A list of (dtype, shape, offset) and the total number of bytes,
+    or (None, 0) if one of the arrays cannot be stored as raw bytes.
+    """
+    layout = []
+    offset = 0
+    for x in arrays:
+        if x.dtype.hasobject:
+            return None, 0
+        layout.append((x.dtype.str, x.shape, offset))
+        # keep every array aligned for its dtype
+        offset += x.nbytes + (-x.nbytes) % 16
+    return layout, offset
+
+
+def allocate_buffers(arrays, count):
+    """ Allocate count shared buffers which are each large enough to hold arrays.
+    """
+    _, nbytes = array_layout(arrays)
+    return [mp.RawArray('b', max(nbytes, 1)) for _ in range(count)]
+
+
+def write_arrays(buffer, arrays):
+    """ Copy a list of arrays into a shared buffer.
+
+    # Returns
+
+    The layout to pass to read_arrays(), or None if the arrays do not fit
+    in the buffer and have to be sent some other way, such as through the queue.
+    """
+    layout, nbytes = array_layout(arrays)
+    if layout is None or nbytes > len(buffer):
+        return None
+    buf = np.frombuffer(buffer, dtype=np.uint8)
+    for x, (_, _, offset) in zip(arrays, layout):
+        buf[offset:offset + x.nbytes] = np.ascontiguousarray(x).view(np.uint8).reshape(-1)
+    return layout
+
+
+def read_arrays(buffer, layout):
+    """ Copy the arrays that write_arrays() put in a shared buffer back out, so the buffer can be reused.
+    """
+    buf = np.frombuffer(buffer, dtype=np.uint8)
+    arrays = []
+    for dtype, shape, offset in layout:
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        arrays.append(buf[offset:offset + size].view(dtype).reshape(shape).copy())
+    return arrays
@@ -216,6 +216,16 @@ def GetModelParser():
     parser.add_argument("--max_img_size",
                         help="Set max size for frames to be resized into",
                         default=224)
+    parser.add_argument("--num_workers",
+                        help="number of processes building batches in the "
+                             "background; 0 builds them on the training "
+                             "thread",
+                        type=int,
+                        default=0)
+    parser.add_argument("--prefetch",
+                        help="number of batches to build ahead of training",
+                        type=int,
+                        default=4)
     return parser
 
 def GetSubmodelOptions():
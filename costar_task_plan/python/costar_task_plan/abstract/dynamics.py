@@ -5,6 +5,10 @@ from world import *
 class AbstractActor(object):
 
   actor_type = ''
+
+  # Static actors never act or move: the world skips evaluate() and update()
+  # for them, and forked worlds share them instead of copying them.
+  static = False
   
   def __init__(self, state=None, policy=None, dynamics=None, features=None):
     self.policy = policy
@@ -67,6 +71,14 @@ class AbstractDynamics(object):
   def apply(self, state, action):
     raise Exception('dynamics.apply not implemented')
 
+  def applyBatch(self, states, actions, dt):
+    '''
+    Step a list of states forward with the matching list of actions; used by
+    AbstractWorld.tickBatch(). Override this to vectorize the update for
+    dynamics whose states can be stacked into arrays.
+    '''
+    return [self(state, action, dt) for state, action in zip(states, actions)]
+
 # AbstractPolicy
 # Policy class governs what actions are chosen.
 # It takes a world state plus some extra information (determining for example
@@ -0,0 +1,27 @@
+from __future__ import print_function
+
+import copy
+
+from costar_task_plan.abstract.world import WorldHistory
+
+
+def test_history_maxlen():
+    for maxlen in [1, 2, 3]:
+        history = WorldHistory(maxlen)
+        for i in range(5):
+            history.append(i)
+            assert len(history) == min(i + 1, maxlen)
+        assert list(history) == list(range(5 - maxlen, 5))
+
+
+def test_history_copy():
+    history = WorldHistory(3, range(3))
+    forked = copy.copy(history)
+    forked.append(3)
+    assert list(history) == [0, 1, 2]
+    assert list(forked) == [1, 2, 3]
+
+
+if __name__ == '__main__':
+    test_history_maxlen()
+    test_history_copy()
@@ -6,6 +6,46 @@ from collections import deque
 from action import AbstractAction
 from state import AbstractState
 
+class WorldHistory(object):
+  '''
+  Bounded history of (features, action code) pairs, used in place of a deque.
+  Entries are kept in an immutable tuple, so that forked worlds can share the
+  same history: copying a history is O(1), and appending to one copy never
+  changes any of the others.
+  '''
+
+  def __init__(self, maxlen, entries=()):
+    self.maxlen = maxlen
+    self._entries = tuple(entries)[-maxlen:] if maxlen > 0 else ()
+
+  def append(self, entry):
+    if self.maxlen <= 0:
+      return
+    if len(self._entries) >= self.maxlen:
+      self._entries = self._entries[len(self._entries) - self.maxlen + 1:] + (entry,)
+    else:
+      self._entries = self._entries + (entry,)
+
+  def popleft(self):
+    entry = self._entries[0]
+    self._entries = self._entries[1:]
+    return entry
+
+  def clear(self):
+    self._entries = ()
+
+  def __copy__(self):
+    return WorldHistory(self.maxlen, self._entries)
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __getitem__(self, idx):
+    return self._entries[idx]
+
+  def __iter__(self):
+    return iter(self._entries)
+
 class AbstractWorld(object):
   '''
   Nonspecific implementation that encapsulates a particular RL/planning problem.
@@ -40,7 +80,13 @@ class AbstractWorld(object):
 
     # history stores features;
     self.history_length = history_length
-    self.history = deque()
+    self.history = WorldHistory(history_length)
+
+    # Indices of actors this world may modify in place. Actors that are not
+    # in this set are shared with the world this one was forked from (or
+    # with worlds forked from this one), and are copied before tick()
+    # changes them.
+    self._owned_actors = set()
 
     # We only update this when we would FORK the world. it helps us make our
     # higher level decisions.
@@ -133,8 +179,19 @@ class AbstractWorld(object):
     actor.state.updatePredicates(self, actor)
     self.actors.append(actor)
     self.num_actors = len(self.actors)
+    self._owned_actors.add(actor_id)
     return actor_id
 
+  def _writableActor(self, idx):
+    '''
+    Copy-on-write access to an actor: make sure this world has its own copy
+    of actor idx before anything changes it, and return that copy.
+    '''
+    if idx not in self._owned_actors:
+      self.actors[idx] = copy.copy(self.actors[idx])
+      self._owned_actors.add(idx)
+    return self.actors[idx]
+
   def addCondition(self, condition, weight, name):
     self.conditions.append((condition, weight, name))
 
@@ -170,15 +227,12 @@ class AbstractWorld(object):
 
     Create a copy of the world and tick() with the appropriate new action. If
     we have policies, actors will be reset appropriately to use new policies.
-    '''
-    new_world = copy.copy(self)
-    # NOTE: this is where the inefficiency lies.
-    #new_world.actors = copy.deepcopy(self.actors)
-    new_world.actors = [copy.copy(actor) for actor in self.actors]
-    new_world.updateTraceID()
 
-    # Make sure new world has a separate history with the same few entries
-    new_world.history = copy.copy(self.history)
+    Actors are not copied here: both worlds share them, and each world only
+    copies an actor when tick() is about to change it. Static actors are
+    never copied at all.
+    '''
+    new_world = self._copy()
 
     # If the action is not valid, take a zero action and update the world
     # appropriately.
@@ -188,12 +242,49 @@ class AbstractWorld(object):
     (res, S0, A0, S1, F1, r) = new_world.tick(action)
     return new_world
 
+  def forkBatch(self, actions):
+    '''
+    Fork one new world per action, and advance all of them together with
+    tickBatch(). This is what we want when expanding all children of an MCTS
+    node at once.
+
+    Returns:
+    --------
+    worlds: list of the new worlds
+    features: stacked features of the new worlds (or a list if they cannot
+              be stacked)
+    rewards: array of rewards
+    done: array of done flags
+    '''
+    worlds = [self._copy() for _ in actions]
+    actions = [action if action is not None else self.zeroAction(0)
+               for action in actions]
+    res, features, rewards, done = self.tickBatch(worlds, actions)
+    return worlds, features, rewards, done
+
+  def _copy(self):
+    '''
+    Shallow copy of the world that shares actors and history with this one.
+    '''
+    new_world = copy.copy(self)
+    new_world.actors = list(self.actors)
+    self._owned_actors = set()
+    new_world._owned_actors = set()
+    new_world.updateTraceID()
+
+    # The history is immutable, so the new world can share it until it ticks
+    new_world.history = copy.copy(self.history)
+    return new_world
+
   def duplicate(self):
     '''
     '''
     new_world = copy.copy(self)
     new_world.actors = [copy.copy(actor) for actor in self.actors]
+    new_world._owned_actors = set(xrange(len(new_world.actors)))
+    new_world.history = copy.copy(self.history)
     new_world.updateTraceID()
+    return new_world
 
   def tick(self, A0):
     '''
@@ -206,37 +297,122 @@ class AbstractWorld(object):
 
     S0 = self.actors[0].state
 
-    # track list of actions for all entities
-    actions = [0]*len(self.actors)
-    for i, actor in enumerate(self.actors):
+    # track list of actions for all entities; static actors never act
+    actions = [None]*len(self.actors)
+    for i in xrange(len(self.actors)):
       if i is 0:
+        self._writableActor(i)
         actions[i] = A0
-      else:
-        actions[i] = actor.evaluate(self)
+      elif not self.actors[i].static:
+        actions[i] = self._writableActor(i).evaluate(self)
 
     # update all actors in a separate loop
-    for actor, action in zip(self.actors, actions):
-      s = actor.update(action, self.dt)
+    for i, action in enumerate(actions):
+      if i is 0 or not self.actors[i].static:
+        s = self.actors[i].update(action, self.dt)
 
+    return self._finishTick(S0, A0)
+
+  def tickBatch(self, worlds, actions):
+    '''
+    Advance a list of worlds (usually siblings forked from this one) by one
+    step each, with the learner in world k taking actions[k].
+
+    Actor states are stepped together: for each actor index, the states from
+    all worlds are passed to a single dynamics.applyBatch() call, which
+    dynamics with array-valued states can vectorize. Actors that override
+    update() are still stepped one by one.
+
+    Returns:
+    --------
+    res: array of per-world results, as in tick()
+    features: stacked features (or a list if they cannot be stacked)
+    rewards: array of rewards
+    done: array of done flags
+    '''
+    if type(self).tick != AbstractWorld.tick:
+      # Subclass has its own update logic: tick worlds one at a time
+      results = [world.tick(A0) for world, A0 in zip(worlds, actions)]
+    else:
+      results = self._tickBatch(worlds, actions)
+
+    res = np.array([r[0] for r in results])
+    features = [r[4] for r in results]
+    try:
+      features = np.array(features)
+    except ValueError:
+      pass
+    rewards = np.array([r[5] for r in results])
+    done = np.array([world.done for world in worlds])
+    return res, features, rewards, done
+
+  def _tickBatch(self, worlds, actions):
+    from dynamics import AbstractActor
+
+    num_actors = len(worlds[0].actors)
+    for world in worlds:
+      if len(world.actors) != num_actors:
+        raise RuntimeError('tickBatch() needs worlds with the same actors')
+      world.ticks += 1
+
+    S0 = [world.actors[0].state for world in worlds]
+
+    # choose actions for all entities in all worlds
+    world_actions = []
+    for world, A0 in zip(worlds, actions):
+      world_actions.append([None] * num_actors)
+      for i in xrange(num_actors):
+        if i is 0:
+          world._writableActor(i)
+          world_actions[-1][i] = A0
+        elif not world.actors[i].static:
+          world_actions[-1][i] = world._writableActor(i).evaluate(world)
+
+    # step each actor across all worlds at once
+    for i in xrange(num_actors):
+      batch = [world.actors[i] for world in worlds]
+      if i is not 0 and batch[0].static:
+        continue
+      if type(batch[0]).update != AbstractActor.update or \
+          not hasattr(batch[0].dynamics, 'applyBatch'):
+        for actor, acts in zip(batch, world_actions):
+          actor.update(acts[i], self.dt)
+        continue
+      states = [actor.state for actor in batch]
+      acts = [a[i] for a in world_actions]
+      new_states = batch[0].dynamics.applyBatch(states, acts, self.dt)
+      for actor, action, state in zip(batch, acts, new_states):
+        actor.last_state = actor.state
+        actor.last_action = action
+        actor.state = state
+
+    return [world._finishTick(s0, A0)
+            for world, s0, A0 in zip(worlds, S0, actions)]
+
+  def _finishTick(self, S0, A0):
+    '''
+    Everything tick() does after the actors have been updated: environment
+    update, predicates, features, reward, and history.
+    '''
     self._update_environment() # run update _update_environment for this environment
 
     S1 = self.actors[0].state
 
-    # set up vectors of predicates properly
-    for actor in self.actors:
-        actor.state.predicates = [0] * len(self.predicates)
-
-    # update all actors
+    # update predicates for all actors
     #self.predicates = [check(world, self, actor, actor.last_state)
     #for actor in self.actors:
     #  actor.state.updatePredicates(self, actor)
-    for i, (name, check) in enumerate(self.predicates):
-      for actor in self.actors:
-        actor.state.predicates[i] = check(
-            self,
-            actor.state,
-            actor,
-            actor.last_state)
+    for idx, actor in enumerate(self.actors):
+      predicates = [check(self, actor.state, actor, actor.last_state)
+                    for name, check in self.predicates]
+      if idx is not 0 and actor.static:
+        # Static actors may share their state with other worlds: only copy
+        # them if their predicates actually changed.
+        if predicates == actor.state.predicates:
+          continue
+        actor = self._writableActor(idx)
+        actor.state = copy.copy(actor.state)
+      actor.state.predicates = predicates
 
     (res, F1, r, rt) = self._process() # get the final set of variables
 
@@ -250,9 +426,7 @@ class AbstractWorld(object):
     self.initial_reward = r + rt
     self.done = not res
 
-    # update the history queue
-    if len(self.history) >= self.history_length:
-        self.history.popleft()
+    # update the history queue; old entries are dropped automatically
     self.history.append((F1, A0.code))
 
     return (res, S0, A0, S1, F1, r + rt)
@@ -15,6 +15,7 @@ import signal
 from costar_models.datasets.tfrecord import TFRecordConverter
 from costar_models.datasets.npz import NpzDataset
 from costar_models.datasets.h5f import H5fDataset
+from costar_models.datasets.shard import ShardDataset
 
 CM_NEXT = "next"
 CM_GOAL = "goal"
@@ -40,6 +41,7 @@ class AbstractAgent(object):
     TFRECORD = 'tfrecord'
     MOVIE = 'npz+movie'
     H5F = 'h5f'
+    SHARD = 'shard'
 
     def __init__(self,
             env=None,
@@ -66,10 +68,11 @@ class AbstractAgent(object):
         verbose: print out a ton of warnings and other information.
         save: save data collected to the disk somewhere.
         load: load data from the disk.
-        data_type: options are 'npz', 'tfrecord, None. The default None
-            tries to detect the data type based on the data file extension,
-            with .npz meaning the numpy zip format, and tfrecord meaning the
-            tensorflow tfrecord format.
+        data_type: options are 'npz', 'h5f', 'shard', 'tfrecord, None. The
+            default None tries to detect the data type based on the data file
+            extension, with .npz meaning the numpy zip format, .shard meaning
+            large uncompressed shard files (see ShardDataset), and tfrecord
+            meaning the tensorflow tfrecord format.
         success_only: when loading data, only load successful examples.
                       Primarily intended for behavioral cloning.
         data_file: parsed to learn how to save data. Include either npz or
@@ -84,6 +87,8 @@ class AbstractAgent(object):
                 data_type = self.NUMPY_ZIP
             elif '.h5f' in data_file:
                 data_type = self.H5F
+            elif '.shard' in data_file:
+                data_type = self.SHARD
             elif '.tfrecord' in data_file:
                 data_type = self.TFRECORD
             else:
@@ -112,7 +117,7 @@ class AbstractAgent(object):
             raise RuntimeError("collecting timestepped predictions over " + \
                                "trajectories not currently supported")
 
-        if self.data_type == self.NUMPY_ZIP or self.data_type == self.H5F:
+        if self.data_type in [self.NUMPY_ZIP, self.H5F, self.SHARD]:
             root = ""
             for tok in data_file.split('.')[:-1]:
                 root += tok
@@ -120,6 +125,8 @@ class AbstractAgent(object):
                 self.npz_writer = NpzDataset(root)
             elif self.data_type == self.H5F:
                 self.npz_writer = H5fDataset(root)
+            elif self.data_type == self.SHARD:
+                self.npz_writer = ShardDataset(root)
             else:
                 raise RuntimeError('data type %s not recognized'
                         % self.data_type)
@@ -135,7 +142,7 @@ class AbstractAgent(object):
             # =====================================================================
             # This is necessary for reading data in to the models.
             self.data = {}
-            if self.data_type == self.NUMPY_ZIP or self.data_type == self.H5F:
+            if self.data_type in [self.NUMPY_ZIP, self.H5F, self.SHARD]:
                 self.data = self.npz_writer.load(success_only=self.success_only)
             elif self.load:
                 raise RuntimeError('Could not load data from %s!' %
@@ -175,6 +182,9 @@ class AbstractAgent(object):
         if self.save:
             if self.data_type == self.TFRECORD:
                 self.tf_writer.close()
+            elif self.data_type == self.SHARD:
+                # write the shard index once, instead of after every example
+                self.npz_writer.close()
 
     def _fit(self, num_iter):
         raise NotImplementedError('_fit() should run algorithm on'
@@ -11,7 +11,7 @@ __all__ = [
     "ContinuousSamplerTaskPolicies",
     # ===========================================================================
     # Rollout functions: estimate value of a leaf
-    "SimulationRollout", "ActionValueRollout",
+    "SimulationRollout", "BatchSimulationRollout", "ActionValueRollout",
     # ===========================================================================
     # Sample functions: add via progressive widening
     "SinglePolicySample", "NullSample", "LearnedOrderPolicySample",
@@ -30,11 +30,16 @@ __all__ = [
     # Score functions:
     "Ucb1Score", "PriorProbabilityScore",
     # ===========================================================================
+    # Share statistics between nodes that reach the same state
+    "TranspositionTable",
+    # ===========================================================================
     # Validator: print out graphs showing what happened
     "Validator",
     # ===========================================================================
     # Tree search functions
-    "MonteCarloTreeSearch", "DepthFirstSearch",
+    "MonteCarloTreeSearch", "ParallelMonteCarloTreeSearch",
+    "ArrayMonteCarloTreeSearch", "ArrayTree",
+    "DepthFirstSearch",
     "RandomSearch", "RandomSearchNoExecution",
     # ===========================================================================
     # Generic tree search result execution (closed-loop)
@@ -45,6 +50,7 @@ __all__ = [
 from abstract import *
 from planning_problem import *
 from node import *
+from tree import *
 from action import *
 
 # Search algorithms
@@ -64,6 +70,7 @@ from initialize import *
 from extract import *
 from widen import *
 from score import *
+from transposition import *
 
 # Validation/graphing utils
 from validation import *
@@ -37,7 +37,9 @@ class AbstractMctsPolicies(object):
                  rollout=None,
                  max_depth=10,
                  verbose=0,
-                 dfs=False):
+                 dfs=False,
+                 transpositions=None,
+                 frontier_rollouts=False):
         self.max_depth = max_depth
         self._rollout = rollout
         self._initialize = initialize
@@ -47,6 +49,8 @@ class AbstractMctsPolicies(object):
         self._extract = extract
         self._dfs = dfs
         self.verbose = verbose
+        self.transpositions = transpositions
+        self.frontier_rollouts = frontier_rollouts
 
         if self.verbose > 0:
             print "=========================================="
@@ -57,6 +61,8 @@ class AbstractMctsPolicies(object):
             print "SAMPLE:", sample
             print "SCORE:", score
             print "WIDEN:", widen
+            print "TRANSPOSITIONS:", transpositions
+            print "FRONTIER ROLLOUTS:", frontier_rollouts
             print "=========================================="
 
         self._can_widen = self.sample is not None and self._widen is not None
@@ -125,14 +131,30 @@ class AbstractMctsPolicies(object):
 
             # instantiate child and select it
             child = node.children[max_idx]
-            if not child.initialized:
-                # fork the world and apply the correct action
-                node.instantiate(child)
-                if self._initialize:
-                    self._initialize(child)
+            self.instantiate(node, child)
 
             node = child
 
+        # Estimate the value of the frontier from other paths to the same
+        # state, or with the rollout policy if frontier_rollouts is set.
+        # Batched rollouts (leaf parallelism) are handled by the rollout
+        # object itself.
+        leaf, leaf_reward = visited[-1]
+        other_visits, other_value = 0, 0.
+        if leaf.transposition is not None:
+            other_visits, other_value = leaf.transposition.otherPaths(leaf)
+        if leaf.terminal:
+            pass
+        elif other_visits > 0 and other_visits >= leaf.transposition_visits:
+            # other paths have reached this state at least as often as this
+            # node has, so use their value estimate instead of rolling out.
+            # It excludes their step rewards, so leaf_reward counts once.
+            visited[-1] = (leaf, leaf_reward + other_value)
+        elif self.frontier_rollouts and self._rollout is not None:
+            rollout_reward, _, _ = self._rollout(leaf, max_depth - steps)
+            leaf.n_rollouts += 1
+            visited[-1] = (leaf, leaf_reward + rollout_reward)
+
         acc_reward = 0
         for node, reward in reversed(visited):
             acc_reward += reward
@@ -146,6 +168,21 @@ class AbstractMctsPolicies(object):
         if not child.initialized:
             # fork the world and apply the correct action
             parent.instantiate(child)
+            if self.transpositions is not None:
+                self.transpositions.attach(child)
+            if self._initialize:
+                self._initialize(child)
+
+    '''
+  Instantiate all of the specified children of a parent together.
+  '''
+
+    def instantiateBatch(self, parent, children):
+        children = [child for child in children if not child.initialized]
+        parent.instantiateBatch(children)
+        for child in children:
+            if self.transpositions is not None:
+                self.transpositions.attach(child)
             if self._initialize:
                 self._initialize(child)
 
@@ -340,6 +377,15 @@ class AbstractScore(object):
     def __call__(self, parent, child):
         raise NotImplementedError('score.__call__() not implemented!')
 
+    def batch(self, tree, parent, children):
+        '''
+        Score a block of children in an ArrayTree at once. Override this with
+        a vectorized version; by default it scores one child at a time.
+        '''
+        parent = tree.getNode(parent)
+        return np.array([self(parent, tree.getNode(child))
+                         for child in children])
+
 '''
 Widen the tree by adding a new entity.
 This function says if we can widen: it returns a boolean.
@@ -357,6 +403,12 @@ class AbstractWiden(object):
     def __call__(self, node):
         raise NotImplementedError('widen.__call__() not implemented!')
 
+    def batch(self, tree, idx):
+        '''
+        Version of __call__() for a node stored in an ArrayTree.
+        '''
+        return self(tree.getNode(idx))
+
 '''
 Extract the best path through the tree.
 
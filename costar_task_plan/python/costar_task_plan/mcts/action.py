@@ -41,7 +41,7 @@ class MctsAction(AbstractMctsAction):
 
     def apply(self, node):
         u = self.getAction(node)
-        if a is None:
+        if u is None:
             print self.tag, "failed"
         child = node.expand(u)
         return self.update(child)
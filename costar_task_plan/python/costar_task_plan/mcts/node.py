@@ -59,17 +59,43 @@ class Node(AbstractState):
         self.rewards = []
         self.reward = 0
 
+        # statistics shared with other nodes that reach the same state, and
+        # how much of them came from this node's own updates
+        self.transposition = None
+        self.transposition_visits = 0
+        self.transposition_value = 0.
+
     '''
     MCTS update step
     '''
 
     def update(self, reward, final_reward, steps):
+        if self.transposition is not None:
+            # self.reward is still the step reward of this trace
+            self.transposition.update(reward, self.reward)
+            self.transposition_visits += 1
+            self.transposition_value += reward - self.reward
         self.total_reward += reward
         self.max_reward = max(reward, self.max_reward)
         self.max_final_reward = max(reward, self.max_final_reward)
         self.avg_reward = self.total_reward / self.n_visits
         self.reward = 0  # reset counter for this trace
 
+    def sharedAvgReward(self):
+        '''
+        Average reward of this node, counting the visits of other nodes that
+        reached the same state (see TranspositionTable) as visits of this one,
+        with this node's step reward in place of theirs.
+        '''
+        if self.transposition is None:
+            return self.avg_reward
+        other_visits, other_value = self.transposition.otherPaths(self)
+        if other_visits == 0:
+            return self.avg_reward
+        step_reward = sum(self.rewards)
+        return (self.total_reward + other_visits * (step_reward + other_value)) \
+            / (self.n_visits + other_visits)
+
     '''
     expand() creates a new child world from a particular environment. We can
     then tick() this world forward however long we want to follow a particular
@@ -94,7 +120,27 @@ class Node(AbstractState):
     '''
 
     def instantiate(self, child):
+        action = self._checkInstantiate(child)
+        self._setWorld(child, action, self.world.fork(action))
 
+    '''
+    Batched version of instantiate(): fork worlds for all of the given
+    children at once, so the world can advance them together.
+    '''
+
+    def instantiateBatch(self, children):
+        if len(children) == 0:
+            return
+        actions = [self._checkInstantiate(child) for child in children]
+        worlds, _, _, _ = self.world.forkBatch(actions)
+        for child, action, new_world in zip(children, actions, worlds):
+            self._setWorld(child, action, new_world)
+
+    def _checkInstantiate(self, child):
+        '''
+        Make sure child can be instantiated from this node, and return the
+        environment action it should take.
+        '''
         if child.parent is None:
             child.parent = self
         elif child.parent is not self:
@@ -109,27 +155,24 @@ class Node(AbstractState):
                 raise RuntimeError(
                     'Cannot instantiate a node with an empty action!')
 
-            action = child.action.getAction(self)
-            if action is None:
-                failed = True
-            else:
-                failed = False
-
-            new_world = self.world.fork(action)
-            child.world = new_world
-            child.state = child.world.actors[0].state
-            child.initialized = True
-            child.terminal = child.world.done or failed
-            child.rewards = [new_world.initial_reward]
-            child.reward += new_world.initial_reward
-            child.parent = self
-            child.prev_reward = self.prev_reward + self.reward
-            child.traj.append((self.world.actors[0].state, action))
-            child.action.update(child)
+            return child.action.getAction(self)
         else:
             raise RuntimeError(
                 'Cannot instantiate a node that already has been instantiated!')
 
+    def _setWorld(self, child, action, new_world):
+        failed = action is None
+        child.world = new_world
+        child.state = child.world.actors[0].state
+        child.initialized = True
+        child.terminal = child.world.done or failed
+        child.rewards = [new_world.initial_reward]
+        child.reward += new_world.initial_reward
+        child.parent = self
+        child.prev_reward = self.prev_reward + self.reward
+        child.traj.append((self.world.actors[0].state, action))
+        child.action.update(child)
+
     @property
     def ticks(self):
         return self.world.ticks
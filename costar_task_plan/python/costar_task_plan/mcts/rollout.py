@@ -1,5 +1,7 @@
 from abstract import *
 
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
 
 '''
@@ -32,6 +34,38 @@ class SimulationRollout(AbstractRollout):
 
         return reward, final_reward, steps_taken
 
+'''
+Leaf-parallel rollouts: run a batch of independent rollouts from the same
+frontier node and return their average. The rollouts are run in a pool of
+threads, which helps when ticking the world releases the GIL (physics
+simulators, numpy, neural net policies). select() only rolls out from the
+frontier when the policies are created with frontier_rollouts=True.
+'''
+
+
+class BatchSimulationRollout(AbstractRollout):
+
+    def __init__(self, rollout_sample, batch_size=4, num_threads=None):
+        self.rollout = SimulationRollout(rollout_sample)
+        self.batch_size = batch_size
+        if num_threads is None:
+            num_threads = batch_size
+        self.num_threads = num_threads
+        self._pool = None
+
+    def __call__(self, node, depth):
+        if self._pool is None and self.num_threads > 1:
+            self._pool = ThreadPool(self.num_threads)
+
+        rollout = lambda _: self.rollout(node, depth)
+        if self._pool is not None:
+            results = self._pool.map(rollout, xrange(self.batch_size))
+        else:
+            results = map(rollout, xrange(self.batch_size))
+
+        reward, final_reward, steps_taken = np.mean(results, axis=0)
+        return reward, final_reward, steps_taken
+
 '''
 Depth First Search --
 This class just continues to roll out the best path it can see until it gets to
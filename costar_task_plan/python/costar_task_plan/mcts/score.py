@@ -3,6 +3,8 @@ from abstract import *
 
 '''
 This is the classic Upper Confidence Bound for Trees score.
+The value of a child includes other paths to the same state when the search
+uses a transposition table, see Node.sharedAvgReward().
 '''
 
 
@@ -15,7 +17,15 @@ class Ucb1Score(AbstractScore):
         if child.n_visits == 0:
             return float('inf')
         else:
-            return child.avg_reward + self.c * np.sqrt(np.log(parent.n_visits) / child.n_visits)
+            return child.sharedAvgReward() + self.c * np.sqrt(np.log(parent.n_visits) / child.n_visits)
+
+    def batch(self, tree, parent, children):
+        visits = tree.n_visits[children]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            explore = np.sqrt(np.log(tree.n_visits[parent]) / visits)
+        score = tree.avgReward(children) + self.c * explore
+        score[visits == 0] = float('inf')
+        return score
 
 '''
 This is the "AlphaGo" score.
@@ -28,4 +38,8 @@ class PriorProbabilityScore(AbstractScore):
         self.c = c
 
     def __call__(self, parent, child):
-        return child.avg_reward + self.c * child.prior / (1 + child.n_visits)
+        return child.sharedAvgReward() + self.c * child.prior / (1 + child.n_visits)
+
+    def batch(self, tree, parent, children):
+        return tree.avgReward(children) + \
+            self.c * tree.prior[children] / (1 + tree.n_visits[children])
@@ -3,10 +3,14 @@
 # (c) 2017 The Johns Hopkins University
 # See License for more details
 
+import multiprocessing
 import timeit
 
+import numpy as np
+
 from abstract import AbstractSearch
 from node import Node
+from tree import ArrayTree
 
 '''
 Search through the tree exhaustively.
@@ -35,15 +39,11 @@ class DepthFirstSearch(AbstractSearch):
                     best_reward = node.accumulatedReward()
                     best_node = node
             else:
-                expanded = 0
-                # add any possible children from the root
-                for child in node.children:
-                    expanded += 1
-                    self.policies.instantiate(node, child)
-                    nodes_to_visit.append(child)
-
-                    if expanded > max_expansions:
-                        break
+                # add any possible children from the root, forking all of
+                # their worlds in one batch
+                children = node.children[:max_expansions + 1]
+                self.policies.instantiateBatch(node, children)
+                nodes_to_visit.extend(children)
 
         path = []
         if best_node is not None:
@@ -66,17 +66,272 @@ class MonteCarloTreeSearch(AbstractSearch):
 
     def __init__(self, policies):
         self.policies = policies
+        self.iterations_per_second = 0.
 
     def __call__(self, root, iter=100, *args, **kwargs):
         self.policies.initialize(root)
         start_time = timeit.default_timer()
         for i in xrange(iter):
             self.policies.explore(root)
+        explore_time = timeit.default_timer() - start_time
+        path = self.policies.extract(root)
+
+        elapsed = timeit.default_timer() - start_time
+        if explore_time > 0:
+            self.iterations_per_second = iter / explore_time
+        return elapsed, path
+
+
+# Tree and policies shared with root-parallel workers. These are set right
+# before the worker pool is created, so that each forked process gets its own
+# private copy of the tree to search.
+_parallel_root = None
+_parallel_policies = None
+
+
+def _rootParallelWorker(args):
+    '''
+    Run an independent search from this worker's private copy of the root and
+    report how much it added to the statistics of the root and its children,
+    so they can be merged by the parent. The private tree persists between
+    calls, so only the changes made by this search are reported.
+    '''
+    iter, seed = args
+    np.random.seed(seed)
+    root, policies = _parallel_root, _parallel_policies
+    n_visits = root.n_visits
+    before = [(child.n_visits, child.total_reward) for child in root.children]
+    for i in xrange(iter):
+        policies.explore(root)
+    stats = []
+    for i, child in enumerate(root.children):
+        # children are only ever appended, so indices are stable
+        visits, total_reward = before[i] if i < len(before) else (0, 0.)
+        stats.append((i, child.tag, child.n_visits - visits,
+                      child.total_reward - total_reward, child.max_reward))
+    return root.n_visits - n_visits, stats
+
+
+class ParallelMonteCarloTreeSearch(MonteCarloTreeSearch):
+
+    '''
+    Root-parallel version of MonteCarloTreeSearch. The iteration budget is
+    split across num_workers independent trees: one is searched in this
+    process, the rest in a pool of forked processes. Visit counts and rewards
+    of the root's children are merged into the local tree before extract() is
+    called.
+
+    The worker pool, and each worker's private tree, is kept between calls
+    that search from the same root, so repeated calls only pay for forking
+    once. Searching from a different root starts a new pool; call close() to
+    shut it down when done.
+
+    Leaf parallelism is provided by the rollout policy instead; see
+    BatchSimulationRollout.
+
+    After each call, iterations_per_second holds the total number of
+    iterations run across all trees divided by the wall-clock search time.
+    '''
+
+    def __init__(self, policies, num_workers=None):
+        super(ParallelMonteCarloTreeSearch, self).__init__(policies)
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        if num_workers < 1:
+            raise RuntimeError('need at least one worker for search')
+        self.num_workers = num_workers
+        self._pool = None
+        self._pool_root = None
+        self._pool_size = 0
+
+    def __call__(self, root, iter=100, *args, **kwargs):
+        self.policies.initialize(root)
+        start_time = timeit.default_timer()
+
+        num_remote = min(self.num_workers, iter) - 1
+        remote_iter = iter // (num_remote + 1)
+        local_iter = iter - num_remote * remote_iter
+
+        results = []
+        if num_remote > 0:
+            pool = self._getPool(root, num_remote)
+            seeds = np.random.randint(2**31 - 1, size=num_remote)
+            try:
+                async_result = pool.map_async(_rootParallelWorker,
+                        [(remote_iter, seed) for seed in seeds], chunksize=1)
+                for i in xrange(local_iter):
+                    self.policies.explore(root)
+                results = async_result.get()
+            except:
+                self.close()
+                raise
+        else:
+            for i in xrange(local_iter):
+                self.policies.explore(root)
+
+        for n_visits, stats in results:
+            self._merge(root, n_visits, stats)
+
+        explore_time = timeit.default_timer() - start_time
+        path = self.policies.extract(root)
+
+        elapsed = timeit.default_timer() - start_time
+        if explore_time > 0:
+            self.iterations_per_second = iter / explore_time
+        return elapsed, path
+
+    def _getPool(self, root, processes):
+        '''
+        Get a pool of processes forked from the current tree under root,
+        reusing the previous pool if it was forked from the same root.
+        '''
+        global _parallel_root, _parallel_policies
+
+        if self._pool is not None and self._pool_root is root and \
+                self._pool_size == processes:
+            return self._pool
+
+        self.close()
+        _parallel_root, _parallel_policies = root, self.policies
+        self._pool = multiprocessing.Pool(processes)
+        self._pool_root = root
+        self._pool_size = processes
+        return self._pool
+
+    def close(self):
+        '''
+        Shut down the worker processes, if there are any.
+        '''
+        global _parallel_root, _parallel_policies
+
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+        self._pool = None
+        self._pool_root = None
+        self._pool_size = 0
+        _parallel_root, _parallel_policies = None, None
+
+    def _merge(self, root, n_visits, stats):
+        '''
+        Add the statistics a remote search added to its tree to the children
+        of the local root. Children are matched by index first and then by
+        tag; children that only exist in the remote tree are dropped, since we
+        do not have their subtrees, and so are the root visits that went
+        through them.
+        '''
+        for idx, tag, visits, total_reward, max_reward in stats:
+            if visits == 0:
+                continue
+            child = None
+            if idx < len(root.children) and root.children[idx].tag == tag:
+                child = root.children[idx]
+            else:
+                for other in root.children:
+                    if other.tag == tag:
+                        child = other
+                        break
+            if child is None:
+                n_visits -= visits
+                continue
+            child.n_visits += visits
+            child.total_reward += total_reward
+            child.max_reward = max(child.max_reward, max_reward)
+            child.avg_reward = child.total_reward / child.n_visits
+        root.n_visits += n_visits
+
+
+class ArrayMonteCarloTreeSearch(MonteCarloTreeSearch):
+
+    '''
+    Same search as MonteCarloTreeSearch, but the tree statistics are kept in
+    an ArrayTree instead of in Node objects, and children are selected with
+    the vectorized batch() versions of the score and widen functions.
+
+    The root and all instantiated nodes still get Node objects, so the
+    policies' initialize, sample, and extract functions are used unchanged.
+    Transposition tables are not supported with this backend.
+    '''
+
+    def __init__(self, policies, capacity=1024):
+        super(ArrayMonteCarloTreeSearch, self).__init__(policies)
+        self.capacity = capacity
+        self.tree = None
+
+    def __call__(self, root, iter=100, *args, **kwargs):
+        self.policies.initialize(root)
+        start_time = timeit.default_timer()
+        self.tree = ArrayTree(self.capacity)
+        root_idx = self.tree.addRoot(root)
+        for i in xrange(iter):
+            self._select(root_idx, self.policies.max_depth)
+        explore_time = timeit.default_timer() - start_time
+        root = self.tree.getNode(root_idx)
         path = self.policies.extract(root)
 
         elapsed = timeit.default_timer() - start_time
+        if explore_time > 0:
+            self.iterations_per_second = iter / explore_time
         return elapsed, path
 
+    def _select(self, idx, max_depth=10, can_widen=True):
+        '''
+        Array version of AbstractMctsPolicies.select().
+        '''
+        tree, policies = self.tree, self.policies
+        visited = []
+        steps = 0
+        while steps < max_depth:
+            node = tree.nodes[idx]
+
+            steps += 1
+            tree.n_visits[idx] += 1
+
+            length = tree.child_count[idx]
+            visited.append((idx, node.reward))
+
+            # optionally expand internal nodes
+            if node.terminal:
+                break
+            elif policies._can_widen and \
+                    (can_widen or (length == 0 and policies._dfs)) \
+                    and policies._widen.batch(tree, idx):
+                action = policies.sample(node)
+                if action:
+                    tree.addChild(idx, Node(action=action))
+                    can_widen = False
+                    length += 1
+
+            if length == 0:
+                break
+
+            # score all children at once and pick the best one
+            children = tree.children(idx)
+            score = policies._score.batch(tree, idx, children)
+            child_idx = children[np.argmax(score)]
+
+            child, created = tree.instantiate(idx, child_idx)
+            if created and policies._initialize:
+                policies._initialize(child)
+
+            idx = child_idx
+
+        leaf_idx, leaf_reward = visited[-1]
+        leaf = tree.nodes[leaf_idx]
+        if policies.frontier_rollouts and policies._rollout is not None \
+                and not leaf.terminal:
+            rollout_reward, _, _ = policies._rollout(leaf, max_depth - steps)
+            leaf.n_rollouts += 1
+            visited[-1] = (leaf_idx, leaf_reward + rollout_reward)
+
+        acc_reward = 0
+        for idx, reward in reversed(visited):
+            acc_reward += reward
+            tree.total_reward[idx] += acc_reward
+            tree.max_reward[idx] = max(acc_reward, tree.max_reward[idx])
+            # reset counter for this trace, as in Node.update()
+            tree.nodes[idx].reward = 0
+
 
 class RandomSearch(AbstractSearch):
 
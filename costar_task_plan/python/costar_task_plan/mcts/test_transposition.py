@@ -0,0 +1,126 @@
+from __future__ import print_function
+
+import numpy as np
+
+from costar_task_plan.mcts.node import Node
+from costar_task_plan.mcts.score import Ucb1Score
+from costar_task_plan.mcts.transposition import TranspositionTable
+
+
+class FakeState(object):
+
+    def __init__(self, x):
+        self.x = x
+
+    def toArray(self):
+        return np.array([self.x])
+
+
+class FakeActor(object):
+
+    def __init__(self, x):
+        self.state = FakeState(x)
+
+
+class FakeWorld(object):
+
+    def __init__(self, x):
+        self.actors = [FakeActor(x)]
+        self.done = False
+
+
+class FakeAction(object):
+
+    def __init__(self, tag):
+        self.tag = tag
+
+
+def make_child(parent, tag, x, step_reward=0.):
+    '''
+    A child of parent as Node._setWorld() leaves it, without ticking a world.
+    '''
+    child = Node(action=FakeAction(tag))
+    child.world = FakeWorld(x)
+    child.state = child.world.actors[0].state
+    child.initialized = True
+    child.parent = parent
+    child.rewards = [step_reward]
+    child.reward = step_reward
+    parent.children.append(child)
+    return child
+
+
+def visit(node, reward):
+    '''
+    One trace through node, with reward the accumulated reward backed up to it.
+    '''
+    node.n_visits += 1
+    node.update(reward, reward, 1)
+
+
+def test_attach_keeps_visit_counts():
+    table = TranspositionTable()
+    roots = [Node(world=FakeWorld(0), root=True) for _ in range(2)]
+    first = make_child(roots[0], 'A', 1)
+    assert not table.attach(first)
+    for _ in range(3):
+        roots[0].n_visits += 1
+        visit(first, 1.)
+
+    # same tag and state at the same depth under another parent
+    second = make_child(roots[1], 'A', 1)
+    assert table.attach(second)
+    assert second.n_visits == 0
+    assert second.total_reward == 0
+    assert second.transposition is first.transposition
+    assert second.transposition.otherPaths(second) == (3, 1.)
+    assert first.transposition.otherPaths(first) == (0, 0.)
+
+
+def test_other_paths_exclude_step_reward():
+    table = TranspositionTable()
+    roots = [Node(world=FakeWorld(0), root=True) for _ in range(2)]
+    first = make_child(roots[0], 'A', 1, step_reward=2.)
+    table.attach(first)
+    # a step reward of 2 and a value of 1 after the state
+    visit(first, 3.)
+    second = make_child(roots[1], 'A', 1, step_reward=0.5)
+    table.attach(second)
+    assert second.transposition.otherPaths(second) == (1, 1.)
+    # second's own step reward replaces first's in the shared estimate
+    visit(second, 1.5)
+    assert np.isclose(second.sharedAvgReward(), 1.5)
+    assert np.isclose(first.sharedAvgReward(), (3. + 2. + 1.) / 2)
+
+
+def test_selection_with_hit():
+    table = TranspositionTable()
+    score = Ucb1Score(c=1.0)
+
+    # another path has found a good value after state 1
+    other_root = Node(world=FakeWorld(0), root=True)
+    other = make_child(other_root, 'B', 1)
+    table.attach(other)
+    for _ in range(10):
+        visit(other, 5.)
+
+    root = Node(world=FakeWorld(0), root=True)
+    a = make_child(root, 'A', 2)
+    b = make_child(root, 'B', 1)
+    assert not table.attach(a)
+    assert table.attach(b)
+    for child in [a, b]:
+        root.n_visits += 1
+        visit(child, 1.)
+    assert root.n_visits == a.n_visits + b.n_visits
+
+    scores = [score(root, child) for child in root.children]
+    assert scores[1] > scores[0]
+    assert np.isclose(b.sharedAvgReward(), (1. + 10 * 5.) / 11)
+    assert a.sharedAvgReward() == a.avg_reward
+
+
+if __name__ == '__main__':
+    test_attach_keeps_visit_counts()
+    test_other_paths_exclude_step_reward()
+    test_selection_with_hit()
@@ -0,0 +1,145 @@
+'''
+By Chris Paxton
+Copyright (c) 2017, The Johns Hopkins University
+All rights reserved. See license for details.
+'''
+
+from collections import OrderedDict
+
+import numpy as np
+
+'''
+Visit and reward statistics shared by every node that reaches the same state.
+'''
+
+
+class TranspositionEntry(object):
+
+    def __init__(self):
+        self.n_visits = 0
+        self.total_reward = 0.
+        self.max_reward = -float('inf')
+        # accumulated rewards minus the step reward of the node that reached
+        # the state, i.e. the value of what comes after it
+        self.total_value = 0.
+
+    @property
+    def avg_reward(self):
+        if self.n_visits == 0:
+            return 0.
+        return self.total_reward / self.n_visits
+
+    def update(self, reward, step_reward=0.):
+        self.n_visits += 1
+        self.total_reward += reward
+        self.total_value += reward - step_reward
+        self.max_reward = max(reward, self.max_reward)
+
+    def otherPaths(self, node):
+        '''
+        Number of visits and average value after the state of the updates
+        that came from nodes other than node. The value does not include the
+        step reward of those nodes, so that it can be added to node's own.
+        '''
+        n_visits = self.n_visits - node.transposition_visits
+        if n_visits <= 0:
+            return 0, 0.
+        return n_visits, (self.total_value - node.transposition_value) / n_visits
+
+'''
+Transposition table for MCTS nodes.
+
+Compiled task graphs often reach the same world state through different
+orderings of options: stacking block A and then block B looks just like
+stacking B and then A. The table recognizes these duplicates by a canonical
+key made of:
+  - the active task node (the node's tag)
+  - the learner's predicates
+  - the learner's state, as an array rounded to a number of decimals
+and lets them share visit and reward statistics. Since the statistics are
+rewards accumulated down to the search horizon, only nodes at the same depth
+of the tree are treated as duplicates.
+
+The table holds at most max_size entries and evicts the least recently used
+one when it is full. hits, misses and evictions are counted so that the hit
+rate can be reported after a search.
+'''
+
+
+class TranspositionTable(object):
+
+    def __init__(self, max_size=10000, decimals=3):
+        self.max_size = max_size
+        self.decimals = decimals
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.warned = False
+
+    def key(self, node):
+        '''
+        Canonical key for the state of an instantiated node. Returns None if
+        the learner's state cannot be converted to an array.
+        '''
+        state = node.world.actors[0].state
+        try:
+            x = np.round(np.asarray(state.toArray(), dtype=float),
+                         self.decimals)
+        except Exception:
+            if not self.warned:
+                print("[WARNING] transposition table disabled: learner state "
+                      "%s has no toArray()" % type(state).__name__)
+                self.warned = True
+            return None
+        predicates = tuple(getattr(state, 'predicates', ()))
+        depth = 0
+        parent = node.parent
+        while parent is not None:
+            depth += 1
+            parent = parent.parent
+        return (depth, node.tag, predicates, x.shape, x.tobytes())
+
+    def attach(self, node):
+        '''
+        Look up the entry for a freshly instantiated node and attach it. The
+        node keeps its own visit counts, so that they still add up to its
+        parent's; the shared statistics are used through otherPaths().
+
+        Returns True on a table hit.
+        '''
+        key = self.key(node)
+        if key is None:
+            return False
+
+        entry = self.entries.pop(key, None)
+        hit = entry is not None
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+            entry = TranspositionEntry()
+            if len(self.entries) >= self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        # reinsert to mark as most recently used
+        self.entries[key] = entry
+
+        node.transposition = entry
+        return hit
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.
+        return float(self.hits) / lookups
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,199 @@
+'''
+By Chris Paxton
+Copyright (c) 2017, The Johns Hopkins University
+All rights reserved. See license for details.
+'''
+
+from node import Node
+
+import numpy as np
+
+'''
+Compact storage for an MCTS tree.
+
+Every node in the tree is a row in a set of preallocated numpy arrays: visits,
+total and max reward, prior, parent index, and the location of its block of
+children. Each node's children are kept in one contiguous block of
+child_index, so scores can be computed for all of them at once. Blocks are
+reallocated with twice the capacity when a node outgrows its block.
+
+Node objects are only created when needed. Instantiated nodes (the ones with
+a world) keep their Node, since it holds the world, trajectory, and reward.
+Children that have not been instantiated yet are just a row plus their MCTS
+action; getNode() builds a throwaway Node for them on request.
+
+Instantiated nodes get an ArrayTreeChildren in place of their children list,
+so existing initialize, sample and extract functions keep working.
+'''
+
+
+class ArrayTree(object):
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.capacity = 0
+        self.n_visits = np.zeros((0,), dtype=np.int64)
+        self.total_reward = np.zeros((0,))
+        self.max_reward = np.zeros((0,))
+        self.prior = np.zeros((0,))
+        self.parent = np.zeros((0,), dtype=np.int64)
+        self.child_start = np.zeros((0,), dtype=np.int64)
+        self.child_count = np.zeros((0,), dtype=np.int64)
+        self.child_capacity = np.zeros((0,), dtype=np.int64)
+        self.child_index = np.zeros((0,), dtype=np.int64)
+        self.child_index_size = 0
+        self.actions = []
+        self.nodes = {}
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        '''
+        Resize all of the per-node arrays to hold capacity nodes.
+        '''
+        def resize(x, fill=0):
+            new_x = np.full((capacity,), fill, dtype=x.dtype)
+            new_x[:self.size] = x[:self.size]
+            return new_x
+        self.n_visits = resize(self.n_visits)
+        self.total_reward = resize(self.total_reward)
+        self.max_reward = resize(self.max_reward, -float('inf'))
+        self.prior = resize(self.prior)
+        self.parent = resize(self.parent, -1)
+        self.child_start = resize(self.child_start)
+        self.child_count = resize(self.child_count)
+        self.child_capacity = resize(self.child_capacity)
+        self.capacity = capacity
+
+    def _allocChildren(self, size):
+        '''
+        Reserve a block of size slots at the end of child_index.
+        '''
+        start = self.child_index_size
+        if start + size > self.child_index.shape[0]:
+            new_index = np.zeros((max(2 * self.child_index.shape[0],
+                                      start + size),), dtype=np.int64)
+            new_index[:start] = self.child_index[:start]
+            self.child_index = new_index
+        self.child_index_size += size
+        return start
+
+    def _addRow(self, parent, action, prior):
+        if self.size == self.capacity:
+            self._grow(2 * self.capacity)
+        idx = self.size
+        self.size += 1
+        self.parent[idx] = parent
+        self.prior[idx] = prior
+        self.actions.append(action)
+        return idx
+
+    def addRoot(self, root):
+        '''
+        Add an instantiated root node, along with any children it already has.
+        '''
+        return self._adopt(root, -1)
+
+    def addChild(self, parent, child):
+        '''
+        Add child (a Node) to the block of children of node parent.
+        '''
+        count = self.child_count[parent]
+        if count == self.child_capacity[parent]:
+            new_capacity = max(4, 2 * count)
+            start = self._allocChildren(new_capacity)
+            old_start = self.child_start[parent]
+            self.child_index[start:start + count] = \
+                self.child_index[old_start:old_start + count]
+            self.child_start[parent] = start
+            self.child_capacity[parent] = new_capacity
+        if child.initialized:
+            idx = self._adopt(child, parent)
+        else:
+            idx = self._addRow(parent, child.action, child.prior)
+        self.child_index[self.child_start[parent] + count] = idx
+        self.child_count[parent] = count + 1
+        return idx
+
+    def _adopt(self, node, parent):
+        '''
+        Add an instantiated node and, recursively, its existing children.
+        '''
+        idx = self._addRow(parent, node.action, node.prior)
+        self.n_visits[idx] = node.n_visits
+        self.total_reward[idx] = node.total_reward
+        self.max_reward[idx] = node.max_reward
+        children = node.children
+        self.register(idx, node)
+        for child in children:
+            self.addChild(idx, child)
+        return idx
+
+    def register(self, idx, node):
+        '''
+        Keep the Node for an instantiated row, and route its children list
+        into the tree.
+        '''
+        self.nodes[idx] = node
+        node.children = ArrayTreeChildren(self, idx)
+
+    def children(self, idx):
+        start = self.child_start[idx]
+        return self.child_index[start:start + self.child_count[idx]]
+
+    def avgReward(self, idx):
+        visits = self.n_visits[idx]
+        return self.total_reward[idx] / np.maximum(visits, 1)
+
+    def getNode(self, idx):
+        '''
+        Return a Node for row idx, with statistics copied in from the arrays.
+        '''
+        node = self.nodes.get(idx, None)
+        if node is None:
+            node = Node(action=self.actions[idx], prior=self.prior[idx])
+        node.n_visits = int(self.n_visits[idx])
+        node.total_reward = self.total_reward[idx]
+        node.max_reward = self.max_reward[idx]
+        if node.n_visits > 0:
+            node.avg_reward = node.total_reward / node.n_visits
+        return node
+
+    def instantiate(self, parent, idx):
+        '''
+        Fork the world for row idx from its parent's world, and keep the new
+        Node. Returns the Node and whether it was just created.
+        '''
+        node = self.nodes.get(idx, None)
+        if node is not None:
+            return node, False
+        node = Node(action=self.actions[idx], prior=self.prior[idx])
+        self.nodes[parent].instantiate(node)
+        self.register(idx, node)
+        return node, True
+
+
+class ArrayTreeChildren(object):
+
+    '''
+    List-like view of the children of one node in an ArrayTree.
+    '''
+
+    def __init__(self, tree, idx):
+        self.tree = tree
+        self.idx = idx
+
+    def __len__(self):
+        return int(self.tree.child_count[self.idx])
+
+    def __getitem__(self, i):
+        children = self.tree.children(self.idx)
+        if isinstance(i, slice):
+            return [self.tree.getNode(j) for j in children[i]]
+        return self.tree.getNode(children[i])
+
+    def __iter__(self):
+        for j in self.tree.children(self.idx):
+            yield self.tree.getNode(j)
+
+    def append(self, child):
+        self.tree.addChild(self.idx, child)
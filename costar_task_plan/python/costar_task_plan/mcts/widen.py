@@ -18,6 +18,10 @@ class ProgressiveWiden(AbstractWiden):
     def __call__(self, node):
         return len(node.children) < int(self.C * node.n_visits ** self.alpha)
 
+    def batch(self, tree, idx):
+        return tree.child_count[idx] < \
+            int(self.C * tree.n_visits[idx] ** self.alpha)
+
 '''
 Just another example of a function you can use.
 '''
@@ -27,3 +31,6 @@ class NeverWiden(AbstractWiden):
 
     def __call__(self, node):
         return False
+
+    def batch(self, tree, idx):
+        return False
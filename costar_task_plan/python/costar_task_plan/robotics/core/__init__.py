@@ -10,6 +10,8 @@ __all__ = [
     # =====================================================================
     "DmpPolicy", "JointDmpPolicy", "CartesianDmpPolicy",
     # =====================================================================
+    "KinematicsCache",
+    # =====================================================================
     "DmpOption",
     # =====================================================================
     # Update the gripper
@@ -27,6 +29,9 @@ from .dynamics import *
 # conditions
 from .condition import *
 
+# Kinematics
+from .kinematics_cache import KinematicsCache
+
 # Policies
 from .dmp_policy import DmpPolicy, JointDmpPolicy, CartesianDmpPolicy
 
@@ -5,13 +5,22 @@ import numpy as np
 import rospy
 import tf_conversions.posemath as pm
 
-# dmp message types
-from dmp.srv import *
-
 from costar_task_plan.abstract import AbstractPolicy
 from costar_task_plan.robotics.representation import PlanDMP, RequestActiveDMP
 
 
+def TrajPointToMatrix(pt):
+    '''
+    Convert a DMP plan point of x, y, z, roll, pitch, yaw to a 4x4 pose matrix.
+    '''
+    T = pm.Frame(
+        pm.Rotation.RPY(pt.positions[3], pt.positions[4], pt.positions[5]))
+    T.p[0] = pt.positions[0]
+    T.p[1] = pt.positions[1]
+    T.p[2] = pt.positions[2]
+    return pm.toMatrix(T)
+
+
 class DmpPolicy(AbstractPolicy):
 
     '''
@@ -25,8 +34,6 @@ class DmpPolicy(AbstractPolicy):
         self.dmp = dmp
         self.kinematics = kinematics
         self.goal = goal
-        self.activate = rospy.ServiceProxy('set_active_dmp', SetActiveDMP)
-        self.plan = rospy.ServiceProxy('get_dmp_plan', GetDMPPlan)
 
     def evaluate(self, world, state, actor=None):
         raise NotImplementedError('DMP policy not set up!')
@@ -82,7 +89,7 @@ class CartesianDmpPolicy(DmpPolicy):
         if reset_seq:
             q = state.q
             T = pm.fromMatrix(self.kinematics.forward(q))
-            self.activate(self.dmp.dmp_list)
+            RequestActiveDMP(self.dmp.dmp_list)
             goal = world.observation[self.goal]
             if goal is None:
                 return None
@@ -103,21 +110,18 @@ class CartesianDmpPolicy(DmpPolicy):
             x0 = [0.] * 6
             g_threshold = [1e-1] * 6
             integrate_iter = 10
-            res = self.plan(
+            res = PlanDMP(
                 x, x0, 0., g, g_threshold, 2 * self.dmp.tau, 1.0, world.dt, integrate_iter)
             traj = res.plan
 
-            for pt in traj.points:
-                T = pm.Frame(
-                    pm.Rotation.RPY(
-                        pt.positions[3],
-                        pt.positions[4],
-                        pt.positions[5]))
-
-                T.p[0] = pt.positions[0]
-                T.p[1] = pt.positions[1]
-                T.p[2] = pt.positions[2]
-                q = self.kinematics.inverse(pm.toMatrix(T), state.q)
+            poses = [TrajPointToMatrix(pt) for pt in traj.points]
+            if hasattr(self.kinematics, 'inverseBatch'):
+                # warm started ik for the whole trajectory, this also fills
+                # the cache used for each step below
+                self.kinematics.inverseBatch(poses, state.q)
+            else:
+                for pose in poses:
+                    q = self.kinematics.inverse(pose, state.q)
         else:
             traj = state.traj
 
@@ -127,13 +131,7 @@ class CartesianDmpPolicy(DmpPolicy):
         # Compute the joint velocity to take us to the next position
         if state.seq < len(traj.points):
             pt = traj.points[state.seq]
-
-            T = pm.Frame(
-                pm.Rotation.RPY(pt.positions[3], pt.positions[4], pt.positions[5]))
-            T.p[0] = pt.positions[0]
-            T.p[1] = pt.positions[1]
-            T.p[2] = pt.positions[2]
-            q = self.kinematics.inverse(pm.toMatrix(T), state.q)
+            q = self.kinematics.inverse(TrajPointToMatrix(pt), state.q)
             if q is not None:
                 dq = (q - state.q) / world.dt
                 return CostarAction(q=q,
@@ -0,0 +1,152 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class KinematicsCache(object):
+
+    '''
+    Wraps a kinematics object with the forward(q) and inverse(pose, q_init)
+    interface of pykdl_utils' KDLKinematics, and adds:
+    - forwardBatch() over an (N, dof) array of joint positions
+    - inverseBatch() over an (N, 4, 4) stack of poses, where each waypoint
+      is seeded with the solution of the previous one
+    - a bounded LRU cache of inverse kinematics solutions, keyed on poses
+      quantized to resolution. A cached solution is only returned if it is
+      within seed_tolerance of the seed, so it cannot make the arm jump to a
+      different configuration found from a distant seed. A failure is only
+      reused for the exact seed it failed from.
+    - counters for forward calls, cache hits and misses, ik calls (to the
+      wrapped solver) and ik failures, see stats()
+
+    It can be used anywhere the wrapped kinematics object is, other
+    attributes are forwarded to it.
+    '''
+
+    def __init__(self, kinematics, max_size=10000, resolution=1e-4,
+                 seed_tolerance=0.1):
+        '''
+        Params:
+        --------
+        kinematics: the kinematics object to wrap, such as KDLKinematics
+        max_size: number of ik solutions to keep, least recently used first
+        resolution: poses whose transform entries round to the same multiple
+                    of resolution share a cache entry
+        seed_tolerance: a cached solution is used only if no joint is
+                        further than this from the seed
+        '''
+        self.kinematics = kinematics
+        self.max_size = max_size
+        self.resolution = resolution
+        self.seed_tolerance = seed_tolerance
+        self.cache = OrderedDict()
+        self.resetStats()
+
+    def __getattr__(self, name):
+        # only called for attributes KinematicsCache does not have itself
+        if name == 'kinematics':
+            raise AttributeError(name)
+        return getattr(self.kinematics, name)
+
+    def resetStats(self):
+        self.fk_calls = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.ik_calls = 0
+        self.ik_failures = 0
+
+    def stats(self):
+        '''
+        Get the counters as a dictionary, along with the current cache size.
+        '''
+        return {'fk_calls': self.fk_calls,
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses,
+                'ik_calls': self.ik_calls,
+                'ik_failures': self.ik_failures,
+                'cache_size': len(self.cache)}
+
+    def clear(self):
+        self.cache.clear()
+
+    def forward(self, q, *args, **kwargs):
+        self.fk_calls += 1
+        return self.kinematics.forward(q, *args, **kwargs)
+
+    def forwardBatch(self, qs):
+        '''
+        Forward kinematics for an (N, dof) array of joint positions.
+        Returns an (N, 4, 4) array of end effector transforms.
+        '''
+        qs = np.asarray(qs, dtype=np.float64)
+        mats = np.zeros((len(qs), 4, 4))
+        for i, q in enumerate(qs):
+            mats[i] = self.forward(q)
+        return mats
+
+    def _key(self, pose):
+        key = np.round(np.asarray(pose, dtype=np.float64)[:3] / self.resolution)
+        return key.astype(np.int64).tobytes()
+
+    def _matches(self, entry, q_init):
+        '''
+        Whether a cached (solution, seed) entry can be used when starting from
+        q_init.
+        '''
+        q, seed = entry
+        if q is None:
+            # failures only stand for the seed they failed from
+            if seed is None or q_init is None:
+                return seed is None and q_init is None
+            return np.array_equal(seed, q_init)
+        elif q_init is None:
+            return True
+        return np.max(np.abs(q - q_init)) <= self.seed_tolerance
+
+    def inverse(self, pose, q_init=None):
+        '''
+        Inverse kinematics for a 4x4 pose matrix, starting from q_init.
+        Returns the joint positions, or None if there is no solution.
+        '''
+        key = self._key(pose)
+        if q_init is not None:
+            q_init = np.array(q_init, dtype=np.float64)
+        entry = self.cache.pop(key, None)
+        if entry is not None and self._matches(entry, q_init):
+            self.cache_hits += 1
+            q = entry[0]
+        else:
+            self.cache_misses += 1
+            self.ik_calls += 1
+            q = self.kinematics.inverse(pose, q_init)
+            if q is None:
+                self.ik_failures += 1
+            else:
+                q = np.array(q, dtype=np.float64)
+            entry = (q, q_init)
+        # reinsert to mark as most recently used
+        self.cache[key] = entry
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return None if q is None else q.copy()
+
+    def inverseBatch(self, poses, q_init):
+        '''
+        Inverse kinematics for an (N, 4, 4) stack of poses along a trajectory.
+        Each waypoint is seeded with the solution of the previous waypoint,
+        or with the last solution found if the previous waypoint failed.
+
+        Returns (qs, success): an (N, dof) array of joint positions, with
+        the seed repeated where there was no solution, and the boolean
+        success of each waypoint.
+        '''
+        q = np.array(q_init, dtype=np.float64)
+        qs = np.zeros((len(poses), len(q)))
+        success = np.zeros(len(poses), dtype=bool)
+        for i, pose in enumerate(poses):
+            new_q = self.inverse(pose, q)
+            if new_q is not None:
+                q = new_q
+                success[i] = True
+            qs[i] = q
+        return qs, success
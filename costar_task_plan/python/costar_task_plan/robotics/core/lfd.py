@@ -4,9 +4,10 @@ from __future__ import print_function
 # (c) 2017 The Johns Hopkins University
 # See License for more details
 
-from dmp_policy import CartesianDmpPolicy
+from dmp_policy import CartesianDmpPolicy, TrajPointToMatrix
 from dmp_option import DmpOption
 from dynamics import SimulatedDynamics
+from kinematics_cache import KinematicsCache
 from geometry_msgs.msg import PoseArray
 from os.path import join
 from pykdl_utils.kdl_parser import kdl_tree_from_urdf_model
@@ -18,7 +19,7 @@ from urdf_parser_py.urdf import URDF
 # of a skill represented as a goal-directed set of motion primitives.
 from costar_task_plan.robotics.representation import RobotFeatures
 from costar_task_plan.robotics.representation import CartesianSkillInstance
-from costar_task_plan.robotics.representation import GMM
+from costar_task_plan.robotics.representation import GMM, FitGMMs
 from costar_task_plan.robotics.representation import Distribution
 from costar_task_plan.robotics.representation import RequestActiveDMP, PlanDMP
 
@@ -61,7 +62,8 @@ class LfD(object):
         # set up kinematics stuff
         self.tree = kdl_tree_from_urdf_model(self.robot)
         self.chain = self.tree.getChain(base_link, end_link)
-        self.kdl_kin = KDLKinematics(self.robot, base_link, end_link)
+        self.kdl_kin = KinematicsCache(
+            KDLKinematics(self.robot, base_link, end_link))
 
         self.base_link = base_link
         self.end_link = end_link
@@ -141,17 +143,25 @@ class LfD(object):
                 else:
                     self.skill_features[name] = np.concatenate((self.skill_features[name], f), axis=0)
 
-            # only fit models if we have an example of that skill
+        # only fit models if we have an example of that skill; EM runs for
+        # several skills at once if config['gmm_processes'] is not 1
+        datasets = {}
+        for name in trajectories.keys():
             if name in self.skill_features:
-                try:
-                    self.skill_models[name] = GMM(
-                        self.config['gmm_k'], self.skill_features[name])
-                except np.linalg.LinAlgError as e:
+                datasets[name] = self.skill_features[name]
+        models = FitGMMs(datasets, self.config['gmm_k'],
+                         self.config.get('gmm_processes', 1))
+
+        for name in trajectories.keys():
+            if name in models:
+                if models[name] is not None:
+                    self.skill_models[name] = models[name]
+                else:
                     simple_conf = {
-                        'mu': np.mean(self.skill_features[name], axis=-1),
+                        'mu': np.mean(self.skill_features[name], axis=0),
                         'k': 1,
                         'pi': np.ones((1,1)),
-                        'sigma': np.expand_dims(np.diag(np.std(self.skill_features[name], axis=-1)),axis=0),
+                        'sigma': np.expand_dims(np.diag(np.std(self.skill_features[name], axis=0)),axis=0),
                     }
                     self.skill_models[name] = GMM(config=simple_conf)
                 print( "> Skill", name, "extracted with dataset of shape", self.skill_features[name].shape, "k =", self.config['gmm_k'])
@@ -237,16 +247,9 @@ class LfD(object):
                           0].tau, 1.0, world.dt, integrate_iter)
 
             # Convert to poses
-            poses = []
-            for i, pt in enumerate(res.plan.points):
-                T = pm.Frame(
-                    pm.Rotation.RPY(pt.positions[3], pt.positions[4], pt.positions[5]))
-                T.p[0] = pt.positions[0]
-                T.p[1] = pt.positions[1]
-                T.p[2] = pt.positions[2]
-                poses.append(pm.toMsg(T))
-                new_q = self.kdl_kin.inverse(pm.toMatrix(T), q)
-                q = new_q
+            mats = [TrajPointToMatrix(pt) for pt in res.plan.points]
+            poses = [pm.toMsg(pm.fromMatrix(T)) for T in mats]
+            self.kdl_kin.inverseBatch(mats, q)
 
             msg = PoseArray(poses=poses)
             msg.header.frame_id = self.base_link
@@ -14,6 +14,10 @@ from dmp_utils import LoadDataDMP
 from dmp_utils import ParamFromDMP
 from dmp_utils import ParamToDMP
 from dmp_utils import SearchDMP
+from dmp_utils import SearchDMPBatch
+from dmp_utils import WeightsFromDMP
+from numpy_dmp import LearnDMPWeights
+from numpy_dmp import IntegrateDMPs
 
 " File loading utilities "
 from file_utils import LoadData
@@ -35,6 +39,7 @@ from skill import RobotSkill
 
 " gmm tools "
 from gmm import GMM
+from gmm import FitGMMs
 
 # =============================================================================
 # Skill models used in updated version of the planning system
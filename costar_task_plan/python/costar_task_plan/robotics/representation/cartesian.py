@@ -1,6 +1,5 @@
 
-from dmp.msg import DMPData
-from dmp_utils import RequestDMP, PlanDMP
+from dmp_utils import DMPData, RequestDMP, PlanDMP
 from geometry_msgs.msg import PoseArray
 from sensor_msgs.msg import JointState
 from tf_conversions import posemath as pm
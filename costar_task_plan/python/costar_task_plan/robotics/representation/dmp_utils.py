@@ -2,30 +2,60 @@
 from features import LoadRobotFeatures
 
 " ros utils "
-import rospy
 import copy
 
 " numpy "
 import numpy as np
 
+" in-process dmp learning and planning "
+import numpy_dmp
+
 " dmp message types "
-from dmp.msg import *
-from dmp.srv import *
+try:
+    import rospy
+    from dmp.msg import *
+    from dmp.srv import *
+except ImportError:
+    # without ROS the DMPs can still be learned and planned in-process
+    rospy = None
+    from numpy_dmp import DMPData, DMPPoint, DMPTraj
+    from numpy_dmp import LearnDMPFromDemoResponse, GetDMPPlanResponse
 
 """
 DMP UTILITIES
 ===============================================================
 These are based on the sample code from http://wiki.ros.org/dmp
 (sample code by Scott Niekum)
+
+By default DMPs are learned and planned in-process with numpy_dmp, which
+follows the same equations as the learn_dmp_from_demo and get_dmp_plan
+services. Pass use_service=True to call the ROS services instead.
 """
 
+# DMPs set by RequestActiveDMP, used by PlanDMP
+_active_dmp_list = None
+
 # Put together a DMP request
-def RequestDMP(u,dt,k_gain,d_gain,num_basis_functions):
+def RequestDMP(u,dt,k_gain,d_gain,num_basis_functions,use_service=False):
 
     ndims = len(u[0])
     k_gains = [k_gain]*ndims
     d_gains = [d_gain]*ndims
-    
+
+    if not use_service:
+        times = [dt * i for i in range(len(u))]
+        weights, tau, f_domain, f_targets = numpy_dmp.LearnDMPWeights(
+                u, times, k_gains, d_gains, num_basis_functions)
+        dmp_list = []
+        for i in range(ndims):
+            dmp_list.append(DMPData(
+                k_gain=k_gains[i],
+                d_gain=d_gains[i],
+                weights=weights[i].tolist(),
+                f_domain=f_domain.tolist(),
+                f_targets=f_targets[:,i].tolist()))
+        return LearnDMPFromDemoResponse(dmp_list=dmp_list, tau=float(tau))
+
     ex = DMPTraj()
     
     for i in range(len(u)):
@@ -45,7 +75,20 @@ def RequestDMP(u,dt,k_gain,d_gain,num_basis_functions):
     return resp;
 
 def PlanDMP(x_0, x_dot_0, t_0, goal, goal_thresh, 
-                    seg_length, tau, dt, integrate_iter):
+                    seg_length, tau, dt, integrate_iter, use_service=False):
+
+    if not use_service:
+        if _active_dmp_list is None:
+            raise RuntimeError('PlanDMP: call RequestActiveDMP first')
+        positions, velocities, times, lengths, at_goal = numpy_dmp.IntegrateDMPs(
+                WeightsFromDMP(_active_dmp_list),
+                [idmp.k_gain for idmp in _active_dmp_list],
+                [idmp.d_gain for idmp in _active_dmp_list],
+                x_0, x_dot_0, t_0, goal, goal_thresh,
+                seg_length, tau, dt, integrate_iter)
+        plan = numpy_dmp.PlanToTraj(positions[0], velocities[0], times,
+                traj_type=DMPTraj, point_type=DMPPoint)
+        return GetDMPPlanResponse(plan=plan, at_goal=int(at_goal[0]))
 
     rospy.wait_for_service('get_dmp_plan')
     try:
@@ -57,7 +100,11 @@ def PlanDMP(x_0, x_dot_0, t_0, goal, goal_thresh,
 
     return resp;
 
-def RequestActiveDMP(dmps):
+def RequestActiveDMP(dmps, use_service=False):
+    global _active_dmp_list
+    _active_dmp_list = dmps
+    if not use_service:
+        return
     try:
         sad = rospy.ServiceProxy('set_active_dmp', SetActiveDMP)
         sad(dmps)
@@ -125,6 +172,13 @@ def ParamFromDMP(goal,dmp):
 
     return params
 
+'''
+WeightsFromDMP
+Get the weights of a list of DMPs as a (dims x num_weights) array.
+'''
+def WeightsFromDMP(dmp):
+    return np.array([idmp.weights for idmp in dmp], dtype=np.float64)
+
 '''
 ParamToDMP
 Take a vector of parameters and turn it into a DMP.
@@ -142,6 +196,8 @@ def ParamToDMP(param,dmp,dims=7,num_weights=6):
 
 '''
 SearchDMP
+Sample num_samples DMP parameter vectors from Z and keep the ones whose
+trajectories are more likely than ll_percentile of the samples.
 '''
 def SearchDMP(Z,robot,world,
         x0,xdot0,t0,threshold,seg_length,tau,dt,int_iter,dmp,
@@ -149,53 +205,70 @@ def SearchDMP(Z,robot,world,
         num_weights=6,
         num_samples=100):
 
-    #print "Search iteration:"
-    dmps = Z.sample(100)
-
-    assert(len(world.keys())==1)
-
-    #search = MarkerArray()
-    gen_trajs = []
-    gen_params = []
-    lls = []
-    count = 1
-    for i in range(100):
-        dmp2 = copy.deepcopy(dmp)
-        (goal,dmp2) = ParamToDMP(dmps[i],dmp,num_weights=num_weights)
+    return SearchDMPBatch(Z,robot,world,
+            x0,xdot0,t0,threshold,seg_length,tau,dt,int_iter,dmp,
+            ll_percentile=ll_percentile,
+            num_weights=num_weights,
+            num_samples=num_samples)
 
-        RequestActiveDMP(dmp2)
-        plan = PlanDMP(x0,xdot0,t0,goal,threshold,seg_length,tau,dt,int_iter)
-
-        #ll = robot.GetTrajectoryLikelihood(plan.plan.points,world)
-        #print ll
-
-        traj = [pt.positions[:7] for pt in plan.plan.points]
-        ll = robot.GetTrajectoryLikelihood(traj,world,objs=['link'])
-        #ll = robot.GetTrajectoryLikelihood(traj,world,(10,17))
-        #ll = robot.GetTrajectoryLikelihood(traj,world,(3,3+(7*len(world.keys()))))
-
-        lls.append(ll)
-
-        gen_trajs.append(traj)
-        gen_params.append(ParamFromDMP(goal,dmp2))
+'''
+SearchDMPBatch
+Batched version of SearchDMP: all of the sampled DMPs are planned at once
+with numpy_dmp.IntegrateDMPs, and every trajectory is scored together with
+robot.GetTrajectoryLikelihoods.
 
-    search_lls = []
-    search_trajs = []
-    search_params = []
+With num_rounds > 1 this is a cross-entropy search: after each round a
+gaussian is fit to the samples above ll_percentile, and the next
+num_samples parameter vectors are drawn from it instead of from Z.
+noise is added to the diagonal of its covariance.
 
-    #print "... done with DMPs."
+Returns the same values as SearchDMP for the last round.
+'''
+def SearchDMPBatch(Z,robot,world,
+        x0,xdot0,t0,threshold,seg_length,tau,dt,int_iter,dmp,
+        ll_percentile=90,
+        num_weights=6,
+        num_samples=1000,
+        num_rounds=1,
+        noise=1e-6,
+        objs=['link']):
 
-    search_params = []
-    ll_threshold = np.percentile(lls,90)
-    for (ll,param,traj) in zip(lls,gen_params,gen_trajs):
-        if ll > ll_threshold:
-            search_params.append(param)
-            search_trajs.append(traj)
-            search_lls.append(ll)
+    assert(len(world.keys())==1)
 
+    dims = len(dmp)
+    num_params = dims + (dims * num_weights)
+    k_gains = [idmp.k_gain for idmp in dmp]
+    d_gains = [idmp.d_gain for idmp in dmp]
+    params = np.array(Z.sample(num_samples))[:,:num_params]
+
+    for search_round in range(num_rounds):
+        goals = params[:,:dims]
+        weights = params[:,dims:].reshape(len(params),dims,num_weights)
+        positions, velocities, times, lengths, at_goal = numpy_dmp.IntegrateDMPs(
+                weights,k_gains,d_gains,x0,xdot0,t0,goals,threshold,
+                seg_length,tau,dt,int_iter)
+
+        gen_trajs = [positions[i,:7,:lengths[i]].T for i in range(len(params))]
+        lls = robot.GetTrajectoryLikelihoods(gen_trajs,world,objs=objs)
+        ll_threshold = np.percentile(lls,ll_percentile)
+
+        if search_round + 1 < num_rounds:
+            # refit the sampling distribution to the best samples
+            elite = params[lls >= ll_threshold]
+            mu = np.mean(elite,axis=0)
+            if len(elite) > 1:
+                sigma = np.cov(elite,rowvar=0)
+            else:
+                sigma = np.zeros((num_params,num_params))
+            sigma += noise * np.eye(num_params)
+            params = np.random.multivariate_normal(mu,sigma,num_samples)
+
+    search = lls > ll_threshold
+    search_lls = list(lls[search])
+    search_trajs = [traj for (traj,keep) in zip(gen_trajs,search) if keep]
+    search_params = [list(param) for param in params[search]]
 
     print "... Done. Average goal probability: %f"%(np.mean(lls))
     print "    Found %d with p>%f."%(len(search_params),ll_threshold)
 
-    return lls,search_lls,search_trajs,search_params,gen_trajs
-
+    return list(lls),search_lls,search_trajs,search_params,gen_trajs
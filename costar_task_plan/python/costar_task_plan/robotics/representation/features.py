@@ -66,6 +66,75 @@ def P_Gauss(x,mu,inv,det,wts):
 
     return np.log(p)
 
+def QuaternionFromMatrices(R):
+    '''
+    QuaternionFromMatrices
+    Get the (x,y,z,w) quaternions of a (N,3,3) stack of rotation matrices,
+    choosing the same branch and sign as PyKDL's Rotation.GetQuaternion.
+    '''
+    R = np.asarray(R,dtype=np.float64)
+    q = np.zeros((R.shape[0],4))
+    trace = R[:,0,0] + R[:,1,1] + R[:,2,2]
+
+    idx = trace > 1e-12
+    s = 0.5 / np.sqrt(trace[idx] + 1.0)
+    q[idx,3] = 0.25 / s
+    q[idx,0] = (R[idx,2,1] - R[idx,1,2]) * s
+    q[idx,1] = (R[idx,0,2] - R[idx,2,0]) * s
+    q[idx,2] = (R[idx,1,0] - R[idx,0,1]) * s
+
+    rest = ~idx
+    idx = rest & (R[:,0,0] > R[:,1,1]) & (R[:,0,0] > R[:,2,2])
+    rest &= ~idx
+    s = 2.0 * np.sqrt(1.0 + R[idx,0,0] - R[idx,1,1] - R[idx,2,2])
+    q[idx,3] = (R[idx,2,1] - R[idx,1,2]) / s
+    q[idx,0] = 0.25 * s
+    q[idx,1] = (R[idx,0,1] + R[idx,1,0]) / s
+    q[idx,2] = (R[idx,0,2] + R[idx,2,0]) / s
+
+    idx = rest & (R[:,1,1] > R[:,2,2])
+    rest &= ~idx
+    s = 2.0 * np.sqrt(1.0 + R[idx,1,1] - R[idx,0,0] - R[idx,2,2])
+    q[idx,3] = (R[idx,0,2] - R[idx,2,0]) / s
+    q[idx,0] = (R[idx,0,1] + R[idx,1,0]) / s
+    q[idx,1] = 0.25 * s
+    q[idx,2] = (R[idx,1,2] + R[idx,2,1]) / s
+
+    idx = rest
+    s = 2.0 * np.sqrt(1.0 + R[idx,2,2] - R[idx,0,0] - R[idx,1,1])
+    q[idx,3] = (R[idx,1,0] - R[idx,0,1]) / s
+    q[idx,0] = (R[idx,0,2] + R[idx,2,0]) / s
+    q[idx,1] = (R[idx,1,2] + R[idx,2,1]) / s
+    q[idx,2] = 0.25 * s
+
+    return q
+
+def GetFeaturesFromMatrices(ee,t,world,objs,gripper):
+    '''
+    GetFeaturesFromMatrices
+    Vectorized version of RobotFeatures.GetFeatures for N points at once,
+    with the same feature layout.
+    - ee is a (N,4,4) stack of end effector transforms
+    - t is the time feature of each point
+    - world maps each object to its (N,4,4) transforms
+    - gripper is a (N,NUM_GRIPPER_VARS) array
+    Returns the (N,F) feature matrix.
+    '''
+    columns = []
+    for obj in objs:
+        if obj == TIME:
+            columns.append(np.reshape(t,(-1,1)))
+        elif obj == GRIPPER:
+            columns.append(np.reshape(gripper,(len(ee),-1)))
+        else:
+            # object offset to end effector: obj_frame.Inverse() * ee_frame
+            obj_rot_t = np.transpose(world[obj][:,:3,:3],(0,2,1))
+            p = np.einsum('nij,nj->ni',obj_rot_t,ee[:,:3,3] - world[obj][:,:3,3])
+            R = np.einsum('nij,njk->nik',obj_rot_t,ee[:,:3,:3])
+            columns += [p, np.linalg.norm(p,axis=1)[:,None], QuaternionFromMatrices(R)]
+
+    return np.concatenate(columns,axis=1)
+
 class RobotFeatures:
     '''
     Old class that holds and represents a robot -- for one skill and one skill
@@ -364,6 +433,21 @@ class RobotFeatures:
 
         return f
 
+    '''
+    GetForwardMatrices
+    Returns the (T,4,4) end effector transforms in the base_tform frame for
+    a joint trajectory, the matrix version of base_tform * GetForward(q).
+    '''
+    def GetForwardMatrices(self,traj):
+
+        if hasattr(self.kinematics,'forwardBatch'):
+            mats = self.kinematics.forwardBatch([q[:self.dof] for q in traj])
+        else:
+            mats = np.array([np.asarray(self.kinematics.forward(q[:self.dof])) for q in traj])
+        if not self.manip_frame is None:
+            mats = np.dot(mats,pm.toMatrix(self.manip_frame))
+        return np.einsum('ij,njk->nik',pm.toMatrix(self.base_tform),mats)
+
     '''
     SetWorld
     Sets locations of different objects at the beginning of the action.
@@ -429,8 +513,8 @@ class RobotFeatures:
 
         weights = [0.0]*len(traj)
 
-        ee_frame = [self.base_tform * self.GetForward(q[:self.dof]) for q in traj]
-        features, goal_features = self.GetFeaturesForTrajectory(ee_frame,world,objs)
+        ee = self.GetForwardMatrices(traj)
+        features, goal_features = self.GetFeaturesForTrajectoryMatrices(ee,self.GetWorldMatrices(world,objs),objs)
 
         features = self.NormalizeActionNG(features)
         if not self.goal_model is None:
@@ -459,8 +543,8 @@ class RobotFeatures:
         Will then score them as per usual
         '''
 
-        ee_frame = [self.base_tform * self.GetForward(q[:self.dof]) for q in traj]
-        features,goal_features = self.GetFeaturesForTrajectory(ee_frame,world,objs)
+        ee = self.GetForwardMatrices(traj)
+        features,goal_features = self.GetFeaturesForTrajectoryMatrices(ee,self.GetWorldMatrices(world,objs),objs)
         isum = np.sum(range(len(features)))
         scores = self.traj_model.score(features)
 
@@ -469,29 +553,100 @@ class RobotFeatures:
 
         return self.goal_model.score(goal_features) + avg
 
+    def GetTrajectoryLikelihoods(self,trajs,world,objs):
+        '''
+        GetTrajectoryLikelihoods
+        Batched GetTrajectoryLikelihood for a list of joint trajectories.
+        The features of all of the trajectories are scored with a single
+        call to the trajectory model and a single call to the goal model.
+        Every trajectory needs at least two points.
+
+        As in GetTrajectoryLikelihood, the likelihood of a trajectory is the
+        total log likelihood of its features plus that of its goal features.
+        '''
+
+        world_mats = self.GetWorldMatrices(world,objs)
+        features = []
+        goal_features = []
+        for traj in trajs:
+            ee = self.GetForwardMatrices(traj)
+            traj_features,traj_goal_features = self.GetFeaturesForTrajectoryMatrices(ee,world_mats,objs)
+            features.append(traj_features)
+            goal_features.append(traj_goal_features)
+
+        lengths = np.array([len(f) for f in features])
+        starts = np.concatenate([[0],np.cumsum(lengths)[:-1]])
+        scores = self.traj_model.loglikelihood(np.concatenate(features))
+
+        # total score of each trajectory
+        traj_scores = np.add.reduceat(scores,starts)
+
+        # one row of goal features per trajectory
+        goal_scores = self.goal_model.loglikelihood(np.concatenate(goal_features))
+        return goal_scores + traj_scores
+
     def GetFeaturesForTrajectory(self,ee_frame,world,objs,gripper=None):
         '''
         GetFeaturesForTrajectory
+        Converts the PyKDL frames to transform matrices and computes the
+        features with GetFeaturesForTrajectoryMatrices.
         '''
 
-        #features = [[]]*(len(traj)-1)
-        npts = len(ee_frame)-1
-        features = [[]]*(npts)
+        ee = np.array([pm.toMatrix(f) for f in ee_frame])
+        return self.GetFeaturesForTrajectoryMatrices(ee,self.GetWorldMatrices(world,objs),objs,gripper)
+
+    def GetWorldMatrices(self,world,objs):
+        '''
+        GetWorldMatrices
+        Convert the PyKDL frames of the objects in world to transform matrices,
+        a list of frames becomes a (T,4,4) stack.
+        '''
 
-        #diffs = self.GetDiffFeatures(ee_frame,world,objs)
+        world_mats = {}
+        for obj in objs:
+            if obj == TIME or obj == GRIPPER:
+                continue
+            elif isinstance(world[obj], list):
+                world_mats[obj] = np.array([pm.toMatrix(f) for f in world[obj]])
+            else:
+                world_mats[obj] = pm.toMatrix(world[obj])
+        return world_mats
 
-        if not gripper is None:
-            for i in range(npts):
-                t = float(i+1) / npts
-                features[i] = self.GetFeatures(ee_frame[i],t,world,objs,i,gripper[i]) #+ diffs[i]
-            goal_features = self.GetFeatures(ee_frame[-1],0.0,world,objs,i,gripper[i-1])
+    def GetFeaturesForTrajectoryMatrices(self,ee,world,objs,gripper=None):
+        '''
+        GetFeaturesForTrajectoryMatrices
+        Features of every point of a (T,4,4) stack of end effector transforms.
+        Each object in world is a single (4,4) transform or a stack with one
+        transform per point. Returns the (T-1,F) features of the first T-1
+        points and the (1,F) goal features of the last point, in the same
+        layout as GetFeatures.
+        '''
+
+        ee = np.asarray(ee,dtype=np.float64)
+        npts = len(ee)-1
+
+        # point i has time (i+1)/npts, the goal has time 0 and uses
+        # the world and gripper of the points before it
+        idx = np.append(np.arange(npts),npts-1)
+        t = np.append(np.arange(1,npts+1,dtype=np.float64) / npts,0.0)
+        if gripper is None:
+            gripper = np.zeros((npts+1,NUM_GRIPPER_VARS))
         else:
-            for i in range(npts):
-                t = float(i+1) / npts
-                features[i] = self.GetFeatures(ee_frame[i],t,world,objs,i)
-            goal_features = self.GetFeatures(ee_frame[-1],0.0,world,objs,i)
+            gripper = np.array(gripper,dtype=np.float64).reshape(len(gripper),-1)
+            gripper = gripper[np.append(np.arange(npts),npts-2)]
+
+        world_mats = {}
+        for obj in objs:
+            if obj == TIME or obj == GRIPPER:
+                continue
+            obj_mats = np.asarray(world[obj],dtype=np.float64)
+            if obj_mats.ndim == 2:
+                world_mats[obj] = np.broadcast_to(obj_mats,(npts+1,4,4))
+            else:
+                world_mats[obj] = obj_mats[idx]
 
-        return np.array(features), np.array([goal_features])
+        features = GetFeaturesFromMatrices(ee,t,world_mats,objs,gripper)
+        return features[:-1], features[-1:]
 
     def GetFeatures(self,ee_frame,t,world,objs,idx,gripper=[0]*NUM_GRIPPER_VARS):
         '''
@@ -1,6 +1,7 @@
 from __future__ import print_function
 
 import numpy as np
+from multiprocessing import Pool
 from pypr.clustering import gmm
 import yaml
 try:
@@ -12,6 +13,13 @@ class GMM(yaml.YAMLObject):
     '''
     Wraps some PyPr functions for easy grouping of different GMMs.
     Uses a couple different functions.
+
+    Scoring does not go through PyPr: updateInvSigma() precomputes the
+    cholesky factor and log determinant of every covariance, and
+    loglikelihood() scores all components of an (N, D) batch at once with
+    a single log-sum-exp. The results are the same as PyPr's
+    gm_log_likelihood(). diag is added to the diagonal of each covariance
+    before it is factorized, so rank deficient covariances still work.
     '''
 
     yaml_tag = u'!GMM'
@@ -20,7 +28,8 @@ class GMM(yaml.YAMLObject):
         if rawdata is not None:
             self.__dict__.update(rawdata)
         else:
-            self.k = 1
+            self.k = k
+            self.diag = diag
             self.invsigma = [None] * k
             self.det = [None] * k
 
@@ -29,9 +38,9 @@ class GMM(yaml.YAMLObject):
             elif not config == None:
                 self.mu = config['mu']
                 self.sigma = config['sigma']
-                self.updateInvSigma()
                 self.pi = config['pi']
                 self.k = config['k']
+                self.updateInvSigma()
             else:
                 raise RuntimeError('Must provide either data array or config')
 
@@ -40,15 +49,25 @@ class GMM(yaml.YAMLObject):
             self.sigma[i] += noise * np.eye(self.sigma[i].shape[0])
 
     def updateInvSigma(self):
+        '''
+        Precompute the inverse cholesky factor, log determinant and inverse
+        of each covariance, after adding diag to its diagonal. Raises
+        np.linalg.LinAlgError if a covariance is still not positive definite.
+        '''
+        # models loaded from older yaml files have no diag
+        diag = getattr(self, 'diag', 1e-8)
+        self.invchol = np.zeros((self.k,) + np.shape(self.sigma[0]))
+        self.logdet = np.zeros(self.k)
+        self.invsigma = [None] * self.k
+        self.det = [None] * self.k
         for i in range(self.k):
-            self.invsigma[i] = np.linalg.inv(self.sigma[i])
-            #try:
-            #    self.invsigma[i] = np.linalg.inv(self.sigma[i])
-            #except np.linalg.linalg.LinAlgError, e:
-            #    #print("ERROR: Inverse failed for cluster %d!" % i)
-            #    #print(self.sigma[i])
-            #    raise e
-
+            sigma = np.asarray(self.sigma[i], dtype=np.float64)
+            sigma = sigma + diag * np.eye(sigma.shape[0])
+            invchol = np.linalg.inv(np.linalg.cholesky(sigma))
+            self.invchol[i] = invchol
+            self.logdet[i] = -2. * np.sum(np.log(np.diag(invchol)))
+            self.invsigma[i] = np.dot(invchol.T, invchol)
+            self.det[i] = np.exp(self.logdet[i])
 
     def fit(self, data):
         '''
@@ -69,17 +88,29 @@ class GMM(yaml.YAMLObject):
 
     def score(self, data):
         '''
-        return log likelihoods
+        return the total log likelihood of the rows of data
         '''
-        return gmm.gm_log_likelihood(data, self.mu, self.sigma, self.pi)
+        return np.sum(self.loglikelihood(data))
 
     def loglikelihood(self, data):
-        # for i in range(k):
-        i = 0
-        ex1 = np.dot(self.invsigma[i], (data.T - self.mu[i]).T)
-        ex = -0.5 * np.dot((data.T - self.mu[i]).T, ex1)
-        return ex  # self.mu[0].transpose() * self.invsigma[0] * self.mu[0]
-
+        '''
+        return the log likelihood of each row of data under the mixture
+        '''
+        if getattr(self, 'invchol', None) is None:
+            # models loaded from older yaml files
+            self.updateInvSigma()
+        data = np.atleast_2d(data)
+        dims = data.shape[1]
+        mu = np.reshape(self.mu, (self.k, dims))
+        # whitened offset of every row from every component mean
+        z = np.einsum('kij,nj->nki', self.invchol, data) - \
+            np.einsum('kij,kj->ki', self.invchol, mu)
+        log_p = -0.5 * (np.sum(z * z, axis=-1) + self.logdet + dims * np.log(2 * np.pi))
+        log_p += np.log(np.ravel(self.pi))
+
+        # log-sum-exp over the components
+        log_p_max = np.max(log_p, axis=1, keepdims=True)
+        return log_p_max[:, 0] + np.log(np.sum(np.exp(log_p - log_p_max), axis=1))
 
     def sample(self, nsamples=1):
         '''
@@ -96,3 +127,53 @@ class GMM(yaml.YAMLObject):
 
     def dict(self):
         return {'mu': self.mu, 'sigma': self.sigma, 'pi': self.pi, 'k': self.k}
+
+
+def FitGMMParams(args):
+    '''
+    Fit the parameters of a GMM with k components to data, for use in a
+    process pool. Returns (mu, sigma, pi), or None if fitting failed.
+    '''
+    k, data = args
+    try:
+        model = GMM(k, data)
+    except np.linalg.LinAlgError:
+        return None
+    return model.mu, model.sigma, model.pi
+
+
+def FitGMMs(datasets, k=1, processes=None):
+    '''
+    Fit one GMM with k components to each dataset, with EM running for
+    several datasets at once in a pool of processes.
+
+    Parameters:
+    -----------
+    datasets: dictionary from name to an (N, D) data array
+    k: number of mixture components
+    processes: number of processes, 1 fits in this process,
+               None uses one per cpu
+
+    Returns a dictionary from name to GMM, with None for any dataset
+    that could not be fit.
+    '''
+    names = list(datasets.keys())
+    jobs = [(k, datasets[name]) for name in names]
+    if processes == 1 or len(jobs) < 2:
+        results = [FitGMMParams(job) for job in jobs]
+    else:
+        pool = Pool(processes)
+        try:
+            results = pool.map(FitGMMParams, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    models = {}
+    for name, result in zip(names, results):
+        if result is None:
+            models[name] = None
+        else:
+            mu, sigma, pi = result
+            models[name] = GMM(config={'mu': mu, 'sigma': sigma, 'pi': pi, 'k': k})
+    return models
@@ -0,0 +1,239 @@
+'''
+NUMPY DMPS
+===============================================================
+In-process versions of the learn_dmp_from_demo, set_active_dmp and
+get_dmp_plan services of the ROS dmp package
+(http://wiki.ros.org/dmp, by Scott Niekum).
+
+The dmp package represents the forcing function of each dimension with
+a Fourier cosine basis over scaled time t / tau. Learning solves for the
+basis weights of every dimension with one least squares projection, and
+planning integrates a whole batch of DMPs at once, so fitting skills and
+planning many rollouts do not need a running dmp server.
+
+Arrays of plans are indexed as (samples x dims x time).
+'''
+
+import numpy as np
+
+# Ensures 99% phase convergence at t = tau, as in the dmp package
+ALPHA = -np.log(0.01)
+
+# Plans are cut off after this many seconds in case of overshoot or oscillation
+MAX_PLAN_LENGTH = 1000.
+
+
+class DMPData(object):
+    '''
+    Stand-in for dmp.msg.DMPData, used when the ROS dmp package is not installed.
+    '''
+
+    def __init__(self, k_gain=0., d_gain=0., weights=[], f_domain=[], f_targets=[]):
+        self.k_gain = k_gain
+        self.d_gain = d_gain
+        self.weights = list(weights)
+        self.f_domain = list(f_domain)
+        self.f_targets = list(f_targets)
+
+
+class DMPPoint(object):
+    '''
+    Stand-in for dmp.msg.DMPPoint.
+    '''
+
+    def __init__(self, positions=[], velocities=[]):
+        self.positions = list(positions)
+        self.velocities = list(velocities)
+
+
+class DMPTraj(object):
+    '''
+    Stand-in for dmp.msg.DMPTraj.
+    '''
+
+    def __init__(self, points=[], times=[]):
+        self.points = list(points)
+        self.times = list(times)
+
+
+def CalcPhase(t, tau):
+    '''
+    Phase variable of the canonical system, decays from 1 to 0.01 at t = tau.
+    '''
+    return np.exp(-(ALPHA / tau) * t)
+
+
+def FourierFeatures(x, num_weights):
+    '''
+    Fourier cosine basis features cos(pi * i * x) for i in [0, num_weights).
+    Returns an array of shape x.shape + (num_weights,).
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    return np.cos(np.pi * x[..., None] * np.arange(num_weights))
+
+
+def LearnDMPWeights(x, times, k_gains, d_gains, num_bases):
+    '''
+    Learn the DMP for every dimension of a demonstration.
+
+    Velocities and accelerations are estimated by finite differences, assuming
+    constant acceleration over each time step, and the forcing function targets
+    of all dimensions are projected onto the basis in one least squares solve.
+
+    Params:
+    - x: (time x dims) array of demonstration positions
+    - times: the time of each point in x
+    - k_gains, d_gains: spring and damper gain of each dimension
+    - num_bases: order of the Fourier basis, there are num_bases + 1 weights
+
+    Returns (weights, tau, f_domain, f_targets): weights is (dims x num_bases + 1),
+    tau is the duration of the demonstration, f_domain the scaled time of each point
+    and f_targets the (time x dims) forcing function targets.
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    if len(x) < 1:
+        raise ValueError('LearnDMPWeights: empty demonstration')
+    k_gains = np.asarray(k_gains, dtype=np.float64)
+    d_gains = np.asarray(d_gains, dtype=np.float64)
+    tau = times[-1]
+    x_0 = x[0]
+    goal = x[-1]
+
+    v = np.zeros(x.shape)
+    v_dot = np.zeros(x.shape)
+    if len(x) > 1:
+        dt = np.diff(times)[:, None]
+        v[1:] = np.diff(x, axis=0) / dt
+        v_dot[1:] = np.diff(v, axis=0) / dt
+
+    phase = CalcPhase(times, tau)[:, None]
+    # scaled time is cleaner than phase for spacing reasons
+    f_domain = times / tau
+    f_targets = (((tau * tau * v_dot) + d_gains * tau * v) / k_gains
+                 - (goal - x) + ((goal - x_0) * phase))
+    # divide by the phase instead of scaling the function approximation output
+    f_targets /= phase
+
+    # least squares weights via projection onto the basis functions
+    features = FourierFeatures(f_domain, num_bases + 1)
+    weights = np.dot(np.dot(np.linalg.pinv(np.dot(features.T, features)), features.T), f_targets)
+    return weights.T, tau, f_domain, f_targets
+
+
+def IntegrateDMPs(weights, k_gains, d_gains, x_0, x_dot_0, t_0, goal, goal_thresh,
+                  seg_length, tau, total_dt, integrate_iter):
+    '''
+    Plan with a batch of DMPs at once, the vectorized version of get_dmp_plan.
+
+    Each plan point is integrated with integrate_iter Euler steps of
+    total_dt / integrate_iter. Plans last at least until tau and then continue
+    until every dimension with goal_thresh > 0 is within goal_thresh of the goal,
+    for at most MAX_PLAN_LENGTH seconds. If seg_length > 0 planning stops after
+    seg_length seconds. Samples which reach their goal earlier stop changing.
+
+    Params:
+    - weights: (samples x dims x num_weights) or (dims x num_weights) DMP weights
+    - k_gains, d_gains: gains of each dimension, (dims,) or (samples x dims)
+    - x_0, x_dot_0, goal, goal_thresh: (dims,) or (samples x dims)
+    - t_0, seg_length, tau, total_dt, integrate_iter: scalars shared by every sample
+
+    Returns (positions, velocities, times, lengths, at_goal): positions and
+    velocities are (samples x dims x time), times is the start time of each plan
+    point, lengths is the number of points in the plan of each sample, after
+    which the plan repeats its last point, and at_goal says which samples
+    reached their goal.
+    '''
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.ndim == 2:
+        weights = weights[None]
+    num_samples, dims, num_weights = weights.shape
+    shape = (num_samples, dims)
+    k_gains = np.broadcast_to(np.asarray(k_gains, dtype=np.float64), shape)
+    d_gains = np.broadcast_to(np.asarray(d_gains, dtype=np.float64), shape)
+    x_0 = np.broadcast_to(np.asarray(x_0, dtype=np.float64), shape)
+    goal = np.broadcast_to(np.asarray(goal, dtype=np.float64), shape)
+    goal_thresh = np.broadcast_to(np.asarray(goal_thresh, dtype=np.float64), shape)
+    dt = float(total_dt) / integrate_iter
+
+    x = x_0.copy()
+    v = np.broadcast_to(np.asarray(x_dot_0, dtype=np.float64), shape) * tau
+    active = np.ones(num_samples, dtype=bool)
+    at_goal = np.zeros(num_samples, dtype=bool)
+    lengths = np.zeros(num_samples, dtype=int)
+    x_list = []
+    x_dot_list = []
+    t_list = []
+    t = 0.
+    seg_end = False
+    while active.any() and not seg_end:
+        if seg_length > 0 and t > seg_length:
+            seg_end = True
+
+        # integrate this plan point for the samples that are still planning
+        x_next = x[active]
+        v_next = v[active]
+        for j in range(integrate_iter):
+            t_j = t + t_0 + dt * j
+            s = CalcPhase(t_j, tau)
+            if t_j / tau >= 1.0:
+                f_eval = 0.
+            else:
+                f_eval = np.dot(weights[active], FourierFeatures(t_j / tau, num_weights)) * s
+            v_dot = (k_gains[active] * ((goal[active] - x_next) - (goal[active] - x_0[active]) * s + f_eval)
+                     - d_gains[active] * v_next) / tau
+            x_dot = v_next / tau
+            v_next = v_next + v_dot * dt
+            x_next = x_next + x_dot * dt
+        x[active] = x_next
+        v[active] = v_next
+        lengths[active] += 1
+        x_list.append(x.copy())
+        x_dot_list.append(v / tau)
+        t_list.append(t)
+
+        at_goal[active] = np.all((goal_thresh[active] <= 0) |
+                                 (np.abs(x_next - goal[active]) <= goal_thresh[active]), axis=-1)
+        t += total_dt
+        if t + t_0 >= tau:
+            active &= ~at_goal & (t < MAX_PLAN_LENGTH)
+
+    positions = np.stack(x_list, axis=-1)
+    velocities = np.stack(x_dot_list, axis=-1)
+    return positions, velocities, np.array(t_list), lengths, at_goal
+
+
+def PlanToTraj(positions, velocities, times, length=None, traj_type=DMPTraj, point_type=DMPPoint):
+    '''
+    Convert the (dims x time) positions and velocities of one plan to a DMPTraj.
+    '''
+    if length is None:
+        length = positions.shape[-1]
+    traj = traj_type()
+    for i in range(length):
+        pt = point_type()
+        pt.positions = positions[:, i].tolist()
+        pt.velocities = velocities[:, i].tolist()
+        traj.points.append(pt)
+        traj.times.append(float(times[i]))
+    return traj
+
+
+class LearnDMPFromDemoResponse(object):
+    '''
+    Stand-in for dmp.srv.LearnDMPFromDemoResponse.
+    '''
+
+    def __init__(self, dmp_list=[], tau=0.):
+        self.dmp_list = dmp_list
+        self.tau = tau
+
+
+class GetDMPPlanResponse(object):
+    '''
+    Stand-in for dmp.srv.GetDMPPlanResponse.
+    '''
+
+    def __init__(self, plan=None, at_goal=0):
+        self.plan = DMPTraj() if plan is None else plan
+        self.at_goal = at_goal
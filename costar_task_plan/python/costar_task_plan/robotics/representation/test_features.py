@@ -0,0 +1,52 @@
+from __future__ import print_function
+
+import numpy as np
+
+from costar_task_plan.robotics.representation.features import RobotFeatures
+from costar_task_plan.robotics.representation.gmm import GMM
+
+
+class TranslationFeatures(RobotFeatures):
+    '''
+    RobotFeatures whose end effector is at the first three joint positions,
+    with a single object at the origin.
+    '''
+
+    def __init__(self, traj_model, goal_model):
+        self.traj_model = traj_model
+        self.goal_model = goal_model
+
+    def GetForwardMatrices(self, traj):
+        mats = np.tile(np.eye(4), (len(traj), 1, 1))
+        mats[:, :3, 3] = np.asarray(traj)[:, :3]
+        return mats
+
+    def GetWorldMatrices(self, world, objs):
+        return {obj: np.eye(4) for obj in objs}
+
+
+def test_trajectory_likelihoods():
+    rng = np.random.RandomState(0)
+    dims = 8
+    traj_model = GMM(config={'mu': [rng.normal(size=dims)],
+                             'sigma': [np.eye(dims)], 'pi': np.ones(1), 'k': 1})
+    goal_model = GMM(config={'mu': [rng.normal(size=dims)],
+                             'sigma': [2 * np.eye(dims)], 'pi': np.ones(1), 'k': 1})
+    robot = TranslationFeatures(traj_model, goal_model)
+    world = {'link': None}
+    objs = ['link']
+
+    trajs = [rng.normal(size=(length, 7)) for length in [2, 5, 9]]
+    lls = robot.GetTrajectoryLikelihoods(trajs, world, objs)
+
+    expected = []
+    for traj in trajs:
+        features, goal_features = robot.GetFeaturesForTrajectoryMatrices(
+            robot.GetForwardMatrices(traj), robot.GetWorldMatrices(world, objs), objs)
+        expected.append(traj_model.score(features) + goal_model.score(goal_features))
+    assert lls.shape == (len(trajs),)
+    assert np.allclose(lls, expected)
+
+
+if __name__ == '__main__':
+    test_trajectory_likelihoods()
@@ -0,0 +1,46 @@
+from __future__ import print_function
+
+import numpy as np
+from pypr.clustering import gmm
+
+from costar_task_plan.robotics.representation.gmm import GMM
+
+
+def random_mixture(rng, k, dims):
+    mu = [rng.normal(size=dims) for _ in range(k)]
+    sigma = []
+    for _ in range(k):
+        a = rng.normal(size=(dims, dims))
+        sigma.append(np.dot(a, a.T) + 0.1 * np.eye(dims))
+    pi = rng.uniform(0.5, 1.0, size=k)
+    return mu, sigma, pi / np.sum(pi)
+
+
+def test_loglikelihood_matches_pypr():
+    rng = np.random.RandomState(0)
+    for k in [1, 3]:
+        mu, sigma, pi = random_mixture(rng, k, 5)
+        model = GMM(config={'mu': mu, 'sigma': sigma, 'pi': pi, 'k': k})
+        data = rng.normal(scale=2.0, size=(50, 5))
+
+        expected = [gmm.gm_log_likelihood(data[i:i + 1], mu, sigma, pi)
+                    for i in range(len(data))]
+        assert np.allclose(model.loglikelihood(data), np.ravel(expected))
+        assert np.allclose(model.score(data),
+                           gmm.gm_log_likelihood(data, mu, sigma, pi))
+
+
+def test_fit_rank_deficient():
+    rng = np.random.RandomState(1)
+    data = rng.normal(size=(200, 4))
+    # one feature column is a linear combination of the others
+    data = np.concatenate([data, data[:, :1] - 2 * data[:, 1:2]], axis=1)
+    model = GMM(1, data)
+    ll = model.loglikelihood(data)
+    assert ll.shape == (200,)
+    assert np.all(np.isfinite(ll))
+
+
+if __name__ == '__main__':
+    test_loglikelihood_matches_pypr()
+    test_fit_rank_deficient()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+'''
+Microbenchmark for AbstractWorld.fork(), which is called once for every node
+expansion during MCTS.
+
+"toy" builds a lightweight world with a configurable number of moving and
+static actors. "simulation" loads the Bullet simulation used by
+costar_bullet; all of its simulation arguments (--robot, --task, ...) are
+accepted.
+
+Each fork is compared against a full copy of every actor and of the history,
+which is what fork() used to do, and against forkBatch(), which forks and
+advances a batch of sibling worlds together.
+'''
+
+from costar_task_plan.abstract import *
+
+import argparse
+import copy
+import numpy as np
+import sys
+import timeit
+
+
+class ToyState(AbstractState):
+
+    def __init__(self, x=0.):
+        super(ToyState, self).__init__()
+        self.x = x
+
+
+class ToyAction(AbstractAction):
+
+    def __init__(self, dx=0.):
+        super(ToyAction, self).__init__()
+        self.dx = dx
+
+
+class ToyDynamics(AbstractDynamics):
+
+    def __call__(self, state, action, dt):
+        return ToyState(state.x + action.dx * dt)
+
+    def applyBatch(self, states, actions, dt):
+        x = np.array([state.x for state in states])
+        dx = np.array([action.dx for action in actions])
+        return [ToyState(xi) for xi in (x + dx * dt).tolist()]
+
+
+class ToyPolicy(AbstractPolicy):
+
+    def __call__(self, world, state, actor):
+        return ToyAction(1.)
+
+
+class ToyActor(AbstractActor):
+    pass
+
+
+class StaticToyActor(AbstractActor):
+    static = True
+
+
+class ToyWorld(AbstractWorld):
+
+    def __init__(self, num_actors, num_static, *args, **kwargs):
+        super(ToyWorld, self).__init__(NullReward(), *args, **kwargs)
+        self.addActor(ToyActor(state=ToyState(), dynamics=ToyDynamics(self)))
+        for i in xrange(num_actors - 1):
+            self.addActor(ToyActor(state=ToyState(), policy=ToyPolicy(),
+                                   dynamics=ToyDynamics(self)))
+        for i in xrange(num_static):
+            self.addActor(StaticToyActor(state=ToyState()))
+        for i in xrange(self.history_length):
+            self.history.append((None, None))
+
+    def zeroAction(self, actor_id=0):
+        return ToyAction()
+
+    def _update_environment(self):
+        pass
+
+
+def legacyFork(world, action):
+    '''
+    Copy every actor and the history, then tick.
+    '''
+    new_world = copy.copy(world)
+    new_world.actors = [copy.copy(actor) for actor in world.actors]
+    new_world._owned_actors = set(xrange(len(new_world.actors)))
+    new_world.history = copy.copy(world.history)
+    new_world.updateTraceID()
+    new_world.tick(action)
+    return new_world
+
+
+def benchmark(name, fork, world, num_forks):
+    action = world.zeroAction(0)
+    start = timeit.default_timer()
+    for i in xrange(num_forks):
+        fork(world, action)
+    elapsed = timeit.default_timer() - start
+    print "%-8s %8d forks in %.3fs: %10.1f forks/sec" % (
+        name, num_forks, elapsed, num_forks / elapsed)
+
+
+def benchmarkBatch(world, num_forks, batch_size):
+    actions = [world.zeroAction(0) for _ in xrange(batch_size)]
+    num_batches = max(1, num_forks // batch_size)
+    start = timeit.default_timer()
+    for i in xrange(num_batches):
+        world.forkBatch(actions)
+    elapsed = timeit.default_timer() - start
+    num_forks = num_batches * batch_size
+    print "%-8s %8d forks in %.3fs: %10.1f forks/sec" % (
+        "batch%d" % batch_size, num_forks, elapsed, num_forks / elapsed)
+
+
+def getArgs(argv):
+    parser = argparse.ArgumentParser(add_help=False,
+                                     description=__doc__)
+    parser.add_argument("--world", choices=["toy", "simulation"],
+                        default="toy")
+    parser.add_argument("--num_forks", type=int, default=10000)
+    parser.add_argument("--batch_size", type=int, default=8,
+                        help="sibling worlds advanced together by forkBatch")
+    parser.add_argument("--num_actors", type=int, default=10,
+                        help="moving actors in the toy world")
+    parser.add_argument("--num_static", type=int, default=50,
+                        help="static actors in the toy world")
+    return parser.parse_known_args(argv)
+
+
+def main(argv):
+    args, remaining = getArgs(argv)
+    if args.world == "toy":
+        world = ToyWorld(args.num_actors, args.num_static)
+    else:
+        from costar_task_plan.simulation import GetSimulationParser
+        from costar_task_plan.simulation import BulletSimulationEnv
+        sim_args = vars(GetSimulationParser().parse_args(remaining))
+        env = BulletSimulationEnv(**sim_args)
+        env.reset()
+        world = env.world
+
+    benchmark("legacy", legacyFork, world, args.num_forks)
+    benchmark("fork", lambda w, a: w.fork(a), world, args.num_forks)
+    benchmarkBatch(world, args.num_forks, args.batch_size)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -35,6 +35,7 @@ from threading import Lock
 import h5py
 from ctp_integration.ros_geometry import pose_to_vec_quat_pair
 from ctp_integration.ros_geometry import pose_to_vec_quat_list
+from ctp_integration.image_encoding_queue import ImageEncodingQueue
 
 def timeStamped(fname, fmt='%Y-%m-%d-%H-%M-%S_{fname}'):
     """ Apply a timestamp to the front of a filename description.
@@ -68,7 +69,12 @@ class DataCollector(object):
             tf_listener=None,
             action_labels_to_always_log=None,
             verbose=0,
-            synchronize=False):
+            synchronize=False,
+            image_encoding_workers=2,
+            image_encoding_queue_size=2,
+            image_drop_policy='oldest',
+            max_image_rate=None,
+            stream_to_disk=True):
         """ Initialize a data collector object for writing ros topic information and data collection state to disk
 
         img_shape: currently ignored
@@ -78,6 +84,16 @@ class DataCollector(object):
         action_labels_to_always_log: 'move_to_home' is always logged by default, others can be added. This option may not work yet.
         verbose: print lots of extra info, useful for debuggging
         synchronize: will attempt to synchronize image data by timestamp. Not yet working as of 2018-05-05.
+        image_encoding_workers: number of threads that jpeg and png encode the camera images,
+            so the ROS image callbacks return right away, see ImageEncodingQueue.
+        image_encoding_queue_size: number of frames from each camera stream that may wait to be encoded.
+        image_drop_policy: which frame to drop when a stream's queue is full, 'oldest' keeps the newest
+            frames so the logged image has the lowest latency, 'newest' drops incoming frames.
+        max_image_rate: maximum rate in Hz at which frames from each stream are encoded, by message timestamp,
+            None encodes every frame the workers can keep up with.
+        stream_to_disk: with the h5f data_type, append each timestep to a temporary h5f file as it is logged,
+            rather than buffering the whole example in memory, and rename it when the example is saved.
+            See H5fStreamWriter.
         """
 
         self.js_topic = "joint_states"
@@ -129,6 +145,10 @@ class DataCollector(object):
         self.root = data_root
         self.data_type = data_type
         rospy.logwarn("Dataset root set to " + str(self.root))
+        self.stream_to_disk = stream_to_disk and self.data_type == "h5f"
+        # the H5fStreamWriter of the example in progress, see _append_timestep()
+        self.stream = None
+        self.image_types = [("image", "jpeg"), ("depth_image", "png")]
         if self.data_type == "h5f":
             self.writer = H5fDataset(self.root)
         elif self.data_type == "npz":
@@ -148,10 +168,17 @@ class DataCollector(object):
         self.camera_depth_info = None
         self.camera_rgb_info = None
         self.depth_img = None
+        self.depth_img_time = None
         self.rgb_img = None
         self.gripper_msg = None
 
         self._bridge = CvBridge()
+        self.image_encoding_queue = ImageEncodingQueue(
+            workers=image_encoding_workers,
+            max_pending=image_encoding_queue_size,
+            drop_policy=image_drop_policy)
+        for stream in ['rgb', 'depth', 'rgbd']:
+            self.image_encoding_queue.set_max_rate(stream, max_image_rate)
         self.task = task
         self.reset()
 
@@ -201,61 +228,47 @@ class DataCollector(object):
     def _rgbdCb(self, rgb_msg, depth_msg):
         if rgb_msg is None:
             rospy.logwarn("_rgbdCb: rgb_msg is None !!!!!!!!!")
+            return
         try:
-            # max out at 10 hz assuming 30hz data source
-            # TODO(ahundt) make mod value configurable
-            if rgb_msg.header.seq % 3 == 0:
-                cv_image = self._bridge.imgmsg_to_cv2(rgb_msg, "rgb8")
-
-                # decode the data, this will take some time
-
-                rospy.loginfo('rgb color cv_image shape: ' + str(cv_image.shape) + ' depth sequence number: ' + str(msg.header.seq))
-                # print('rgb color cv_image shape: ' + str(cv_image.shape))
-                cv_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
-                # encode the jpeg with high quality
-                encode_params = [cv2.IMWRITE_JPEG_QUALITY, 99]
-                rgb_img = cv2.imencode('.jpg', cv_image, encode_params)[1].tobytes()
-                # rgb_img = GetJpeg(np.asarray(cv_image))
-
-                cv_depth_image = self._bridge.imgmsg_to_cv2(depth_msg, desired_encoding="passthrough")
-                depth_encoded_as_rgb_numpy = encode_depth_numpy(cv_depth_image)
-                bytevalues = cv2.imencode('.png', depth_encoded_as_rgb_numpy)[1].tobytes()
-
-                with self.mutex:
-                    self.rgb_time = msg.header.stamp
-                    self.rgb_img = rgb_img
-                    # self.depth_info = depth_camera_info
-                    # self.rgb_info = rgb_camera_info
-                    self.depth_img_time = msg.header.stamp
-                    # self.depth_img = np_image
-                    # self.depth_img = img_str
-                    self.depth_img = bytevalues
-            #print(self.rgb_img)
+            # the frames are encoded in the background by self.image_encoding_queue,
+            # which drops frames according to image_drop_policy and max_image_rate
+            cv_image = self._bridge.imgmsg_to_cv2(rgb_msg, "rgb8")
+            cv_depth_image = self._bridge.imgmsg_to_cv2(depth_msg, desired_encoding="passthrough")
+            if self.verbose > 3:
+                rospy.loginfo('rgb color cv_image shape: ' + str(cv_image.shape) + ' rgb sequence number: ' + str(rgb_msg.header.seq))
+            self.image_encoding_queue.submit(
+                'rgbd', rgb_msg.header.stamp, encode_rgbd, (cv_image, cv_depth_image), self._rgbdEncodedCb)
         except CvBridgeError as e:
             rospy.logwarn(str(e))
 
+    def _rgbdEncodedCb(self, stamp, encoded):
+        rgb_img, bytevalues = encoded
+        with self.mutex:
+            # workers can finish out of order, only keep the newest frame
+            if self.rgb_time is None or stamp >= self.rgb_time:
+                self.rgb_time = stamp
+                self.rgb_img = rgb_img
+                self.depth_img_time = stamp
+                self.depth_img = bytevalues
+
     def _rgbCb(self, msg):
         if msg is None:
             rospy.logwarn("_rgbCb: msg is None !!!!!!!!!")
+            return
         try:
-            # max out at 10 hz assuming 30hz data source
-            if msg.header.seq % 3 == 0:
-                cv_image = self._bridge.imgmsg_to_cv2(msg, "rgb8")
-                # decode the data, this will take some time
-
-                # rospy.loginfo('rgb color cv_image shape: ' + str(cv_image.shape) + ' depth sequence number: ' + str(msg.header.seq))
-                # print('rgb color cv_image shape: ' + str(cv_image.shape))
-                cv_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
-                rgb_img = cv2.imencode('.jpg', cv_image)[1].tobytes()
-                # rgb_img = GetJpeg(np.asarray(cv_image))
-
-                with self.mutex:
-                    self.rgb_time = msg.header.stamp
-                    self.rgb_img = rgb_img
-            #print(self.rgb_img)
+            cv_image = self._bridge.imgmsg_to_cv2(msg, "rgb8")
+            # rospy.loginfo('rgb color cv_image shape: ' + str(cv_image.shape) + ' depth sequence number: ' + str(msg.header.seq))
+            self.image_encoding_queue.submit(
+                'rgb', msg.header.stamp, encode_rgb_jpeg, (cv_image,), self._rgbEncodedCb)
         except CvBridgeError as e:
             rospy.logwarn(str(e))
 
+    def _rgbEncodedCb(self, stamp, rgb_img):
+        with self.mutex:
+            if self.rgb_time is None or stamp >= self.rgb_time:
+                self.rgb_time = stamp
+                self.rgb_img = rgb_img
+
     def _infoCb(self, msg):
         with self.mutex:
             self.info = msg.data
@@ -278,82 +291,36 @@ class DataCollector(object):
 
     def _depthCb(self, msg):
         try:
-            if msg.header.seq % 3 == 0:
-                cv_image = self._bridge.imgmsg_to_cv2(msg, desired_encoding="passthrough")
-
-                # ref: https://stackoverflow.com/a/25592959
-                # also: https://stackoverflow.com/a/17970817
-                # kinda works, but only 8 bit image....
-
-                # img_str = cv2.imencode('.png', cv_image, cv2.CV_16U)[1].tobytes()
-                # img_str = np.frombuffer(cv2.imencode('.png', cv_image)[1].tobytes(), np.uint8)
-                # doesn't work
-                # img_str = np.string_(cv2.imencode('.png', cv_image)[1].tostring())
-                # img_str = io.BytesIO(img_str).getvalue()
-                # doesn't work
-                # img_str = io.BytesIO(cv2.imencode('.png', cv_image)[1].tobytes().getvalue())
-                # These values are in mm according to:
-                # https://github.com/ros-perception/depthimage_to_laserscan/blob/indigo-devel/include/depthimage_to_laserscan/depth_traits.h#L49
-                # np_image = np.asarray(cv_image, dtype=np.uint16)
-
-                # depth_image = PIL.Image.fromarray(np_image)
-
-                # if depth_image.mode == 'I;16':
-                #     # https://github.com/python-pillow/Pillow/issues/1099
-                #     # https://github.com/arve0/leicaexperiment/blob/master/leicaexperiment/experiment.py#L560
-                #     depth_image = depth_image.convert(mode='I')
-                # max_val = np.max(np_image)
-                # min_val = np.min(np_image)
-                # print('max val: ' + str(max_val) + ' min val: ' + str(min_val))
-                # decode the data, this will take some time
-                # output = io.BytesIO()
-                # depth_image.save(output, format="PNG")
-
-                # begin 32 bit float code (too slow)
-                # cv_image = self._bridge.imgmsg_to_cv2(msg, "32FC1")
-                # # These values are in mm according to:
-                # # https://github.com/ros-perception/depthimage_to_laserscan/blob/indigo-devel/include/depthimage_to_laserscan/depth_traits.h#L49
-                # np_image = np.asarray(cv_image, dtype=np.float32) * 1000.0
-                # # max_val = np.max(np_image)
-                # # min_val = np.min(np_image)
-                # # print('max val: ' + str(max_val) + ' min val: ' + str(min_val))
-                # # decode the data, this will take some time
-                # depth_image = FloatArrayToRgbImage(np_image)
-                # output = io.BytesIO()
-                # depth_image.save(output, format="PNG")
-                # end 32 bit float code (too slow)
-
-                # convert to meters from milimeters
-                # plt.imshow(cv_image, cmap='nipy_spectral')
-                # plt.pause(.01)
-                # plt.draw()
-                # print('np_image shape: ' + str(np_image.shape))
-
-                # split into three channels
-                # np_image = np.asarray(cv_image, dtype=np.uint32) * 1000
-                # r = np.array(np.divide(np_image, 256*256), dtype=np.uint8)
-                # g = np.array(np.mod(np.divide(np_image, 256), 256), dtype=np.uint8)
-                # b = np.array(np.mod(np_image, 256), dtype=np.uint8)
-
-                # split into two channels with a third zero channel
-
-                # bytevalues = uint16_depth_image_to_png_numpy(cv_image)
-                depth_encoded_as_rgb_numpy = encode_depth_numpy(cv_image)
-                bytevalues = cv2.imencode('.png', depth_encoded_as_rgb_numpy)[1].tobytes()
-
-                with self.mutex:
-                    self.depth_img_time = msg.header.stamp
-                    # self.depth_img = np_image
-                    # self.depth_img = img_str
-                    self.depth_img = bytevalues
-                # print (self.depth_img)
+            cv_image = self._bridge.imgmsg_to_cv2(msg, desired_encoding="passthrough")
+            # See encode_depth_png() for notes on the depth encoding.
+            self.image_encoding_queue.submit(
+                'depth', msg.header.stamp, encode_depth_png, (cv_image,), self._depthEncodedCb)
         except CvBridgeError as e:
             rospy.logwarn(str(e))
 
+    def _depthEncodedCb(self, stamp, bytevalues):
+        with self.mutex:
+            if self.depth_img_time is None or stamp >= self.depth_img_time:
+                self.depth_img_time = stamp
+                # self.depth_img = np_image
+                # self.depth_img = img_str
+                self.depth_img = bytevalues
+
+    def get_image_encoding_stats(self, reset=False):
+        """ Get the queue depth, dropped frame counts and encoding times of each camera stream.
+
+        See ImageEncodingQueue.stats().
+        """
+        return self.image_encoding_queue.stats(reset=reset)
+
     def setTask(self, task):
         self.task = task
 
     def reset(self):
+        if self.stream is not None:
+            # discard the unsaved example
+            self.stream.abort()
+            self.stream = None
         self.data = {}
         self.data["nsecs"] = []
         self.data["secs"] = []
@@ -432,6 +399,19 @@ class DataCollector(object):
             data and the error string will make it easier to determine
             what happened after the fact.
         '''
+        if isinstance(result, int) or isinstance(result, float):
+            result = "success" if result > 0. else "failure"
+        if log is None:
+            # save an empty string in the log if nothing is specified
+            log = ''
+
+        filename = timeStamped("example%06d.%s.h5f" % (seed, result))
+        self._log_image_encoding_stats()
+
+        if self.stream_to_disk:
+            self._save_stream(filename, log)
+            return
+
         if self.verbose:
             for k, v in self.data.items():
                 print(k, np.array(v).shape)
@@ -445,20 +425,77 @@ class DataCollector(object):
         # self.data['depth_image'] = np.asarray(self.data['depth_image'], dtype=dt)
         self.data['depth_image'] = np.asarray(self.data['depth_image'])
         self.data['image'] = np.asarray(self.data['image'])
-        if log is None:
-            # save an empty string in the log if nothing is specified
-            log = ''
         self.data['log'] = np.asarray(log)
 
-        if isinstance(result, int) or isinstance(result, float):
-            result = "success" if result > 0. else "failure"
-
-        filename = timeStamped("example%06d.%s.h5f" % (seed, result))
         rospy.loginfo('Saving dataset example with filename: ' + filename)
         # for now all examples are considered a success
-        self.writer.write(self.data, filename, image_types=[("image", "jpeg"), ("depth_image", "png")])
+        self.writer.write(self.data, filename, image_types=self.image_types)
+        self.reset()
+
+    def _save_stream(self, filename, log):
+        '''
+        Finish the example streamed to disk by _append_timestep() and rename it to filename.
+        '''
+        stream = self._get_stream()
+        # the labels and goals are small and the goals are only known at the end of each action
+        stream.extend("label", self.data["label"])
+        stream.extend("goal_idx", self.data["goal_idx"])
+        stream.write("labels_to_name", self.data["labels_to_name"])
+        stream.write("log", np.asarray(log))
+        for key, value in self.data.items():
+            # keys that were never logged are saved as empty datasets, as in the in memory case
+            if key not in stream.lengths and key not in stream.file:
+                stream.write(key, np.asarray(value))
+        # write the partial last chunks so the shapes below are complete
+        stream.flush()
+        if self.verbose:
+            for key in stream.file:
+                print(key, stream.file[key].shape)
+            print(self.data["labels_to_name"])
+            print("Labels and goals:")
+            print(self.data["label"])
+            print(self.data["goal_idx"])
+        rospy.loginfo('Saving dataset example with filename: ' + filename)
+        stream.finalize(filename)
+        self.stream = None
         self.reset()
 
+    def _get_stream(self):
+        '''
+        Get the H5fStreamWriter of the example in progress, starting one if needed.
+        '''
+        if self.stream is None:
+            self.stream = self.writer.stream(timeStamped("example_in_progress.tmp"), image_types=self.image_types)
+        return self.stream
+
+    def _append_timestep(self, row):
+        '''
+        Store the data logged in one call to update().
+
+        row: dictionary from data key to the value at this timestep.
+        '''
+        # the labels are kept in memory to compute the goal indices
+        self.data["label"].append(row.pop("label"))
+        if self.stream_to_disk:
+            self._get_stream().append_row(row)
+        else:
+            for key, value in row.items():
+                self.data[key].append(value)
+
+    def _log_image_encoding_stats(self):
+        """ Log and reset the image encoding counters of the example being saved.
+        """
+        for stream, stats in self.get_image_encoding_stats(reset=True).items():
+            rospy.loginfo(
+                'Image encoding for ' + stream + ' this example: ' +
+                str(stats['encoded']) + ' of ' + str(stats['submitted']) + ' frames encoded, ' +
+                str(stats['dropped']) + ' dropped with a full queue, ' +
+                str(stats['skipped']) + ' skipped by max_image_rate, ' +
+                str(stats['errors']) + ' errors, max queue depth ' + str(stats['max_queue_depth']) +
+                ', mean encode time ' + str(stats['mean_encode_time']) + ' sec')
+            if stats['last_error'] is not None:
+                rospy.logwarn('Image encoding error for ' + stream + ': ' + stats['last_error'])
+
     def set_home_pose(self, pose):
         self.home_xyz_quat = pose
 
@@ -657,64 +694,146 @@ class DataCollector(object):
 
         self.current_ee_pose = pm.fromTf(pose_to_vec_quat_pair(ee_pose))
 
-        self.data["nsecs"].append(np.copy(self.t.nsecs)) # time
-        self.data["secs"].append(np.copy(self.t.secs)) # time
-        self.data["pose"].append(np.copy(ee_xyz_quat)) # end effector pose (6 DOF)
-        self.data["camera"].append(np.copy(c_xyz_quat)) # camera pose (6 DOF)
+        row = {}
+        row["nsecs"] = np.copy(self.t.nsecs) # time
+        row["secs"] = np.copy(self.t.secs) # time
+        row["pose"] = np.copy(ee_xyz_quat) # end effector pose (6 DOF)
+        row["camera"] = np.copy(c_xyz_quat) # camera pose (6 DOF)
 
         if self.object:
-            self.data["object_pose"].append(np.copy(obj_xyz_quat))
+            row["object_pose"] = np.copy(obj_xyz_quat)
         elif 'move_to_home' in label_to_check:
-            self.data["object_pose"].append(self.home_xyz_quat)
+            row["object_pose"] = self.home_xyz_quat
             # TODO(ahundt) should object pose be all 0 or NaN when there is no object?
             # self.data["object_pose"].append([0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
         else:
             raise ValueError("Attempted to log unsupported "
                              "object pose data for action_label " +
                              str(action_label))
-        self.data["camera_rgb_optical_frame_pose"].append(rgb_optical_xyz_quat)
-        self.data["camera_depth_optical_frame_pose"].append(depth_optical_xyz_quat)
+        row["camera_rgb_optical_frame_pose"] = rgb_optical_xyz_quat
+        row["camera_depth_optical_frame_pose"] = depth_optical_xyz_quat
         #plt.figure()
         #plt.imshow(self.rgb_img)
         #plt.show()
         # print("jpg size={}, png size={}".format(sys.getsizeof(img_jpeg), sys.getsizeof(depth_png)))
-        self.data["image"].append(img_jpeg) # encoded as JPEG
-        self.data["depth_image"].append(depth_png)
-        self.data["gripper"].append(self.gripper_msg.gPO / 255.)
+        row["image"] = img_jpeg # encoded as JPEG
+        row["depth_image"] = depth_png
+        row["gripper"] = self.gripper_msg.gPO / 255.
 
         # TODO(cpaxton): verify
         if not self.task.validLabel(action_label):
             raise RuntimeError("action not recognized: " + str(action_label))
 
         action = self.task.index(action_label)
-        self.data["label"].append(action)  # integer code for high-level action
+        row["label"] = action  # integer code for high-level action
 
         # Take Mutex ---
         with self.mutex:
-            self.data["q"].append(np.copy(self.q)) # joint position
-            self.data["dq"].append(np.copy(self.dq)) # joint velocuity
-            self.data["info"].append(np.copy(self.info))  # string description of current step
-            self.data["rgb_info_D"].append(self.rgb_info.D)
-            self.data["rgb_info_K"].append(self.rgb_info.K)
-            self.data["rgb_info_R"].append(self.rgb_info.R)
-            self.data["rgb_info_P"].append(self.rgb_info.P)
-            self.data["rgb_info_distortion_model"].append(self.rgb_info.distortion_model)
-            self.data["depth_info_D"].append(self.depth_info.D)
-            self.data["depth_info_K"].append(self.depth_info.K)
-            self.data["depth_info_R"].append(self.depth_info.R)
-            self.data["depth_info_P"].append(self.depth_info.P)
-            self.data["depth_distortion_model"].append(self.depth_info.distortion_model)
+            row["q"] = np.copy(self.q) # joint position
+            row["dq"] = np.copy(self.dq) # joint velocuity
+            row["info"] = np.copy(self.info)  # string description of current step
+            row["rgb_info_D"] = self.rgb_info.D
+            row["rgb_info_K"] = self.rgb_info.K
+            row["rgb_info_R"] = self.rgb_info.R
+            row["rgb_info_P"] = self.rgb_info.P
+            row["rgb_info_distortion_model"] = self.rgb_info.distortion_model
+            row["depth_info_D"] = self.depth_info.D
+            row["depth_info_K"] = self.depth_info.K
+            row["depth_info_R"] = self.depth_info.R
+            row["depth_info_P"] = self.depth_info.P
+            row["depth_distortion_model"] = self.depth_info.distortion_model
             if self.object:
-                self.data["object"].append(np.copy(self.object))
+                row["object"] = np.copy(self.object)
             else:
-                self.data["object"].append('none')
+                row["object"] = 'none'
 
-        self.data["all_tf2_frames_as_yaml"].append(all_tf2_frames_as_yaml)
-        self.data["all_tf2_frames_from_base_link_vec_quat_xyzxyzw_json"].append(self.tf2_json)
+        row["all_tf2_frames_as_yaml"] = all_tf2_frames_as_yaml
+        row["all_tf2_frames_from_base_link_vec_quat_xyzxyzw_json"] = self.tf2_json
+        self._append_timestep(row)
 
         return True
 
 
+def encode_rgb_jpeg(cv_image, quality=None):
+    """ Encode an image from cv_bridge as jpeg bytes, quality defaults to the opencv default.
+    """
+    cv_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
+    if quality is None:
+        return cv2.imencode('.jpg', cv_image)[1].tobytes()
+    encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    return cv2.imencode('.jpg', cv_image, encode_params)[1].tobytes()
+
+
+def encode_depth_png(cv_depth_image):
+    """ Encode a 16 bit depth image in millimeters as png bytes, see encode_depth_numpy().
+    """
+    # ref: https://stackoverflow.com/a/25592959
+    # also: https://stackoverflow.com/a/17970817
+    # kinda works, but only 8 bit image....
+
+    # img_str = cv2.imencode('.png', cv_image, cv2.CV_16U)[1].tobytes()
+    # img_str = np.frombuffer(cv2.imencode('.png', cv_image)[1].tobytes(), np.uint8)
+    # doesn't work
+    # img_str = np.string_(cv2.imencode('.png', cv_image)[1].tostring())
+    # img_str = io.BytesIO(img_str).getvalue()
+    # doesn't work
+    # img_str = io.BytesIO(cv2.imencode('.png', cv_image)[1].tobytes().getvalue())
+    # These values are in mm according to:
+    # https://github.com/ros-perception/depthimage_to_laserscan/blob/indigo-devel/include/depthimage_to_laserscan/depth_traits.h#L49
+    # np_image = np.asarray(cv_image, dtype=np.uint16)
+
+    # depth_image = PIL.Image.fromarray(np_image)
+
+    # if depth_image.mode == 'I;16':
+    #     # https://github.com/python-pillow/Pillow/issues/1099
+    #     # https://github.com/arve0/leicaexperiment/blob/master/leicaexperiment/experiment.py#L560
+    #     depth_image = depth_image.convert(mode='I')
+    # max_val = np.max(np_image)
+    # min_val = np.min(np_image)
+    # print('max val: ' + str(max_val) + ' min val: ' + str(min_val))
+    # decode the data, this will take some time
+    # output = io.BytesIO()
+    # depth_image.save(output, format="PNG")
+
+    # begin 32 bit float code (too slow)
+    # cv_image = self._bridge.imgmsg_to_cv2(msg, "32FC1")
+    # # These values are in mm according to:
+    # # https://github.com/ros-perception/depthimage_to_laserscan/blob/indigo-devel/include/depthimage_to_laserscan/depth_traits.h#L49
+    # np_image = np.asarray(cv_image, dtype=np.float32) * 1000.0
+    # # max_val = np.max(np_image)
+    # # min_val = np.min(np_image)
+    # # print('max val: ' + str(max_val) + ' min val: ' + str(min_val))
+    # # decode the data, this will take some time
+    # depth_image = FloatArrayToRgbImage(np_image)
+    # output = io.BytesIO()
+    # depth_image.save(output, format="PNG")
+    # end 32 bit float code (too slow)
+
+    # convert to meters from milimeters
+    # plt.imshow(cv_image, cmap='nipy_spectral')
+    # plt.pause(.01)
+    # plt.draw()
+    # print('np_image shape: ' + str(np_image.shape))
+
+    # split into three channels
+    # np_image = np.asarray(cv_image, dtype=np.uint32) * 1000
+    # r = np.array(np.divide(np_image, 256*256), dtype=np.uint8)
+    # g = np.array(np.mod(np.divide(np_image, 256), 256), dtype=np.uint8)
+    # b = np.array(np.mod(np_image, 256), dtype=np.uint8)
+
+    # split into two channels with a third zero channel
+
+    # bytevalues = uint16_depth_image_to_png_numpy(cv_image)
+    depth_encoded_as_rgb_numpy = encode_depth_numpy(cv_depth_image)
+    return cv2.imencode('.png', depth_encoded_as_rgb_numpy)[1].tobytes()
+
+
+def encode_rgbd(cv_image, cv_depth_image):
+    """ Encode synchronized rgb and depth images, the rgb jpeg is high quality.
+    """
+    return encode_rgb_jpeg(cv_image, quality=99), encode_depth_png(cv_depth_image)
+
+
 def uint16_depth_image_to_png_numpy(cv_image):
     # split into two channels with a third zero channel
     rgb_np_image = encode_depth_numpy(cv_image)
@@ -0,0 +1,165 @@
+'''
+Encode camera frames in background threads so ROS subscriber callbacks return immediately.
+
+Image callbacks hand a raw frame and its timestamp to an ImageEncodingQueue,
+and a small pool of worker threads does the slow JPEG and PNG encoding.
+OpenCV releases the GIL while encoding, so the threads run in parallel.
+
+Each stream, such as 'rgb' or 'depth', has a bounded number of pending frames.
+When a stream is full, the drop policy chooses which frame to discard:
+
+- 'oldest' drops the oldest pending frame, which keeps the latency of the
+  newest frame low. This suits a logger that always stores the latest image.
+- 'newest' drops the incoming frame, so the frames that are kept are encoded
+  in the order they arrived.
+
+A stream can also have a maximum frame rate, which skips frames by timestamp.
+Queue depth, dropped and skipped frame counts and the encoding time of each
+stream are available from stats().
+'''
+import threading
+from collections import deque
+from timeit import default_timer
+
+
+class ImageEncodingQueue(object):
+    '''
+    A bounded queue of frames to encode, shared by a pool of worker threads.
+
+    workers: the number of encoding threads.
+    max_pending: the number of frames each stream may have waiting to be encoded.
+    drop_policy: 'oldest' or 'newest', the frame to drop when a stream is full.
+    '''
+
+    def __init__(self, workers=2, max_pending=2, drop_policy='oldest'):
+        if drop_policy not in ['oldest', 'newest']:
+            raise ValueError('ImageEncodingQueue: unsupported drop_policy: ' + str(drop_policy) +
+                             ', the options are oldest and newest')
+        self.max_pending = max_pending
+        self.drop_policy = drop_policy
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._min_period = {}
+        self._last_accepted_stamp = {}
+        self._stats = {}
+        self._closed = False
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name='image_encoding_' + str(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def set_max_rate(self, stream, rate):
+        ''' Only accept frames from stream at most rate times per second of timestamp time, None accepts all frames.
+        '''
+        with self._condition:
+            self._min_period[stream] = None if not rate else 1.0 / rate
+
+    def _new_stats(self):
+        return {'submitted': 0, 'encoded': 0, 'dropped': 0, 'skipped': 0, 'errors': 0,
+                'queue_depth': 0, 'max_queue_depth': 0, 'encode_time': 0.0, 'max_encode_time': 0.0,
+                'last_error': None}
+
+    def submit(self, stream, stamp, encode_fn, args, done_fn):
+        ''' Queue a frame to be encoded.
+
+        stream: the name of the image stream, such as 'rgb'.
+        stamp: the timestamp of the frame, a float in seconds or a rospy.Time.
+        encode_fn: called as encode_fn(*args) in a worker thread, returns the encoded frame.
+        args: the arguments to encode_fn, usually the raw image.
+        done_fn: called as done_fn(stamp, encoded) in the worker thread when encoding is done.
+
+        Returns True if the frame was queued, False if it was dropped or skipped.
+        '''
+        stamp_sec = stamp.to_sec() if hasattr(stamp, 'to_sec') else float(stamp)
+        with self._condition:
+            if self._closed:
+                return False
+            stats = self._stats.setdefault(stream, self._new_stats())
+            pending = self._pending.setdefault(stream, deque())
+            stats['submitted'] += 1
+            min_period = self._min_period.get(stream)
+            last_stamp = self._last_accepted_stamp.get(stream)
+            if min_period is not None and last_stamp is not None and stamp_sec - last_stamp < min_period:
+                stats['skipped'] += 1
+                return False
+            if len(pending) >= self.max_pending:
+                stats['dropped'] += 1
+                if self.drop_policy == 'newest':
+                    return False
+                pending.popleft()
+            self._last_accepted_stamp[stream] = stamp_sec
+            pending.append((default_timer(), stamp, encode_fn, args, done_fn))
+            stats['queue_depth'] = len(pending)
+            stats['max_queue_depth'] = max(stats['max_queue_depth'], len(pending))
+            self._condition.notify()
+        return True
+
+    def _next_frame(self):
+        ''' Wait for a frame and take the one that has waited longest from any stream, None when closed.
+        '''
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None, None
+                streams = [stream for stream, pending in self._pending.items() if pending]
+                if streams:
+                    stream = min(streams, key=lambda s: self._pending[s][0][0])
+                    frame = self._pending[stream].popleft()
+                    self._stats[stream]['queue_depth'] = len(self._pending[stream])
+                    return stream, frame
+                self._condition.wait()
+
+    def _worker(self):
+        while True:
+            stream, frame = self._next_frame()
+            if frame is None:
+                return
+            _, stamp, encode_fn, args, done_fn = frame
+            start = default_timer()
+            try:
+                encoded = encode_fn(*args)
+                done_fn(stamp, encoded)
+                error = None
+            except Exception as ex:
+                error = ex
+            encode_time = default_timer() - start
+            with self._condition:
+                stats = self._stats[stream]
+                if error is None:
+                    stats['encoded'] += 1
+                    stats['encode_time'] += encode_time
+                    stats['max_encode_time'] = max(stats['max_encode_time'], encode_time)
+                else:
+                    stats['errors'] += 1
+                    stats['last_error'] = str(error)
+
+    def stats(self, reset=False):
+        ''' Get the counters of each stream.
+
+        Returns a dictionary from stream name to a dictionary with the submitted, encoded,
+        dropped, skipped and errors frame counts, the current and max queue_depth,
+        and the mean_encode_time and max_encode_time in seconds.
+        '''
+        with self._condition:
+            all_stats = {}
+            for stream, stats in self._stats.items():
+                stats = dict(stats)
+                stats['mean_encode_time'] = stats.pop('encode_time') / max(stats['encoded'], 1)
+                all_stats[stream] = stats
+                if reset:
+                    queue_depth = self._stats[stream]['queue_depth']
+                    self._stats[stream] = self._new_stats()
+                    self._stats[stream]['queue_depth'] = queue_depth
+        return all_stats
+
+    def close(self):
+        ''' Stop the worker threads, frames which are still pending are discarded.
+        '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
@@ -22,6 +22,7 @@ from costar_hyper import hypertree_model
 from costar_hyper import block_stacking_reader
 from costar_hyper import hypertree_pose_metrics
 from threading import Lock
+from timeit import default_timer
 from cv_bridge import CvBridge, CvBridgeError
 from sensor_msgs.msg import Image
 from ctp_integration.ros_geometry import pose_to_vec_quat_list
@@ -61,6 +62,10 @@ flags.DEFINE_string('default_action', '5',
     'default action if no action has been'
     ' received from ROS on the topic /costar/action_label_current.'
     ' The default 5 means grab_blue.')
+flags.DEFINE_boolean('fused_inference', True,
+    'Run the translation and rotation models as a single fused keras model,'
+    ' so each prediction is one forward pass with a single input feed,'
+    ' and prepare the network input images as they arrive in the rgb callback.')
 
 FLAGS = flags.FLAGS
 
@@ -119,6 +124,7 @@ class CostarHyperPosePredictor(object):
             image_shape=(224, 224, 3),
             force_action=None,
             default_action=None,
+            fused_inference=None,
             verbose=0):
 
         if load_rotation_weights is None:
@@ -137,6 +143,8 @@ class CostarHyperPosePredictor(object):
             rotation_problem_type = FLAGS.rotation_problem_type
         if force_action is None:
             force_action = FLAGS.force_action
+        if fused_inference is None:
+            fused_inference = FLAGS.fused_inference
 
         self.using_default_action = True
         if force_action is not None:
@@ -156,11 +164,20 @@ class CostarHyperPosePredictor(object):
         self.data_features_to_extract = data_features_to_extract
         self.need_clear_view_rgb_img = True
         self.clear_view_rgb_img = None
+        # images already scaled to the network input range, see _rgbCb()
+        self.fused_inference = fused_inference
+        self.preprocessed_rgb_img = None
+        self.preprocessed_clear_view_rgb_img = None
+        # pose looked up at the time of the latest rgb image, or None
+        self.rgb_ee_xyz_quat = None
+        # per stage latency, see get_latency_stats()
+        self.latency = {}
 
         self.rotation_problem_type = rotation_problem_type
         self.translation_problem_type = translation_problem_type
         self.verbose = verbose
         self.mutex = Lock()
+        self.latency_mutex = Lock()
         self.image_shape = image_shape
         self._initialize_ros(robot_config, tf_buffer, tf_listener)
 
@@ -181,6 +198,70 @@ class CostarHyperPosePredictor(object):
                 load_weights=translation_weights_path,
                 load_hyperparams=translation_hyperparams_path,
                 top=top)
+        self.fused_model = None
+        if self.fused_inference:
+            self.fused_model = self._initialize_fused_model()
+
+    def _initialize_fused_model(self):
+        """ Combine the translation and rotation models into one model with both outputs.
+
+        The two models are trained separately, so each keeps its own weights,
+        but one predict_on_batch() call runs both in a single session run.
+        When both models take the same input features the inputs are shared,
+        so the encoded input only needs to be fed once.
+        """
+        input_shapes = [keras.backend.int_shape(x) for x in self.translation_model.inputs]
+        self.fused_shared_inputs = (
+            self.translation_data_features == self.rotation_data_features and
+            input_shapes == [keras.backend.int_shape(x) for x in self.rotation_model.inputs])
+        translation_inputs = [keras.layers.Input(batch_shape=shape) for shape in input_shapes]
+        if self.fused_shared_inputs:
+            rotation_inputs = translation_inputs
+        else:
+            rotation_inputs = [keras.layers.Input(batch_shape=keras.backend.int_shape(x))
+                               for x in self.rotation_model.inputs]
+        translation_outputs = self.translation_model(translation_inputs)
+        rotation_outputs = self.rotation_model(rotation_inputs)
+        inputs = translation_inputs
+        if not self.fused_shared_inputs:
+            inputs = translation_inputs + rotation_inputs
+        fused_model = keras.models.Model(inputs=inputs, outputs=[translation_outputs, rotation_outputs])
+        print('costar_hyper_prediction.py: fused translation and rotation model created, shared inputs: ' +
+              str(self.fused_shared_inputs))
+        return fused_model
+
+    def _record_latency(self, stage, seconds):
+        """ Add the seconds spent in one stage of the prediction pipeline to the latency stats.
+        """
+        with self.latency_mutex:
+            count, total, maximum, _ = self.latency.get(stage, (0, 0.0, 0.0, 0.0))
+            self.latency[stage] = (count + 1, total + seconds, max(maximum, seconds), seconds)
+
+    def get_latency_stats(self, reset=False):
+        """ Get the latency of each prediction stage in seconds.
+
+        Stages are image_decode and image_encode, which run in _rgbCb() as each image arrives,
+        then transform, encode, forward and decode_pose, which run in __call__().
+
+        # Returns
+
+        A dictionary from stage name to a dictionary with the count, mean, max and last latency.
+        """
+        with self.latency_mutex:
+            stats = {}
+            for stage, (count, total, maximum, last) in self.latency.items():
+                stats[stage] = {'count': count, 'mean': total / count, 'max': maximum, 'last': last}
+            if reset:
+                self.latency = {}
+        return stats
+
+    def get_latency_string(self):
+        """ Get a one line summary of the mean latency of each stage in milliseconds.
+        """
+        stats = self.get_latency_stats()
+        stages = ['image_decode', 'image_encode', 'transform', 'encode', 'forward', 'decode_pose']
+        return ', '.join('{}: {:.1f} ms'.format(stage, stats[stage]['mean'] * 1000.0)
+                         for stage in stages if stage in stats)
 
     def _initialize_hypertree_model_for_inference(
             self,
@@ -372,6 +453,7 @@ class CostarHyperPosePredictor(object):
         try:
             # max out at 10 hz assuming 30hz data source
             if msg.header.seq % 3 == 0:
+                start_time = default_timer()
                 cv_image = self._bridge.imgmsg_to_cv2(msg, "rgb8")
                 # decode the data, this will take some time
 
@@ -383,13 +465,26 @@ class CostarHyperPosePredictor(object):
                 # Resize to match what is expected of the neural network
                 if self.image_shape is not None:
                     rgb_img = resize(rgb_img, self.image_shape, mode='constant', preserve_range=True)
+                decode_time = default_timer()
+                self._record_latency('image_decode', decode_time - start_time)
+
+                preprocessed_rgb_img = None
+                ee_xyz_quat = None
+                if self.fused_inference:
+                    # prepare the network input now so predictions don't wait for it
+                    preprocessed_rgb_img = block_stacking_reader.preprocess_images([rgb_img])[0]
+                    ee_xyz_quat = self._lookup_transform_once(msg.header.stamp)
+                    self._record_latency('image_encode', default_timer() - decode_time)
 
                 with self.mutex:
                     self.rgb_time = msg.header.stamp
                     # print('rgb_time stamp: ' + str(msg.header.stamp))
                     self.rgb_img = rgb_img
+                    self.preprocessed_rgb_img = preprocessed_rgb_img
+                    self.rgb_ee_xyz_quat = ee_xyz_quat
                     if self.need_clear_view_rgb_img or self.clear_view_rgb_img is None:
                         self.clear_view_rgb_img = rgb_img
+                        self.preprocessed_clear_view_rgb_img = preprocessed_rgb_img
                         self.clear_view_rgb_time = msg.header.stamp
                         self.need_clear_view_rgb_img = False
 
@@ -402,6 +497,22 @@ class CostarHyperPosePredictor(object):
         with self.mutex:
             self.need_clear_view_rgb_img = True
 
+    def _lookup_transform_once(self, stamp):
+        """ Try to get the end effector pose at the time of an image without waiting or retrying.
+
+        # Returns
+
+        The pose as an [x, y, z, qx, qy, qz, qw] list, or None if the transform is not available yet.
+        """
+        if not hasattr(self, 'ee_frame'):
+            # images can arrive before _initialize_ros() is done
+            return None
+        try:
+            ee_pose = self.tf_buffer.lookup_transform(self.base_link, self.ee_frame, stamp)
+        except (tf2.LookupException, tf2.ExtrapolationException, tf2.ConnectivityException):
+            return None
+        return pose_to_vec_quat_list(ee_pose)
+
     def get_latest_transform(self, from_frame=None, to_frame=None, preferred_time=None, max_attempts=10, backup_timestamp_attempts=4):
         """
         # Arguments
@@ -470,10 +581,17 @@ class CostarHyperPosePredictor(object):
     def __call__(self):
         """ Make the prediction and return the predicted pose
         """
+        start_time = default_timer()
         with self.mutex:
             rgb_images = [self.rgb_img]
             rgb_time = self.rgb_time
             clear_view_rgb_images = [self.clear_view_rgb_img]
+            preprocessed = (self.fused_inference and self.preprocessed_rgb_img is not None and
+                            self.preprocessed_clear_view_rgb_img is not None)
+            if preprocessed:
+                rgb_images = [self.preprocessed_rgb_img]
+                clear_view_rgb_images = [self.preprocessed_clear_view_rgb_img]
+            ee_xyz_quat = self.rgb_ee_xyz_quat
             action_labels = np.copy(self.action_labels)
             if self.using_default_action:
                 rospy.logwarn_throttle(
@@ -481,7 +599,11 @@ class CostarHyperPosePredictor(object):
                     'CostarHyperPosePredictor Warning: no user specified action received, '
                     'using default action: ' + str(self.action_labels))
 
-        ee_xyz_quat, input_example_time = self.get_latest_transform(preferred_time=rgb_time)
+        if ee_xyz_quat is not None:
+            # the pose at the image time was already found in _rgbCb()
+            input_example_time = rgb_time
+        else:
+            ee_xyz_quat, input_example_time = self.get_latest_transform(preferred_time=rgb_time)
         if input_example_time != rgb_time:
                 rospy.logwarn_throttle(
                     10.0,
@@ -489,30 +611,54 @@ class CostarHyperPosePredictor(object):
                     ' so we are using the backup time: ' + str(input_example_time) +
                     ' This means the data used in the costar_hyper_prediction may '
                     ' be synchronized less accurately.')
-        # encode the prediction information
-        X = block_stacking_reader.encode_action_and_images(
-                self.translation_data_features,
-                poses=[ee_xyz_quat],
-                action_labels=action_labels,
-                init_images=clear_view_rgb_images,
-                current_images=rgb_images)
-
-        translation_predictions = self.translation_model.predict_on_batch(X)
+        transform_time = default_timer()
+        self._record_latency('transform', transform_time - start_time)
 
         # encode the prediction information
         X = block_stacking_reader.encode_action_and_images(
-                self.rotation_data_features,
+                self.translation_data_features,
                 poses=[ee_xyz_quat],
                 action_labels=action_labels,
                 init_images=clear_view_rgb_images,
-                current_images=rgb_images)
-
-        rotation_predictions = self.rotation_model.predict_on_batch(X)
+                current_images=rgb_images,
+                images_preprocessed=preprocessed)
+
+        if self.fused_model is not None:
+            if not self.fused_shared_inputs:
+                X = list(X) + list(block_stacking_reader.encode_action_and_images(
+                    self.rotation_data_features,
+                    poses=[ee_xyz_quat],
+                    action_labels=action_labels,
+                    init_images=clear_view_rgb_images,
+                    current_images=rgb_images,
+                    images_preprocessed=preprocessed))
+            encode_time = default_timer()
+            translation_predictions, rotation_predictions = self.fused_model.predict_on_batch(X)
+        else:
+            encode_time = default_timer()
+            translation_predictions = self.translation_model.predict_on_batch(X)
+
+            # encode the prediction information
+            rotation_encode_time = default_timer()
+            X = block_stacking_reader.encode_action_and_images(
+                    self.rotation_data_features,
+                    poses=[ee_xyz_quat],
+                    action_labels=action_labels,
+                    init_images=clear_view_rgb_images,
+                    current_images=rgb_images)
+            # don't count the second encoding as forward pass time
+            encode_time += default_timer() - rotation_encode_time
+
+            rotation_predictions = self.rotation_model.predict_on_batch(X)
+        forward_time = default_timer()
+        self._record_latency('encode', encode_time - transform_time)
+        self._record_latency('forward', forward_time - encode_time)
         rospy.loginfo_throttle(10.0,
             'encoded translation predictions: ' + str(translation_predictions) +
             ' encoded rotation predictions: ' + str(rotation_predictions))
         tr_predictions = np.concatenate([translation_predictions[0], rotation_predictions[0]])
         prediction_xyz_qxyzw = hypertree_pose_metrics.decode_xyz_aaxyz_nsc_to_xyz_qxyzw(tr_predictions)
+        self._record_latency('decode_pose', default_timer() - forward_time)
         rospy.loginfo_throttle(10.0,
             'decoded prediction_xyz_qxyzw: ' + str(prediction_xyz_qxyzw))
 
@@ -577,7 +723,9 @@ def main(_):
         # figure out where the time has gone
         time_str = ('Total tick + log time: {:04} sec, '
                     'Robot Prediction: {:04} sec, '
-                    'Sending Results: {:04} sec'.format(update_time - start_time, tick_time - start_time, update_time - tick_time))
+                    'Sending Results: {:04} sec, '
+                    'Prediction stages: {}'.format(update_time - start_time, tick_time - start_time, update_time - tick_time,
+                                                   predictor.get_latency_string()))
         verify_update_rate(update_time_remaining=rate.remaining(), update_rate=update_rate, info=time_str)
         progbar.update()
 
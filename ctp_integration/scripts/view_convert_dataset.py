@@ -16,6 +16,11 @@ Preprocess data that was just collected to include action labels
 
     export CUDA_VISIBLE_DEVICES="" && python2 ctp_integration/scripts/view_convert_dataset.py --path "~/.keras/datasets/costar_plush_block_stacking_dataset_v0.4/" --preprocess_inplace gripper_action --write
 
+Preprocess or convert a whole dataset non-interactively in a pool of processes,
+each file is updated atomically and label only passes never decode images:
+
+    python2 ctp_integration/scripts/view_convert_dataset.py --path "~/.keras/datasets/costar_block_stacking_dataset_v0.4/" --preprocess_inplace gripper_action --write --batch --processes 8
+
 Relabel "success" data in a dataset:
 
     python2 ctp_integration/scripts/view_convert_dataset.py --path ~/.keras/datasets/costar_block_stacking_dataset_v0.4 --label_correction --fps 60 --ignore_failure --ignore_error
@@ -24,7 +29,10 @@ Relabel "success" data in a dataset:
 import argparse
 import os
 import sys
+import time
+import shutil
 import traceback
+from multiprocessing import Pool
 import numpy as np
 import h5py
 import matplotlib.pyplot as plt
@@ -144,8 +152,8 @@ def GetPng(img):
     return output.getvalue()
 
 
-def JpegToNumpy(jpeg):
-    if tf is not None:
+def JpegToNumpy(jpeg, use_tf=True):
+    if tf is not None and use_tf:
         image = tf.image.decode_jpeg(jpeg)
     else:
         stream = io.BytesIO(jpeg)
@@ -153,7 +161,7 @@ def JpegToNumpy(jpeg):
     return np.asarray(image, dtype=np.uint8)
 
 
-def ConvertImageListToNumpy(data, format='numpy', data_format='NHWC', dtype=np.uint8):
+def ConvertImageListToNumpy(data, format='numpy', data_format='NHWC', dtype=np.uint8, use_tf=True):
     """ Convert a list of binary jpeg or png files to numpy format.
 
     # Arguments
@@ -161,10 +169,11 @@ def ConvertImageListToNumpy(data, format='numpy', data_format='NHWC', dtype=np.u
     data: a list of binary jpeg images to convert
     format: default 'numpy' returns a 4d numpy array,
         'list' returns a list of 3d numpy arrays
+    use_tf: decode with tensorflow when it is available, otherwise PIL is used.
     """
     images = []
     for raw in data:
-        img = JpegToNumpy(raw)
+        img = JpegToNumpy(raw, use_tf=use_tf)
         if data_format == 'NCHW':
             img = np.transpose(img, [2, 0, 1])
         images.append(img)
@@ -280,6 +289,14 @@ def _parse_args():
                                    the action label that the robot was supposed to do at the time frame.
                                 2. Checks the action labels stored in each file for inconsistent ordering.
                              ''')
+    parser.add_argument("--batch", action='store_true', default=False,
+                        help='Non-interactive batch mode for --preprocess_inplace, --convert, --print and --gripper. '
+                             'Files are processed in a pool of --processes worker processes, '
+                             'images are only decoded for --convert, and with --write each file '
+                             'is modified in a temporary copy which then atomically replaces the original. '
+                             'A progress bar and a throughput summary are printed.')
+    parser.add_argument("--processes", type=int, default=None,
+                        help='Number of worker processes for --batch, defaults to the number of cpus.')
 
     return vars(parser.parse_args())
 
@@ -357,6 +374,9 @@ def save_label_correction_csv_file(label_correction_csv_path, label_correction_t
 
 def main(args, root="root"):
 
+    if args['batch']:
+        return batch_main(args)
+
     clip = None
     label_correction_table = None
     path = os.path.expanduser(args['path'])
@@ -582,81 +602,30 @@ def main(args, root="root"):
                     for data_str in data_to_print:
                         progress_bar.write(filename + ' ' + data_str + ': ' + str(list(data[data_str])))
 
-                if args['preprocess_inplace'] == 'gripper_action':
-                    if 'gripper' not in data or 'label' not in data:
+                if args['preprocess_inplace']:
+                    try:
+                        new_datasets = preprocess_inplace_datasets(data, args['preprocess_inplace'])
+                    except KeyError as ex:
                         progress_bar.write('Skipping file because the feature string '
-                                           'gripper  and/or label is not present: ' +
-                                           str(filename))
+                                           'is not present: ' + str(ex) + ' ' + str(filename))
                         continue
-                    # if 'label' in data:
-                    #     progress_bar.write("frames ", len(list(data['label'])))
-                    # generate new action labels based on when the gripper opens and closes
-                    gripper_action_label, gripper_action_goal_idx = generate_gripper_action_label(data)
-                    # add the new action label and goal indices based on when the gripper opens/closes
                     if args['write']:
                         # cannot write without deleting existing data
-                        if "gripper_action_label" in list(data.keys()):
-                                progress_bar.write('Deleting existing gripper action labels for file: ' + str(filename))
-                                del data['gripper_action_label']
-                                del data['gripper_action_goal_idx']
-
-                        data['gripper_action_label'], data['gripper_action_goal_idx'] = np.array(gripper_action_label), np.array(gripper_action_goal_idx)
-                        # progress_bar.write("data on file",list(data['gripper_action_goal_idx']))
+                        for key, value in new_datasets.items():
+                            if key in list(data.keys()):
+                                progress_bar.write('Deleting existing ' + key + ' for file: ' + str(filename))
+                                del data[key]
+                            data[key] = value
+                        progress_bar.write('Wrote ' + str(list(new_datasets.keys())) + ' to file: ' + str(filename))
                     else:
                         progress_bar.write(
-                            'gripper_action_label test run, use --write to change the files in place. gripper_action_label: ' +
-                            str(gripper_action_label) + ' gripper_action_goal_idx: ' + str(gripper_action_goal_idx))
+                            args['preprocess_inplace'] + ' test run, use --write to change the files in place. ' +
+                            str(new_datasets))
 
                     # skip other steps like video viewing,
                     # so this conversion runs 1000x faster
                     continue
 
-                if args['preprocess_inplace'] == 'pose_gripper_center':
-                    # Check dependency
-                    if sva == None or eigen == None:
-                        raise ValueError(
-                            'Trying to do tf calculation, but sva or eigen is not available!'
-                            'To install run the script at'
-                            'https://github.com/ahundt/robotics_setup/blob/master/robotics_tasks.sh'
-                            'or follow the instructions at https://github.com/jrl-umi3218/Eigen3ToPython'
-                            'and https://github.com/jrl-umi3218/SpaceVecAlg and make sure python bindings'
-                            'are enabled.')
-                    
-                    # Check column existence
-                    if 'pose' not in data:
-                        progress_bar.write('Skipping file because the feature string '
-                                           'pose is not present: ' +
-                                           str(filename))
-                        continue
-                    
-                    ee_link_poses = data['pose']
-                    gripper_center_poses = np.zeros(ee_link_poses.shape, dtype=ee_link_poses.dtype)
-                    
-                    for i in range(len(ee_link_poses)):
-                        tf_ee_link = vector_quaternion_array_to_ptransform(ee_link_poses[i])
-                        tf_gripper_center = apply_static_tf_to_gripper_center(tf_ee_link)
-                        gripper_center_poses[i] = ptransform_to_vector_quaternion_array(tf_gripper_center)
-                        
-                        # uncomment for verbose output
-                        #progress_bar.write(
-                        #    'Processed datapoint[' + str(i) + ']: ' +
-                        #    '\nee_link = ' + str(ee_link_poses[i]) + 
-                        #    '\ngripper_center = ' + str(gripper_center_poses[i])
-                        #    )
-                        
-                    if args['write']:
-                        # Delete existing column, if there is one already
-                        if 'pose_gripper_center' in list(data.keys()):
-                            del data['pose_gripper_center']
-                        # Write the data 
-                        data['pose_gripper_center'] = gripper_center_poses
-                        progress_bar.write("Writing gripper_center dataset to file:" + str(filename))
-                    else:
-                        progress_bar.write('pose_gripper_center test run. Use --write to actually write to the h5f file(s).')
-                    # skip other steps like video viewing,
-                    # so this conversion runs 1000x faster
-                    continue
-
                 if args['goal_to_jpeg']:
                     # Visit all the goal timesteps and write out a jpeg file in the 'goal_images' folder
                     progress_bar.write('-' * 80)
@@ -893,6 +862,210 @@ def label_correction(
     return label_correction_table
 
 
+def preprocess_inplace_datasets(data, preprocess_inplace):
+    """ Compute the new datasets for --preprocess_inplace from an open h5f file.
+
+    Only the label and pose datasets are read, the images are never decoded.
+
+    # Arguments
+
+    data: The open h5f file.
+    preprocess_inplace: 'gripper_action' or 'pose_gripper_center', see _parse_args().
+
+    # Returns
+
+    A dictionary from dataset name to the numpy array to write.
+    Raises KeyError if a dataset needed for preprocess_inplace is missing.
+    """
+    if preprocess_inplace == 'gripper_action':
+        for key in ['gripper', 'label']:
+            if key not in data:
+                raise KeyError(key)
+        # generate new action labels based on when the gripper opens and closes
+        gripper_action_label, gripper_action_goal_idx = generate_gripper_action_label(data)
+        # add the new action label and goal indices based on when the gripper opens/closes
+        return {'gripper_action_label': np.array(gripper_action_label),
+                'gripper_action_goal_idx': np.array(gripper_action_goal_idx)}
+    elif preprocess_inplace == 'pose_gripper_center':
+        # Check dependency
+        if sva == None or eigen == None:
+            raise ValueError(
+                'Trying to do tf calculation, but sva or eigen is not available!'
+                'To install run the script at'
+                'https://github.com/ahundt/robotics_setup/blob/master/robotics_tasks.sh'
+                'or follow the instructions at https://github.com/jrl-umi3218/Eigen3ToPython'
+                'and https://github.com/jrl-umi3218/SpaceVecAlg and make sure python bindings'
+                'are enabled.')
+        # Check column existence
+        if 'pose' not in data:
+            raise KeyError('pose')
+
+        ee_link_poses = np.array(data['pose'])
+        gripper_center_poses = np.zeros(ee_link_poses.shape, dtype=ee_link_poses.dtype)
+
+        for i in range(len(ee_link_poses)):
+            tf_ee_link = vector_quaternion_array_to_ptransform(ee_link_poses[i])
+            tf_gripper_center = apply_static_tf_to_gripper_center(tf_ee_link)
+            gripper_center_poses[i] = ptransform_to_vector_quaternion_array(tf_gripper_center)
+
+            # uncomment for verbose output
+            #progress_bar.write(
+            #    'Processed datapoint[' + str(i) + ']: ' +
+            #    '\nee_link = ' + str(ee_link_poses[i]) +
+            #    '\ngripper_center = ' + str(gripper_center_poses[i])
+            #    )
+        return {'pose_gripper_center': gripper_center_poses}
+    raise ValueError('Unsupported --preprocess_inplace option: ' + str(preprocess_inplace))
+
+
+def write_datasets_atomically(example_filename, new_datasets):
+    """ Replace or add datasets in an h5f file so that the file is either fully updated or untouched.
+
+    The changes are made to a temporary copy in the same folder, which is then renamed over the original.
+    The temporary name starts with '.' and doesn't contain '.h5f' so dataset scans ignore it.
+    """
+    folder, name = os.path.split(example_filename)
+    tmp_filename = os.path.join(folder, '.' + name.replace('.h5f', '') + '.inplace_tmp')
+    try:
+        shutil.copy2(example_filename, tmp_filename)
+        with h5py.File(tmp_filename, 'r+') as data:
+            for key, value in new_datasets.items():
+                if key in data:
+                    del data[key]
+                data[key] = value
+        os.rename(tmp_filename, example_filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def batch_skip_reason(filename, args):
+    """ Get the reason to skip a file in --batch mode based on the command line filters, or None.
+    """
+    if os.path.basename(filename).startswith('.') or '.h5' not in filename:
+        return 'not an h5f file'
+    if args['success_only'] and 'success' not in filename:
+        return 'not labeled success'
+    if args['ignore_error'] and 'error' in filename:
+        return 'contains errors'
+    if args['ignore_failure'] and 'failure' in filename:
+        return 'contains failure'
+    if args['ignore_success'] and 'success' in filename:
+        return 'contains success'
+    return None
+
+
+def batch_process_file(job):
+    """ Process one file in --batch mode, this runs in a worker process.
+
+    # Returns
+
+    A dictionary with the filename, the status 'ok', 'skipped' or 'error',
+    the number of frames processed and a message.
+    """
+    example_filename, args = job
+    result = {'filename': example_filename, 'status': 'ok', 'frames': 0, 'message': ''}
+    try:
+        new_datasets = None
+        with h5py.File(example_filename, 'r') as data:
+            messages = []
+            if args['gripper']:
+                messages.append('gripper: ' + str(list(data['gripper'])))
+            if args['print']:
+                for data_str in args['print'].split(','):
+                    messages.append(data_str + ': ' + str(list(data[data_str])))
+            if 'label' in data:
+                result['frames'] = len(data['label'])
+            if args['preprocess_inplace']:
+                try:
+                    new_datasets = preprocess_inplace_datasets(data, args['preprocess_inplace'])
+                except KeyError as ex:
+                    result['status'] = 'skipped'
+                    result['message'] = 'the feature string is not present: ' + str(ex)
+                    return result
+                if not args['write']:
+                    messages.append('test run, use --write to change the files in place: ' + str(new_datasets))
+            elif args['convert']:
+                fps = args['fps']
+                start_frame = args['preview_initial_frame']
+                end_frame = args['preview_final_frame']
+                load_depth = args['depth'] and 'depth_image' in data and len(data['depth_image']) > 0
+                load_rgb = args['rgb'] and 'image' in data and len(data['image']) > 0
+                clip = None
+                # tensorflow is not fork safe, so decode with PIL in the workers
+                if load_depth:
+                    depth_images = ConvertImageListToNumpy(
+                        np.squeeze(list(data['depth_image'][start_frame:end_frame])), format='list', use_tf=False)
+                    result['frames'] = len(depth_images)
+                    clip = depth_clip = mpye.ImageSequenceClip(depth_images, fps=fps)
+                if load_rgb:
+                    rgb_images = ConvertImageListToNumpy(
+                        np.squeeze(list(data['image'][start_frame:end_frame])), format='list', use_tf=False)
+                    result['frames'] = len(rgb_images)
+                    clip = rgb_clip = mpye.ImageSequenceClip(rgb_images, fps=fps)
+                if load_depth and load_rgb:
+                    clip = mpye.clips_array([[rgb_clip, depth_clip]])
+                if clip is None:
+                    result['status'] = 'skipped'
+                    result['message'] = 'no images to convert'
+                    return result
+                save_filename = example_filename.replace('.h5f', '.' + args['convert'])
+                if 'gif' in args['convert']:
+                    clip.write_gif(save_filename, fps=fps)
+                else:
+                    clip.write_videofile(save_filename, fps=fps)
+            result['message'] = '\n'.join(messages)
+        if new_datasets is not None and args['write']:
+            write_datasets_atomically(example_filename, new_datasets)
+            result['message'] = 'wrote ' + str(sorted(new_datasets.keys()))
+    except Exception as ex:
+        result['status'] = 'error'
+        result['message'] = str(type(ex).__name__) + ': ' + str(ex)
+    return result
+
+
+def batch_main(args):
+    """ Run --preprocess_inplace, --convert, --print or --gripper on every file in a pool of processes.
+    """
+    if args['label_correction'] or args['label_correction_reconfirm'] or args['goal_to_jpeg'] or args['preview']:
+        raise ValueError('--batch only supports --preprocess_inplace, --convert, --print and --gripper, '
+                         'label correction, goal_to_jpeg and preview need the interactive mode.')
+    path = os.path.expanduser(args['path'])
+    if '.h5f' in path:
+        filenames = [path]
+    elif os.path.isdir(path):
+        filenames = [os.path.join(path, filename) for filename in sorted(os.listdir(path))]
+    else:
+        filenames = sorted(glob.glob(path))
+    jobs = []
+    skipped = 0
+    for filename in filenames:
+        reason = batch_skip_reason(filename, args)
+        if reason is None:
+            jobs.append((filename, args))
+        elif '.h5' in filename:
+            skipped += 1
+
+    counts = {'ok': 0, 'skipped': 0, 'error': 0}
+    frames = 0
+    start_time = time.time()
+    pool = Pool(args['processes'])
+    progress_bar = tqdm(pool.imap_unordered(batch_process_file, jobs), total=len(jobs))
+    for result in progress_bar:
+        counts[result['status']] += 1
+        frames += result['frames']
+        if result['status'] != 'ok' or result['message']:
+            progress_bar.write(result['status'] + ' ' + result['filename'] + ': ' + result['message'])
+    pool.close()
+    pool.join()
+    elapsed = time.time() - start_time
+    print('Batch complete: {} files ok, {} skipped, {} errors, {} filtered out by the command line options. '
+          '{:.1f} sec, {:.2f} files/sec, {:.1f} frames/sec'.format(
+              counts['ok'], counts['skipped'], counts['error'], skipped,
+              elapsed, len(jobs) / max(elapsed, 1e-6), frames / max(elapsed, 1e-6)))
+    return counts
+
+
 def generate_gripper_action_label(data):
     """ generate new action labels and goal action indices based on the gripper open/closed state
 